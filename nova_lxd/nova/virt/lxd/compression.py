@@ -0,0 +1,68 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import tarfile
+
+from nova import exception
+from nova import i18n
+
+from oslo_config import cfg
+
+_ = i18n._
+
+CONF = cfg.CONF
+
+# Compression formats of a published image and the tarfile mode that
+# reads them.
+FORMATS = {
+    'xz': 'xz',
+    'pxz': 'xz',
+    'pigz': 'gz',
+    'zstd': None,
+}
+
+
+def get_publish_algorithm():
+    """Return the compression_algorithm to request on publish
+
+    LXD runs the named command to compress a published image and
+    does not take arguments with it. pigz and pxz compress on every
+    CPU by default, which is what makes them worth picking.
+
+    :return: compressor name, or None for the LXD default
+    """
+    return CONF.lxd.image_compressor or None
+
+
+def is_readable(name):
+    """Tell whether tarfile can read an image compressed by name"""
+    mode = FORMATS.get(name)
+    return mode is not None and mode in tarfile.TarFile.OPEN_METH
+
+
+def check_config():
+    """Reject a compressor that delta snapshots cannot read
+
+    Delta snapshots read the published image with tarfile, which
+    knows nothing of zstd, nor of xz on python 2.7.
+
+    :raises: NovaException
+    """
+    name = CONF.lxd.image_compressor
+    if name and CONF.lxd.snapshot_delta and not is_readable(name):
+        raise exception.NovaException(
+            _('image_compressor %s produces images that delta snapshots '
+              'cannot read, pick another compressor or disable '
+              'snapshot_delta') % name)
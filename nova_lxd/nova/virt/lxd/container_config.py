@@ -30,6 +30,9 @@ from oslo_utils import fileutils
 from oslo_utils import units
 import six
 
+from nova_lxd.nova.virt.lxd import container_disk
+from nova_lxd.nova.virt.lxd import cpuset
+from nova_lxd.nova.virt.lxd import numa
 from nova_lxd.nova.virt.lxd.session import session
 from nova_lxd.nova.virt.lxd import utils as container_dir
 from nova_lxd.nova.virt.lxd import vif
@@ -49,6 +52,7 @@ class LXDContainerConfig(object):
         self.container_dir = container_dir.LXDContainerDirectories()
         self.session = session.LXDAPISession()
         self.vif_driver = vif.LXDGenericDriver()
+        self.disk = container_disk.LXDContainerDisk()
 
     def _init_container_config(self):
         config = {}
@@ -111,17 +115,170 @@ class LXDContainerConfig(object):
         LOG.debug('Configure LXD container config')
 
         ''' Set the limits. '''
-        flavor = instance.flavor
-        mem = flavor.memory_mb * units.Mi
-
-        if mem >= 0:
-            self.add_config(container_config, 'config', 'limits.memory',
-                            data='%s' % mem)
+        limits = self.get_container_limits(instance, instance.flavor)
+        for key, value in sorted(limits.items()):
+            self.add_config(container_config, 'config', key, data=value)
+        root_device = self.get_container_root_device(instance.flavor)
+        if root_device:
+            self.add_config(container_config, 'devices', 'root',
+                            data=root_device)
 
         ''' Basic container configuration. '''
         self.add_config(container_config, 'config', 'raw.lxc',
-                        data='lxc.console.logfile=%s\n'
-                        % self.container_dir.get_console_path(instance.name))
+                        data=self.get_container_raw_lxc(instance))
+        return container_config
+
+    def get_container_raw_lxc(self, instance):
+        """Return the raw LXC configuration of a container
+
+        Besides the console log, a container placed in NUMA cells only
+        allocates memory from the nodes of those cells.
+        """
+        raw_lxc = ('lxc.console.logfile=%s\n'
+                   % self.container_dir.get_console_path(instance.name))
+        placement = numa.get_placement(instance.numa_topology)
+        if placement:
+            raw_lxc += ('lxc.cgroup.cpuset.mems=%s\n'
+                        % ','.join('%d' % mem for mem in sorted(placement[1])))
+        return raw_lxc
+
+    def get_container_limits(self, instance, flavor):
+        """Return the LXD limits that enforce a flavor
+
+        The container gets as many CPUs as the flavor has vcpus. A
+        container placed in NUMA cells by the resource tracker gets
+        that many CPUs of those cells instead; this is also how
+        hw:cpu_policy=dedicated flavors get their pinned host CPUs,
+        since the host reports its NUMA topology. The quota:cpu_quota
+        and quota:cpu_period extra specs, in microseconds, cap the CPU
+        time it gets, and lxd:cpu_priority (0 to 10) weighs it against
+        other containers.
+
+        :param instance: nova instance
+        :param flavor: nova flavor
+        :return: dictionary of LXD config keys
+        """
+        limits = {}
+        mem = flavor.memory_mb * units.Mi
+        if mem >= 0:
+            limits['limits.memory'] = '%s' % mem
+
+        extra_specs = flavor.extra_specs
+        placement = numa.get_placement(instance.numa_topology)
+        if flavor.vcpus > 0:
+            if placement:
+                limits['limits.cpu'] = cpuset.format_cpuset(placement[0])
+            else:
+                limits['limits.cpu'] = '%d' % flavor.vcpus
+
+        quota = int(extra_specs.get('quota:cpu_quota', 0))
+        if quota > 0:
+            period = int(extra_specs.get('quota:cpu_period', 100000))
+            limits['limits.cpu.allowance'] = '%dus/%dus' % (quota, period)
+
+        priority = extra_specs.get('lxd:cpu_priority')
+        if priority is not None:
+            limits['limits.cpu.priority'] = '%d' % int(priority)
+        return limits
+
+    def get_container_root_device(self, flavor):
+        """Return the root disk device that enforces a flavor
+
+        The root_gb of the flavor becomes the size of the root device
+        on storage backends where LXD enforces it. The
+        quota:disk_read_*, quota:disk_write_* and quota:disk_total_*
+        extra specs, per second, become its limits.read and
+        limits.write, the total ones applying to both directions
+        unless overridden. LXD takes a single limit per direction, so a
+        bytes limit wins over an IOPS one.
+
+        :param flavor: nova flavor
+        :return: LXD disk device, or None when the flavor sets no limits
+        """
+        extra_specs = flavor.extra_specs
+
+        def _get_limit(name):
+            bytes_sec = int(extra_specs.get(
+                'quota:disk_%s_bytes_sec' % name, 0))
+            iops_sec = int(extra_specs.get(
+                'quota:disk_%s_iops_sec' % name, 0))
+            if bytes_sec > 0:
+                return '%d' % bytes_sec
+            if iops_sec > 0:
+                return '%diops' % iops_sec
+            return None
+
+        total = _get_limit('total')
+        device = {}
+        for name in ('read', 'write'):
+            limit = _get_limit(name) or total
+            if limit:
+                device['limits.%s' % name] = limit
+        if flavor.root_gb > 0 and self.disk.supports_quota():
+            device['size'] = '%d' % (flavor.root_gb * units.Gi)
+        if not device:
+            return None
+        device.update({'path': '/', 'type': 'disk'})
+        return device
+
+    def get_network_limits(self, flavor):
+        """Return the NIC limits that enforce a flavor
+
+        The quota:vif_inbound_average and quota:vif_outbound_average
+        extra specs, in KiB/s as with libvirt, become the limits.ingress
+        and limits.egress of the NIC, which LXD applies with tc on the
+        host side veth. LXD has no peak or burst setting, so the other
+        quota:vif_* specs are not used.
+
+        :param flavor: nova flavor
+        :return: dictionary of LXD NIC device keys
+        """
+        limits = {}
+        for direction, key in (('inbound', 'limits.ingress'),
+                               ('outbound', 'limits.egress')):
+            average = int(flavor.extra_specs.get(
+                'quota:vif_%s_average' % direction, 0))
+            if average > 0:
+                limits[key] = '%dkbit' % (average * units.Ki * 8 // 1000)
+        return limits
+
+    def configure_container_resize(self, instance, flavor):
+        """Build the config of an existing container with new limits
+
+        :param instance: nova instance
+        :param flavor: flavor whose limits are applied
+        :return: LXD container configuration to update the container with
+        """
+        LOG.debug('Configure LXD container resize', instance=instance)
+        container_config = self.get_container_config(instance)
+        return self.update_container_limits(container_config, instance,
+                                            flavor)
+
+    def update_container_limits(self, container_config, instance, flavor):
+        """Replace the limits in the config of an existing container
+
+        :param container_config: LXD container configuration
+        :param instance: nova instance
+        :param flavor: flavor whose limits are applied
+        :return: the updated container configuration
+        """
+        container_config['config'].update(
+            self.get_container_limits(instance, flavor))
+        container_config['config']['raw.lxc'] = (
+            self.get_container_raw_lxc(instance))
+
+        root_device = self.get_container_root_device(flavor)
+        if root_device:
+            container_config['devices']['root'] = root_device
+        else:
+            container_config['devices'].pop('root', None)
+
+        network_limits = self.get_network_limits(flavor)
+        for device in container_config['devices'].values():
+            if device.get('type') == 'nic':
+                device.pop('limits.ingress', None)
+                device.pop('limits.egress', None)
+                device.update(network_limits)
         return container_config
 
     def configure_lxd_image(self, container_config, instance):
@@ -145,13 +302,15 @@ class LXDContainerConfig(object):
 
         vif_name = self.vif_driver.get_vif_devname(network_info)
 
+        network_device = {'nictype': 'bridged',
+                          'hwaddr': cfg['mac_address'],
+                          'parent': cfg['bridge'],
+                          'type': 'nic',
+                          'host_name': vif_name}
+        network_device.update(self.get_network_limits(instance.flavor))
         network_devices = self.add_config(container_config,
                                           'devices', cfg['bridge'],
-                                          data={'nictype': 'bridged',
-                                                'hwaddr': cfg['mac_address'],
-                                                'parent': cfg['bridge'],
-                                                'type': 'nic',
-                                                'host_name': vif_name})
+                                          data=network_device)
 
         LOG.debug(pprint.pprint(container_config))
         self.session.container_update(network_devices, instance)
@@ -179,10 +338,13 @@ class LXDContainerConfig(object):
                     instance), instance_name)))
 
         rescue_path = self.container_dir.get_container_rescue(instance_name)
+        rescue_disk = {'path': 'mnt',
+                       'source': rescue_path,
+                       'type': 'disk'}
+        if CONF.lxd.rescue_readonly:
+            rescue_disk['readonly'] = 'true'
         self.add_config(container_config, 'devices', 'rescue',
-                        data={'path': 'mnt',
-                              'source': rescue_path,
-                              'type': 'disk'})
+                        data=rescue_disk)
         return container_config
 
     def configure_container_configdrive(self, container_config, instance,
@@ -223,19 +385,22 @@ class LXDContainerConfig(object):
         container_network_config = self.vif_driver.get_config(instance, vif)
         vif_name = self.vif_driver.get_vif_devname(vif)
 
+        network_device = {'name': self._get_network_device(instance.name),
+                          'nictype': 'bridged',
+                          'hwaddr': vif['address'],
+                          'parent': container_network_config['bridge'],
+                          'type': 'nic',
+                          'host_name': vif_name}
+        network_device.update(self.get_network_limits(instance.flavor))
         container_config = self.add_config(
             container_config, 'devices',
             container_network_config['bridge'],
-            data={'name': self._get_network_device(instance.name),
-                  'nictype': 'bridged',
-                  'hwaddr': vif['address'],
-                  'parent': container_network_config['bridge'],
-                  'type': 'nic',
-                  'host_name': vif_name})
+            data=network_device)
 
         return container_config
 
-    def configure_container_migrate(self, instance, container_ws, host):
+    def configure_container_migrate(self, instance, container_ws, host,
+                                    base_image=None):
         LOG.debug('Creating container config for migration.')
         container_config = self.get_container_config(instance, host=host)
 
@@ -243,14 +408,33 @@ class LXDContainerConfig(object):
                                            self.configure_lxd_ws(
                                                container_config,
                                                container_ws,
-                                               host))
+                                               host,
+                                               base_image))
+
+        return container_config
+
+    def configure_container_transfer(self, instance, host, base_image=None):
+        LOG.debug('Creating container config for rsync migration.')
+        container_config = self.get_container_config(instance, host=host)
+
+        # The rootfs is copied over by rsync once the container exists.
+        # Starting from the base image leaves rsync only the changes.
+        if base_image:
+            source = {'type': 'image', 'fingerprint': base_image}
+        else:
+            source = {'type': 'none'}
+        container_config = self.add_config(container_config, 'source',
+                                           source)
 
         return container_config
 
-    def configure_lxd_ws(self, container_config, container_ws, host):
+    def configure_lxd_ws(self, container_config, container_ws, host,
+                         base_image=None):
         container_url = ('wss://%s:8443/1.0/operations/%s/websocket'
                          % (host, container_ws['operation']))
-        container_migrate = {'base-image': '',
+        # With a base image LXD creates the container from it and only
+        # the files that differ are sent.
+        container_migrate = {'base-image': base_image or '',
                              "mode": "pull",
                              "operation": container_url,
                              "secrets": {
@@ -258,6 +442,10 @@ class LXDContainerConfig(object):
                                  "fs": container_ws['fs']
                              },
                              "type": "migration"}
+        if 'criu' in container_ws:
+            # Stateful migration of a running container
+            container_migrate['secrets']['criu'] = container_ws['criu']
+            container_migrate['live'] = True
 
         container_config = (self.add_config(container_config, 'source',
                                             container_migrate))
@@ -0,0 +1,233 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import gzip
+import os
+import pwd
+import re
+import shutil
+
+from nova import i18n
+from nova import utils
+
+from oslo_concurrency import lockutils
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import fileutils
+from oslo_utils import units
+
+from nova_lxd.nova.virt.lxd import utils as container_dir
+
+_ = i18n._
+_LW = i18n._LW
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+MAX_CONSOLE_BYTES = 100 * units.Ki
+
+SEGMENT_RE = re.compile(r'^console\.log\.(\d+)-(\d+)\.gz$')
+
+
+class LXDContainerConsole(object):
+    """Console log management for LXD containers.
+
+    LXC appends the container console to console.log in the container
+    directory. Once the file grows past CONF.lxd.console_log_max_bytes
+    its content is moved into a gzip segment in the instance directory
+    and the live file is truncated. Segments are named after the range
+    of console bytes they hold, so offsets stay valid across rotations,
+    and the oldest segments are dropped to keep every instance within
+    CONF.lxd.console_log_budget bytes on disk, the newest one excepted.
+    """
+
+    def __init__(self):
+        self.container_dir = container_dir.LXDContainerDirectories()
+
+    def get_console_output(self, instance):
+        """Return the last MAX_CONSOLE_BYTES of the console
+
+        :param instance: nova instance object
+        :return: console log data
+        """
+        LOG.debug('get_console_output called for instance',
+                  instance=instance)
+        console_log = self.container_dir.get_console_path(instance.name)
+        if not os.path.exists(console_log):
+            return
+        with lockutils.lock('lxd-console-%s' % instance.name):
+            self._ensure_readable(instance)
+            self._rotate(instance.name)
+            pieces = self._get_pieces(instance.name)
+            end = pieces[-1][1]
+            return self._read_range(pieces, end - MAX_CONSOLE_BYTES, end)
+
+    def get_console_log(self, instance, offset=0):
+        """Return the console log written since a given offset
+
+        Callers polling the console pass back the offset returned by
+        the previous call and only receive the bytes written since.
+        At most MAX_CONSOLE_BYTES are returned; a caller that fell
+        further behind skips ahead to the tail of the log. If the log
+        is shorter than the offset it was reset and is read again
+        from the start.
+
+        :param instance: nova instance object
+        :param offset: offset returned by the previous call
+        :return: tuple of the log data and the offset to pass next time
+        """
+        LOG.debug('get_console_log called for instance', instance=instance)
+        console_log = self.container_dir.get_console_path(instance.name)
+        if not os.path.exists(console_log):
+            return b'', 0
+        with lockutils.lock('lxd-console-%s' % instance.name):
+            self._ensure_readable(instance)
+            self._rotate(instance.name)
+            pieces = self._get_pieces(instance.name)
+            end = pieces[-1][1]
+            if offset > end:
+                offset = 0
+            start = max(offset, end - MAX_CONSOLE_BYTES)
+            return self._read_range(pieces, start, end), end
+
+    def setup_console_log(self, instance):
+        """Make the console log of a container accessible to nova
+
+        This is done once when the container is created rather than
+        on every console request. Nova owns the log afterwards so it
+        can also truncate it when rotating.
+
+        :param instance: nova instance object
+        """
+        console_log = self.container_dir.get_console_path(instance.name)
+        user = pwd.getpwuid(os.getuid())
+        utils.execute('chmod', '755',
+                      os.path.join(
+                          self.container_dir.get_container_dir(
+                              instance.name), instance.name),
+                      run_as_root=True)
+        utils.execute('touch', console_log, run_as_root=True)
+        utils.execute('chown', '%s:%s' % (user.pw_uid, user.pw_gid),
+                      console_log, run_as_root=True)
+
+    def rotate_console_logs(self, instance_names):
+        """Rotate the console logs of the given containers
+
+        :param instance_names: list of container names
+        """
+        for instance_name in instance_names:
+            try:
+                with lockutils.lock('lxd-console-%s' % instance_name):
+                    self._rotate(instance_name)
+            except Exception as ex:
+                LOG.warn(_LW('Failed to rotate console log of %(instance)s: '
+                             '%(reason)s'),
+                         {'instance': instance_name, 'reason': ex})
+
+    def _ensure_readable(self, instance):
+        console_log = self.container_dir.get_console_path(instance.name)
+        if not os.access(console_log, os.R_OK | os.W_OK):
+            # Containers created before the console log was prepared
+            # in create_container still need their permissions fixed.
+            self.setup_console_log(instance)
+
+    def _get_segments(self, instance_name):
+        segment_dir = self.container_dir.get_console_segment_dir(
+            instance_name)
+        try:
+            names = os.listdir(segment_dir)
+        except OSError:
+            return []
+
+        segments = []
+        for name in names:
+            match = SEGMENT_RE.match(name)
+            if match:
+                segments.append((int(match.group(1)), int(match.group(2)),
+                                 os.path.join(segment_dir, name)))
+        return sorted(segments)
+
+    def _get_pieces(self, instance_name):
+        """List the console log pieces in order
+
+        :return: list of (start, end, path) tuples, the live console
+                 log being the last one
+        """
+        pieces = self._get_segments(instance_name)
+        base = pieces[-1][1] if pieces else 0
+        console_log = self.container_dir.get_console_path(instance_name)
+        try:
+            size = os.path.getsize(console_log)
+        except OSError:
+            size = 0
+        pieces.append((base, base + size, console_log))
+        return pieces
+
+    def _read_range(self, pieces, start, end):
+        data = []
+        for piece_start, piece_end, path in pieces:
+            if piece_end <= start or piece_start >= end:
+                continue
+            offset = max(start, piece_start) - piece_start
+            length = min(end, piece_end) - piece_start - offset
+            if path.endswith('.gz'):
+                fp = gzip.open(path, 'rb')
+            else:
+                fp = open(path, 'rb')
+            try:
+                fp.seek(offset)
+                data.append(fp.read(length))
+            finally:
+                fp.close()
+        return b''.join(data)
+
+    def _rotate(self, instance_name):
+        console_log = self.container_dir.get_console_path(instance_name)
+        try:
+            size = os.path.getsize(console_log)
+        except OSError:
+            return
+        if size < CONF.lxd.console_log_max_bytes:
+            return
+
+        LOG.debug('Rotating console log of %s', instance_name)
+        segment_dir = self.container_dir.get_console_segment_dir(
+            instance_name)
+        fileutils.ensure_tree(segment_dir)
+        segments = self._get_segments(instance_name)
+        base = segments[-1][1] if segments else 0
+
+        tmp_path = os.path.join(segment_dir, 'console.log.tmp')
+        with open(console_log, 'r+b') as src:
+            with gzip.open(tmp_path, 'wb') as dst:
+                # Copy up to the end of file and truncate right away to
+                # keep the window in which new output is lost small.
+                shutil.copyfileobj(src, dst)
+                length = src.tell()
+                src.truncate(0)
+        os.rename(tmp_path, os.path.join(
+            segment_dir, 'console.log.%d-%d.gz' % (base, base + length)))
+        self._enforce_budget(instance_name)
+
+    def _enforce_budget(self, instance_name):
+        # The newest segment is always kept as it records where the
+        # live console log starts.
+        pieces = self._get_pieces(instance_name)
+        used = sum(os.path.getsize(path) for _s, _e, path in pieces)
+        for _start, _end, path in pieces[:-2]:
+            if used <= CONF.lxd.console_log_budget:
+                break
+            used -= os.path.getsize(path)
+            os.unlink(path)
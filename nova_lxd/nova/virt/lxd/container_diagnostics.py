@@ -0,0 +1,316 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import time
+
+from nova.compute import power_state
+from nova import i18n
+from nova.virt import configdrive
+from nova.virt import diagnostics
+
+from oslo_concurrency import lockutils
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import units
+
+from nova_lxd.nova.virt.lxd import vif
+
+_ = i18n._
+_LW = i18n._LW
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+PROC_NET_DEV = '/proc/net/dev'
+
+NET_DEV_FIELDS = ('rx_bytes', 'rx_packets', 'rx_errors', 'rx_drop',
+                  'rx_fifo', 'rx_frame', 'rx_compressed', 'rx_multicast',
+                  'tx_bytes', 'tx_packets', 'tx_errors', 'tx_drop',
+                  'tx_fifo', 'tx_colls', 'tx_carrier', 'tx_compressed')
+
+
+def _read_file(path):
+    try:
+        with open(path, 'r') as fp:
+            return fp.read()
+    except (IOError, OSError):
+        return None
+
+
+def _read_int(path, default=0):
+    data = _read_file(path)
+    if data is None:
+        return default
+    try:
+        return int(data.strip())
+    except ValueError:
+        return default
+
+
+def parse_net_dev(data):
+    """Parse the contents of /proc/net/dev
+
+    :param data: contents of /proc/net/dev
+    :return: dictionary of interface name to counter dictionary
+    """
+    interfaces = {}
+    for line in data.splitlines()[2:]:
+        if ':' not in line:
+            continue
+        name, counters = line.split(':', 1)
+        values = counters.split()
+        if len(values) < len(NET_DEV_FIELDS):
+            continue
+        interfaces[name.strip()] = dict(
+            zip(NET_DEV_FIELDS, [int(v) for v in values]))
+    return interfaces
+
+
+def parse_blkio(data):
+    """Parse a blkio.throttle.io_service_* cgroup file
+
+    :param data: contents of the cgroup file
+    :return: dictionary with the total read and write counters
+    """
+    totals = {'read': 0, 'write': 0}
+    if not data:
+        return totals
+    for line in data.splitlines():
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+        op = fields[1].lower()
+        if op in totals:
+            totals[op] += int(fields[2])
+    return totals
+
+
+class LXDContainerDiagnostics(object):
+    """Container diagnostics gathered from the host kernel.
+
+    Counters are read straight from the cgroup hierarchy and from the
+    host side of the container network devices, so no LXD API call is
+    needed. A single host-wide sweep is cached for
+    CONF.lxd.diagnostics_cache_ttl seconds and shared by every caller.
+    """
+
+    def __init__(self):
+        self.vif_driver = vif.LXDGenericDriver()
+        self._stats = None
+        self._stats_time = 0
+
+    def get_diagnostics(self, instance):
+        LOG.debug('get_diagnostics called for instance', instance=instance)
+        stats = self.get_host_stats()
+        container = stats['containers'].get(instance.name)
+        if container is None:
+            return {}
+
+        output = {}
+        for cpu, cpu_time in enumerate(container['cpu_percpu']):
+            output['cpu%d_time' % cpu] = cpu_time
+
+        output['root_read'] = container['blkio_bytes']['read']
+        output['root_read_req'] = container['blkio_requests']['read']
+        output['root_write'] = container['blkio_bytes']['write']
+        output['root_write_req'] = container['blkio_requests']['write']
+
+        for devname, vif_stats in self._get_vif_stats(instance, stats):
+            output[devname + '_rx'] = vif_stats['rx_bytes']
+            output[devname + '_rx_packets'] = vif_stats['rx_packets']
+            output[devname + '_rx_errors'] = vif_stats['rx_errors']
+            output[devname + '_rx_drop'] = vif_stats['rx_drop']
+            output[devname + '_tx'] = vif_stats['tx_bytes']
+            output[devname + '_tx_packets'] = vif_stats['tx_packets']
+            output[devname + '_tx_errors'] = vif_stats['tx_errors']
+            output[devname + '_tx_drop'] = vif_stats['tx_drop']
+
+        output['memory'] = (
+            self._get_memory_limit(instance, container) / units.Ki)
+        output['memory-actual'] = container['memory_usage'] / units.Ki
+        return output
+
+    def get_instance_diagnostics(self, instance):
+        LOG.debug('get_instance_diagnostics called for instance',
+                  instance=instance)
+        stats = self.get_host_stats()
+        container = stats['containers'].get(instance.name)
+        if container is None:
+            state = power_state.SHUTDOWN
+        else:
+            state = power_state.RUNNING
+
+        diags = diagnostics.Diagnostics(
+            state=power_state.STATE_MAP[state],
+            driver='lxd',
+            hypervisor_os='linux',
+            config_drive=configdrive.required_by(instance))
+        if container is None:
+            return diags
+
+        diags.uptime = int(stats['timestamp'] - container['started'])
+        for cpu_time in container['cpu_percpu']:
+            diags.add_cpu(time=cpu_time)
+
+        for vif_info in self._get_network_info(instance):
+            vif_stats = stats['interfaces'].get(
+                self.vif_driver.get_vif_devname(vif_info))
+            if vif_stats is None:
+                continue
+            vif_stats = self._container_view(vif_stats)
+            diags.add_nic(mac_address=vif_info['address'],
+                          rx_octets=vif_stats['rx_bytes'],
+                          rx_errors=vif_stats['rx_errors'],
+                          rx_drop=vif_stats['rx_drop'],
+                          rx_packets=vif_stats['rx_packets'],
+                          tx_octets=vif_stats['tx_bytes'],
+                          tx_errors=vif_stats['tx_errors'],
+                          tx_drop=vif_stats['tx_drop'],
+                          tx_packets=vif_stats['tx_packets'])
+
+        diags.add_disk(id='root',
+                       read_bytes=container['blkio_bytes']['read'],
+                       read_requests=container['blkio_requests']['read'],
+                       write_bytes=container['blkio_bytes']['write'],
+                       write_requests=container['blkio_requests']['write'])
+
+        diags.memory_details.maximum = (
+            self._get_memory_limit(instance, container) / units.Mi)
+        diags.memory_details.used = container['memory_usage'] / units.Mi
+        return diags
+
+    def get_all_bw_counters(self, instances):
+        """Return bandwidth counters for every vif of the instances
+
+        The host side device of each vif is looked up in a single
+        fresh read of /proc/net/dev, so the cost stays linear in the
+        number of ports.
+
+        :param instances: nova.objects.instance.InstanceList
+        :return: list of bandwidth counter dictionaries
+        """
+        LOG.debug('get_all_bw_counters called')
+        interfaces = self._sweep_interfaces()
+        bw_counters = []
+        for instance in instances:
+            for vif_info in self._get_network_info(instance):
+                vif_stats = interfaces.get(
+                    self.vif_driver.get_vif_devname(vif_info))
+                if vif_stats is None:
+                    continue
+                vif_stats = self._container_view(vif_stats)
+                bw_counters.append({'uuid': instance.uuid,
+                                    'mac_address': vif_info['address'],
+                                    'bw_in': vif_stats['rx_bytes'],
+                                    'bw_out': vif_stats['tx_bytes']})
+        return bw_counters
+
+    @lockutils.synchronized('lxd-host-stats')
+    def get_host_stats(self):
+        """Return the cached host-wide sweep, refreshing it when stale
+
+        :return: dictionary with the per container cgroup counters,
+                 the host network device counters and the time
+                 the sweep was taken
+        """
+        now = time.time()
+        if (self._stats is None or
+                now - self._stats_time >= CONF.lxd.diagnostics_cache_ttl):
+            self._stats = {'containers': self._sweep_cgroups(),
+                           'interfaces': self._sweep_interfaces(),
+                           'timestamp': now}
+            self._stats_time = now
+        return self._stats
+
+    def _sweep_cgroups(self):
+        containers = {}
+        cpuacct_dir = self._get_cgroup_dir('cpuacct')
+        try:
+            names = os.listdir(cpuacct_dir)
+        except OSError as ex:
+            LOG.warn(_LW('Unable to read cgroup hierarchy %(path)s: '
+                         '%(reason)s'), {'path': cpuacct_dir, 'reason': ex})
+            return containers
+
+        memory_dir = self._get_cgroup_dir('memory')
+        blkio_dir = self._get_cgroup_dir('blkio')
+        for name in names:
+            cgroup = os.path.join(cpuacct_dir, name)
+            if not os.path.isdir(cgroup):
+                continue
+            percpu = _read_file(os.path.join(cgroup, 'cpuacct.usage_percpu'))
+            containers[name] = {
+                'started': os.stat(cgroup).st_ctime,
+                'cpu_time': _read_int(os.path.join(cgroup,
+                                                   'cpuacct.usage')),
+                'cpu_percpu': [int(v) for v in (percpu or '').split()],
+                'memory_usage': _read_int(
+                    os.path.join(memory_dir, name, 'memory.usage_in_bytes')),
+                'memory_limit': _read_int(
+                    os.path.join(memory_dir, name, 'memory.limit_in_bytes')),
+                'blkio_bytes': parse_blkio(_read_file(
+                    os.path.join(blkio_dir, name,
+                                 'blkio.throttle.io_service_bytes'))),
+                'blkio_requests': parse_blkio(_read_file(
+                    os.path.join(blkio_dir, name,
+                                 'blkio.throttle.io_serviced'))),
+            }
+        return containers
+
+    def _sweep_interfaces(self):
+        data = _read_file(PROC_NET_DEV)
+        if data is None:
+            return {}
+        return parse_net_dev(data)
+
+    def _get_cgroup_dir(self, controller):
+        return os.path.join(CONF.lxd.cgroup_path, controller,
+                            CONF.lxd.cgroup_parent)
+
+    def _get_network_info(self, instance):
+        try:
+            return instance.get_network_info() or []
+        except Exception as ex:
+            LOG.debug('Unable to get network info: %s', ex,
+                      instance=instance)
+            return []
+
+    def _get_vif_stats(self, instance, stats):
+        for vif_info in self._get_network_info(instance):
+            devname = self.vif_driver.get_vif_devname(vif_info)
+            vif_stats = stats['interfaces'].get(devname)
+            if vif_stats is not None:
+                yield devname, self._container_view(vif_stats)
+
+    def _container_view(self, vif_stats):
+        """Swap the host side counters of a veth to the container view
+
+        Bytes received by the host end of the veth pair were
+        transmitted by the container and the other way around.
+        """
+        view = {}
+        for key, value in vif_stats.items():
+            if key.startswith('rx_'):
+                view['tx_' + key[3:]] = value
+            elif key.startswith('tx_'):
+                view['rx_' + key[3:]] = value
+        return view
+
+    def _get_memory_limit(self, instance, container):
+        flavor_limit = instance.flavor.memory_mb * units.Mi
+        if flavor_limit > 0:
+            return min(container['memory_limit'], flavor_limit)
+        return container['memory_limit']
@@ -0,0 +1,253 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import time
+
+from nova import exception
+from nova import i18n
+from nova import utils
+
+from oslo_concurrency import lockutils
+from oslo_concurrency import processutils
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import units
+
+from nova_lxd.nova.virt.lxd.session import session
+from nova_lxd.nova.virt.lxd import utils as container_dir
+
+_ = i18n._
+_LW = i18n._LW
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+# Storage backends on which LXD enforces the size of the root device,
+# with a ZFS refquota, a btrfs qgroup limit or the size of the LV.
+QUOTA_STORAGE = ('btrfs', 'lvm', 'zfs')
+
+# Thin pool LXD creates the container volumes in, unless configured
+# with storage.lvm_thinpool_name.
+LVM_THINPOOL = 'LXDPool'
+
+
+def _parse_size(value):
+    return int(value) if value.isdigit() and int(value) else None
+
+
+class LXDContainerDisk(object):
+    """Disk quotas and disk usage of the containers on the host
+
+    The usage of every container is read with a single query of the
+    storage backend and reused for CONF.lxd.disk_usage_cache_ttl
+    seconds, so the resource tracker does not walk the storage once
+    per instance.
+    """
+
+    def __init__(self):
+        self.session = session.LXDAPISession()
+        self.container_dir = container_dir.LXDContainerDirectories()
+        self._storage = None
+        self._thinpool = LVM_THINPOOL
+        self._usage = None
+        self._usage_time = 0
+
+    def get_storage(self):
+        """Return the storage backend of LXD
+
+        :return: tuple of the backend name, and the ZFS pool or LVM
+                 volume group it uses
+        """
+        if self._storage is None:
+            data = self.session.host_config()
+            backend = data.get('environment', {}).get('storage', 'dir')
+            config = data.get('config', {})
+            pool = config.get({'zfs': 'storage.zfs_pool_name',
+                               'lvm': 'storage.lvm_vg_name'}.get(backend))
+            self._storage = (backend, pool)
+            self._thinpool = config.get('storage.lvm_thinpool_name',
+                                        LVM_THINPOOL)
+        return self._storage
+
+    def supports_quota(self):
+        try:
+            return self.get_storage()[0] in QUOTA_STORAGE
+        except Exception as ex:
+            LOG.warn(_LW('Unable to find the LXD storage backend, root '
+                         'disk sizes are not enforced: %s'), ex)
+            return False
+
+    @lockutils.synchronized('lxd-disk-usage')
+    def get_usage(self):
+        """Return the disk usage of the containers on the host
+
+        :return: dictionary keyed by container name of the bytes used
+                 and the quota in bytes, None without a quota
+        """
+        now = time.time()
+        if (self._usage is None or
+                now - self._usage_time >= CONF.lxd.disk_usage_cache_ttl):
+            backend, pool = self.get_storage()
+            names = set(self.session.container_list())
+            get_usage = getattr(self, '_get_%s_usage' % backend,
+                                self._get_dir_usage)
+            self._usage = get_usage(pool, names)
+            self._usage_time = now
+        return self._usage
+
+    def get_instance_disk_info(self, instance):
+        """Describe the root disk of a container for nova
+
+        :param instance: nova instance
+        :return: JSON list with the root disk of the container
+        """
+        usage = self.get_usage().get(instance.name,
+                                     {'used': 0, 'quota': None})
+        size = usage['quota'] or instance.flavor.root_gb * units.Gi
+        return jsonutils.dumps([{
+            'type': 'lxd',
+            'path': self.container_dir.get_container_rootfs(instance.name),
+            'virt_disk_size': size,
+            'disk_size': usage['used'],
+            'backing_file': '',
+            'over_committed_disk_size': max(size - usage['used'], 0)}])
+
+    def get_over_committed(self):
+        """Bytes the containers may still write within their quotas
+
+        :return: number of bytes, 0 when the usage cannot be read
+        """
+        try:
+            usage = self.get_usage()
+        except (exception.NovaException,
+                processutils.ProcessExecutionError) as ex:
+            LOG.warn(_LW('Unable to read the disk usage of the '
+                         'containers: %s'), ex)
+            return 0
+        return sum(max(container['quota'] - container['used'], 0)
+                   for container in usage.values() if container['quota'])
+
+    def get_available(self):
+        """Bytes free for containers in the ZFS pool or LVM thin pool
+
+        Containers on zfs and lvm do not live in the file system of
+        CONF.lxd.root_dir, so its free space says nothing about theirs.
+
+        :return: number of bytes, None on the dir and btrfs backends or
+                 when it cannot be read, where the free space of the
+                 file system holding CONF.lxd.root_dir applies
+        """
+        try:
+            backend, pool = self.get_storage()
+            get_available = getattr(self, '_get_%s_available' % backend,
+                                    None)
+            return get_available(pool) if get_available else None
+        except (exception.NovaException,
+                processutils.ProcessExecutionError) as ex:
+            LOG.warn(_LW('Unable to read the free space of the LXD '
+                         'storage: %s'), ex)
+            return None
+
+    def _get_zfs_available(self, pool):
+        out, err = utils.execute('zfs', 'get', '-H', '-p', '-o', 'value',
+                                 'available', pool, run_as_root=True)
+        return int(out.strip())
+
+    def _get_lvm_available(self, vg):
+        for name, size, percent in self._list_lvs(vg):
+            if name == self._thinpool:
+                return int(size * (100 - float(percent or 0)) / 100)
+        return None
+
+    def _list_lvs(self, vg):
+        out, err = utils.execute('lvs', '--noheadings', '--units', 'b',
+                                 '--nosuffix', '--separator', ':',
+                                 '-o', 'lv_name,lv_size,data_percent', vg,
+                                 run_as_root=True)
+        lvs = []
+        for line in out.splitlines():
+            fields = [field.strip() for field in line.split(':')]
+            if len(fields) == 3:
+                lvs.append((fields[0], int(fields[1]), fields[2]))
+        return lvs
+
+    def _get_zfs_usage(self, pool, names):
+        prefix = '%s/containers/' % pool
+        out, err = utils.execute('zfs', 'list', '-H', '-p',
+                                 '-o', 'name,used,refquota',
+                                 '-r', prefix.rstrip('/'),
+                                 run_as_root=True)
+        usage = {}
+        for line in out.splitlines():
+            fields = line.split('\t')
+            if len(fields) != 3 or not fields[0].startswith(prefix):
+                continue
+            name = fields[0][len(prefix):]
+            if name in names:
+                usage[name] = {'used': int(fields[1]),
+                               'quota': _parse_size(fields[2])}
+        return usage
+
+    def _get_lvm_usage(self, vg, names):
+        # LXD doubles the dashes of a container name in its LV name.
+        lv_names = dict((name.replace('-', '--'), name) for name in names)
+        usage = {}
+        for name, size, percent in self._list_lvs(vg):
+            if name not in lv_names:
+                continue
+            # Thin volumes report how much of them is allocated.
+            used = size * float(percent) / 100 if percent else size
+            usage[lv_names[name]] = {'used': int(used), 'quota': size}
+        return usage
+
+    def _get_btrfs_usage(self, pool, names):
+        path = self.container_dir.get_container_dir(None)
+        out, err = utils.execute('btrfs', 'subvolume', 'list', '-o', path,
+                                 run_as_root=True)
+        qgroups = {}
+        for line in out.splitlines():
+            fields = line.split()
+            if len(fields) >= 9 and fields[0] == 'ID':
+                qgroups['0/%s' % fields[1]] = os.path.basename(fields[-1])
+
+        out, err = utils.execute('btrfs', 'qgroup', 'show', '-r', '--raw',
+                                 path, run_as_root=True)
+        usage = {}
+        for line in out.splitlines():
+            fields = line.split()
+            if len(fields) != 4 or qgroups.get(fields[0]) not in names:
+                continue
+            usage[qgroups[fields[0]]] = {'used': int(fields[1]),
+                                         'quota': _parse_size(fields[3])}
+        return usage
+
+    def _get_dir_usage(self, pool, names):
+        if not names:
+            return {}
+        # One du over the containers directory, with a total for each
+        # container directory; it still reports the other containers
+        # when one goes away while it runs.
+        out, err = utils.execute('du', '-x', '-B1', '-d', '1',
+                                 self.container_dir.get_container_dir(None),
+                                 run_as_root=True, check_exit_code=[0, 1])
+        usage = {}
+        for line in out.splitlines():
+            size, sep, path = line.partition('\t')
+            name = os.path.basename(path)
+            if sep and name in names:
+                usage[name] = {'used': int(size), 'quota': None}
+        return usage
@@ -13,7 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import re
+import time
+
+import eventlet
+from nova import exception
 from nova import i18n
+from nova import rpc
+from nova import utils
 
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -21,16 +28,25 @@ from oslo_utils import excutils
 
 from nova_lxd.nova.virt.lxd import container_config
 from nova_lxd.nova.virt.lxd import container_ops
+from nova_lxd.nova.virt.lxd import container_transfer
 from nova_lxd.nova.virt.lxd.session import session
 
 
 _ = i18n._
 _LE = i18n._LE
 _LI = i18n._LI
+_LW = i18n._LW
 
 CONF = cfg.CONF
+CONF.import_opt('my_ip', 'nova.netconf')
 LOG = logging.getLogger(__name__)
 
+PROGRESS_RE = re.compile(r'(\d+)%')
+
+PRECOPY_KEYS = ('migration.incremental.memory',
+                'migration.incremental.memory.iterations',
+                'migration.incremental.memory.goal')
+
 
 class LXDContainerMigrate(object):
 
@@ -38,6 +54,7 @@ class LXDContainerMigrate(object):
         self.virtapi = virtapi
         self.config = container_config.LXDContainerConfig()
         self.session = session.LXDAPISession()
+        self.transfer = container_transfer.LXDContainerTransfer()
         self.container_ops = \
             container_ops.LXDContainerOperations(
                 self.virtapi)
@@ -48,19 +65,54 @@ class LXDContainerMigrate(object):
                                    retry_interval=0):
         LOG.debug("migrate_disk_and_power_off called", instance=instance)
 
-        LOG.info(_('No disk to migrate'))
+        if dest in (CONF.my_ip, CONF.host):
+            self._resize_in_place(instance, flavor)
+            instance.system_metadata[container_ops.RESIZE_IN_PLACE] = 'True'
+        else:
+            LOG.info(_('No disk to migrate'))
 
         # disk_info is not used
         disk_info = {}
         return disk_info
 
+    def _resize_in_place(self, instance, flavor):
+        """Apply the limits of a flavor to the running container
+
+        Nothing is copied and the container is not restarted. When the
+        host cannot fit the new flavor the scheduler picks another one,
+        and the resize goes through a migration instead.
+        """
+        try:
+            container_config = self.config.configure_container_resize(
+                instance, flavor)
+            self.session.container_update(container_config, instance)
+            LOG.info(_LI('Resized %(instance)s in place to %(flavor)s'),
+                     {'instance': instance.name, 'flavor': flavor.name},
+                     instance=instance)
+        except Exception as ex:
+            LOG.error(_LE('Failed to resize container %(instance)s in '
+                          'place: %(reason)s'),
+                      {'instance': instance.name, 'reason': ex},
+                      instance=instance)
+            raise exception.InstanceFaultRollback(ex)
+
     def confirm_migration(self, migration, instance, network_info):
         LOG.debug("confirm_migration called", instance=instance)
+        instance.system_metadata.pop(container_ops.RESIZE_IN_PLACE, None)
 
     def finish_revert_migration(self, context, instance, network_info,
                                 block_device_info=None, power_on=True):
         LOG.debug("finish_revert_migration called", instance=instance)
-        container_config = self.get_container_config(instance)
+        resized = instance.system_metadata.pop(
+            container_ops.RESIZE_IN_PLACE, None)
+        if resized:
+            # instance.flavor is the old flavor again by now.
+            container_config = self.config.configure_container_resize(
+                instance, instance.flavor)
+            self.session.container_update(container_config, instance)
+            return
+
+        container_config = self.config.get_container_config(instance)
         self.container_ops.start_container(container_config, instance,
                                            network_info,
                                            need_vif_plugged=True)
@@ -70,6 +122,9 @@ class LXDContainerMigrate(object):
                          block_device_info=None, power_on=True):
         LOG.debug("finish_migration called", instance=instance)
 
+        if migration['source_compute'] == migration['dest_compute']:
+            # The limits were applied by migrate_disk_and_power_off.
+            return
         self._migration(migration, instance, network_info)
 
     def _migration(self, migration, instance, network_info):
@@ -78,18 +133,48 @@ class LXDContainerMigrate(object):
         try:
             if self.session.container_defined(instance.name, instance):
                 LOG.exception(_LE('Container already migrated'))
-            self.session.container_stop(instance.name, src_host, instance)
-            container_ws = self.session.container_migrate(
-                instance.name, src_host, instance)
-            container_config = (
-                self.config.configure_container_migrate(
-                    instance, container_ws, src_host))
-
-            self.session.container_init(container_config,
-                                        instance, dst_host)
+            base_image = self._get_base_image(instance, dst_host)
+            # rsync needs the rootfs of the stopped source, and of the
+            # destination before it starts, to be in place. Only dir
+            # and btrfs storage keep it there; zfs and lvm go through
+            # the LXD websocket, presync included.
+            if (CONF.lxd.migration_transport == 'rsync' and
+                    self.transfer.is_supported(src_host)):
+                container_config = (
+                    self.config.configure_container_transfer(
+                        instance, src_host, base_image))
+                self._update_limits(container_config, instance)
+                self.session.container_init(container_config,
+                                            instance, dst_host)
+                if CONF.lxd.migration_presync:
+                    # Bulk copy while the container still runs, so only
+                    # what changed since is copied once it is stopped.
+                    self.transfer.transfer(instance, src_host)
+                self.session.container_stop(instance.name, src_host,
+                                            instance)
+                stopped = time.time()
+                self.transfer.transfer(instance, src_host)
+            else:
+                self.session.container_stop(instance.name, src_host,
+                                            instance)
+                stopped = time.time()
+                container_ws = self.session.container_migrate(
+                    instance.name, src_host, instance)
+                container_config = (
+                    self.config.configure_container_migrate(
+                        instance, container_ws, src_host, base_image))
+                self._update_limits(container_config, instance)
+
+                self.session.container_init(container_config,
+                                            instance, dst_host)
             self.container_ops.start_container(container_config, instance,
                                                network_info,
                                                need_vif_plugged=True)
+            LOG.info(_LI('Migrated %(instance)s from %(host)s with '
+                         '%(downtime).1f seconds of downtime'),
+                     {'instance': instance.name, 'host': src_host,
+                      'downtime': time.time() - stopped},
+                     instance=instance)
             self.session.container_destroy(instance.name, src_host, instance)
         except Exception as ex:
             with excutils.save_and_reraise_exception():
@@ -98,19 +183,274 @@ class LXDContainerMigrate(object):
                           {'instance': instance.name, 'reason': ex},
                           instance=instance)
 
+    def _update_limits(self, container_config, instance):
+        """Set the limits of the flavor the container lands with
+
+        The config copied from the source carries the limits of the
+        old flavor on a resize, and the CPUs and NUMA nodes of the
+        source host.
+        """
+        self.config.update_container_limits(container_config, instance,
+                                            instance.flavor)
+
+    def _get_base_image(self, instance, host):
+        """Find the image of an instance in the image store of a host
+
+        :return: fingerprint of the image on host, or None
+        """
+        try:
+            fingerprint = self.session.image_peer_fingerprint(host,
+                                                              instance)
+        except Exception as ex:
+            LOG.warn(_LW('Unable to look up image %(image)s on %(host)s: '
+                         '%(reason)s'),
+                     {'image': instance.image_ref, 'host': host,
+                      'reason': ex},
+                     instance=instance)
+            return None
+        if fingerprint is None:
+            LOG.info(_LI('Image %(image)s is not on %(host)s, migrating '
+                         'the whole rootfs'),
+                     {'image': instance.image_ref, 'host': host},
+                     instance=instance)
+        return fingerprint
+
     def live_migration(self, context, instance_ref, dest, post_method,
                        recover_method, block_migration=False,
                        migrate_data=None):
         LOG.debug("live_migration called", instance=instance_ref)
+        try:
+            self._live_migration(context, instance_ref, dest)
+        except Exception as ex:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE('Failed to live migrate container '
+                              '%(instance)s: %(reason)s'),
+                          {'instance': instance_ref.name, 'reason': ex},
+                          instance=instance_ref)
+                recover_method(context, instance_ref, dest, block_migration)
         post_method(context, instance_ref, dest, block_migration)
 
+    def _live_migration(self, context, instance, dest):
+        """Move a running container to another host
+
+        LXD pre-copies the memory of the container in up to
+        CONF.lxd.live_migration_iterations rounds while it keeps
+        running, until CONF.lxd.live_migration_goal percent of it is
+        in sync, and then stops it for the final copy of what is left.
+        Containers that dirty memory faster than it is copied are
+        frozen once the copy made no progress for
+        CONF.lxd.live_migration_max_stalls checks, so it converges.
+        """
+        saved = self._configure_precopy(instance)
+        try:
+            container_ws = self.session.container_live_migrate(
+                instance.name, CONF.host, instance)
+            container_config = self.config.configure_container_migrate(
+                instance, container_ws, CONF.host,
+                self._get_base_image(instance, dest))
+            # The destination starts out with the settings the
+            # container had before this migration.
+            self._restore_precopy(container_config, saved)
+            operation = self.session.container_migrate_init(
+                container_config, instance, dest)
+            self._monitor_migration(context, operation, dest, instance)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._reset_precopy(instance, saved)
+
+    def _configure_precopy(self, instance):
+        """Turn on memory pre-copy for the migration of a container
+
+        LXD only reads these settings from the container config.
+
+        :return: the previous values of PRECOPY_KEYS, None when unset
+        """
+        container_config = self.config.get_container_config(instance)
+        saved = dict((key, container_config['config'].get(key))
+                     for key in PRECOPY_KEYS)
+        container_config['config'].update({
+            'migration.incremental.memory': 'true',
+            'migration.incremental.memory.iterations':
+                str(CONF.lxd.live_migration_iterations),
+            'migration.incremental.memory.goal':
+                str(CONF.lxd.live_migration_goal),
+        })
+        self.session.container_update(container_config, instance)
+        return saved
+
+    def _restore_precopy(self, container_config, saved):
+        for key, value in saved.items():
+            if value is None:
+                container_config['config'].pop(key, None)
+            else:
+                container_config['config'][key] = value
+
+    def _reset_precopy(self, instance, saved):
+        """Put back the settings of a container that failed to migrate"""
+        try:
+            container_config = self.config.get_container_config(instance)
+            self._restore_precopy(container_config, saved)
+            self.session.container_update(container_config, instance)
+        except Exception as ex:
+            LOG.warn(_LW('Unable to restore the migration settings of '
+                         '%(instance)s: %(reason)s'),
+                     {'instance': instance.name, 'reason': ex},
+                     instance=instance)
+
+    def _monitor_migration(self, context, operation, dest, instance):
+        """Follow a live migration until it completes
+
+        Progress published by LXD in the operation metadata is logged
+        and, when it carries a percentage, saved as the progress of the
+        instance. Once done, the downtime and total time of the
+        migration are logged and sent as a notification.
+
+        LXD offers no post-copy, so a migration that stalls is made to
+        converge by freezing the source: nothing dirties memory any
+        more and the remaining rounds only copy what is left. This
+        ends the pre-copy sooner at the cost of the frozen time counting
+        as downtime. A container frozen here is thawed whatever the
+        outcome, on the destination when the migration completed and
+        on the source otherwise.
+        """
+        start = time.time()
+        stopped = None
+        paused = False
+        completed = False
+        last_progress = None
+        stalls = 0
+        try:
+            while True:
+                data = self.session.migration_status(operation, dest,
+                                                     instance)
+                status_code = data['status_code']
+                now = time.time()
+                if status_code >= 400:
+                    raise exception.NovaException(
+                        data.get('err') or data.get('metadata') or
+                        data.get('status'))
+
+                # The source stops running for the final copy
+                if (stopped is None and
+                        not self.session.container_running(instance)):
+                    stopped = now
+
+                if status_code == 200:
+                    completed = True
+                    self._report_migration(context, instance, dest, start,
+                                           stopped or now, now, paused)
+                    return
+
+                timeout = CONF.lxd.live_migration_completion_timeout
+                if timeout and now - start >= timeout:
+                    self._cancel_migration(operation, dest, instance)
+                    raise exception.NovaException(
+                        _('Live migration of %(instance)s did not complete '
+                          'within %(time)d seconds') %
+                        {'instance': instance.name, 'time': timeout})
+
+                progress = data.get('metadata') or {}
+                LOG.debug('Live migration of %(instance)s running for '
+                          '%(time)d seconds: %(progress)s',
+                          {'instance': instance.name,
+                           'time': now - start,
+                           'progress': progress},
+                          instance=instance)
+                percent = self._update_progress(instance, progress)
+                if percent is not None and (last_progress is None or
+                                            percent > last_progress):
+                    last_progress = percent
+                    stalls = 0
+                else:
+                    stalls += 1
+
+                max_stalls = CONF.lxd.live_migration_max_stalls
+                if (max_stalls and not paused and stopped is None and
+                        stalls >= max_stalls):
+                    LOG.warn(_LW('Live migration of %(instance)s made no '
+                                 'progress in %(stalls)d checks, freezing '
+                                 'it'),
+                             {'instance': instance.name, 'stalls': stalls},
+                             instance=instance)
+                    self.session.container_pause(instance.name, instance)
+                    paused = True
+                    stopped = now
+
+                eventlet.sleep(CONF.lxd.live_migration_poll_interval)
+        finally:
+            if paused:
+                self._thaw_after_migration(instance, dest, completed)
+
+    def _cancel_migration(self, operation, dest, instance):
+        try:
+            self.session.migration_cancel(operation, dest, instance)
+        except Exception as ex:
+            LOG.warn(_LW('Unable to cancel the live migration of '
+                         '%(instance)s: %(reason)s'),
+                     {'instance': instance.name, 'reason': ex},
+                     instance=instance)
+
+    def _thaw_after_migration(self, instance, dest, completed):
+        try:
+            if completed:
+                self.session.migration_resume(instance.name, dest, instance)
+            else:
+                self.session.container_unpause(instance.name, instance)
+        except Exception as ex:
+            LOG.error(_LE('Unable to thaw %(instance)s after its live '
+                          'migration: %(reason)s'),
+                      {'instance': instance.name, 'reason': ex},
+                      instance=instance)
+
+    def _report_migration(self, context, instance, dest, start, stopped,
+                          done, paused):
+        payload = {'instance_id': instance.uuid,
+                   'source': CONF.host,
+                   'dest': dest,
+                   'total_time': done - start,
+                   'downtime': done - stopped,
+                   'paused': paused}
+        LOG.info(_LI('Live migrated %(instance)s to %(dest)s in '
+                     '%(total).1f seconds with %(downtime).1f seconds of '
+                     'downtime'),
+                 {'instance': instance.name, 'dest': dest,
+                  'total': payload['total_time'],
+                  'downtime': payload['downtime']},
+                 instance=instance)
+        rpc.get_notifier('compute').info(context,
+                                         'compute.nova_lxd.live_migration',
+                                         payload)
+
+    def _update_progress(self, instance, progress):
+        """Save the percentage found in the progress of a migration
+
+        :return: the percentage, or None when LXD published none
+        """
+        for value in progress.values():
+            match = PROGRESS_RE.search(str(value))
+            if match:
+                instance.progress = min(int(match.group(1)), 100)
+                instance.save()
+                return instance.progress
+        return None
+
     def pre_live_migration(self, context, instance, block_device_info,
                            network_info):
         LOG.debug("pre_live_migration called", instance=instance)
+        self.container_ops.plug_vifs(None, instance, network_info, True)
 
     def post_live_migration(self, context, instance, block_device_info):
         LOG.debug("post_live_migration", instance=instance)
-        pass
+        # LXD leaves the stopped source container behind
+        if self.session.container_defined(instance.name, instance):
+            self.session.container_destroy(instance.name, CONF.host,
+                                           instance)
+
+    def post_live_migration_at_source(self, context, instance,
+                                      network_info):
+        LOG.debug("post_live_migration_at_source called",
+                  instance=instance)
+        self.container_ops._unplug_vifs(instance, network_info, True)
 
     def post_live_migration_at_destination(self, ctxt, instance_ref,
                                            network_info, block_migration,
@@ -123,6 +463,7 @@ class LXDContainerMigrate(object):
                                            block_migration=False,
                                            disk_over_commit=False):
         LOG.debug("check_can_live_migrate_destination called", instance_ref)
+        self._check_criu(instance_ref)
         return {}
 
     def check_can_live_migrate_destination_cleanup(self, ctxt,
@@ -132,4 +473,17 @@ class LXDContainerMigrate(object):
     def check_can_live_migrate_source(self, ctxt, instance_ref,
                                       dest_check_data):
         LOG.debug("check_can_live_migrate_source called", instance_ref)
+        self._check_criu(instance_ref)
+        if not self.session.container_running(instance_ref):
+            raise exception.MigrationPreCheckError(
+                reason=_('Container %s is not running') % instance_ref.name)
         return dest_check_data
+
+    def _check_criu(self, instance):
+        try:
+            utils.execute('criu', '--version')
+        except Exception as ex:
+            LOG.warn(_LW('CRIU is not available: %s'), ex,
+                     instance=instance)
+            raise exception.MigrationPreCheckError(
+                reason=_('CRIU is not available on %s') % CONF.host)
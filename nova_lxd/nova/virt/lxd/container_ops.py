@@ -16,7 +16,6 @@
 
 from nova.virt import hardware
 import os
-import pwd
 import shutil
 import time
 
@@ -24,13 +23,14 @@ import eventlet
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
-from oslo_utils import units
 
+from nova.compute import task_states
 from nova import exception
 from nova import i18n
 from nova import utils
 
 from nova_lxd.nova.virt.lxd import container_config
+from nova_lxd.nova.virt.lxd import container_console
 from nova_lxd.nova.virt.lxd import container_firewall
 from nova_lxd.nova.virt.lxd import image
 from nova_lxd.nova.virt.lxd.session import session
@@ -47,7 +47,7 @@ CONF.import_opt('vif_plugging_timeout', 'nova.virt.driver')
 CONF.import_opt('vif_plugging_is_fatal', 'nova.virt.driver')
 LOG = logging.getLogger(__name__)
 
-MAX_CONSOLE_BYTES = 100 * units.Ki
+RESIZE_IN_PLACE = 'lxd_resize_in_place'
 
 
 class LXDContainerOperations(object):
@@ -56,6 +56,7 @@ class LXDContainerOperations(object):
         self.virtapi = virtapi
 
         self.container_config = container_config.LXDContainerConfig()
+        self.container_console = container_console.LXDContainerConsole()
         self.container_dir = container_dir.LXDContainerDirectories()
         self.image = image.LXDContainerImage()
         self.firewall_driver = container_firewall.LXDContainerFirewall()
@@ -112,6 +113,7 @@ class LXDContainerOperations(object):
             eventlet.spawn(self.session.container_init,
                            container_config, instance,
                            instance.host).wait()
+            self.container_console.setup_console_log(instance)
 
             self.start_container(container_config, instance, network_info,
                                  need_vif_plugged)
@@ -166,6 +168,13 @@ class LXDContainerOperations(object):
 
     def destroy(self, context, instance, network_info, block_device_info=None,
                 destroy_disks=True, migrate_data=None):
+        if (instance.task_state == task_states.RESIZE_REVERTING and
+                instance.system_metadata.get(RESIZE_IN_PLACE)):
+            # Reverting a resize done in place: the container is the
+            # one to revert to.
+            LOG.debug('Keeping container resized in place',
+                      instance=instance)
+            return
         self.session.container_destroy(instance.name, instance.host,
                                        instance)
         self.cleanup(context, instance, network_info, block_device_info)
@@ -193,50 +202,52 @@ class LXDContainerOperations(object):
 
     def rescue(self, context, instance, network_info, image_meta,
                rescue_password):
+        """Boot a rescue container with the original rootfs attached
+
+        The original container is renamed out of the way instead of
+        being copied. LXD renames the storage volume along with the
+        container (a dataset, subvolume or logical volume rename on
+        ZFS, btrfs and LVM, a directory rename otherwise), so rescue
+        and unrescue do not depend on the size of the disk. The rescue
+        container gets the original rootfs as a disk device, mounted
+        read-only when CONF.lxd.rescue_readonly is set.
+        """
         LOG.debug('Container rescue')
         if not self.session.container_defined(instance.name, instance):
             msg = _('Unable to find instance')
             raise exception.NovaException(msg)
 
-        self.session.container_stop(instance.name, instance.host)
-        self._container_local_copy(instance)
-        self.session.container_destroy(instance.name, instance.host,
-                                       instance)
-
-        self.spawn(context, instance, image_meta, injected_files=None,
-                   admin_password=None, network_info=network_info,
-                   block_device_info=None, need_vif_plugged=False,
-                   rescue=True)
-
-    def _container_local_copy(self, instance):
-        container_snapshot = {
-            'name': 'snap',
-            'stateful': False
-        }
-        self.session.container_snapshot(container_snapshot, instance)
-
-        ''' Creating container copy '''
-        container_copy = {
-            "config": None,
-            "name": "%s-backup" % instance.name,
-            "profiles": None,
-            "source": {
-                "source": "%s/snap" % instance.name,
-                "type": "copy"}}
-        self.session.container_copy(container_copy, instance)
+        self.session.container_stop(instance.name, instance.host, instance)
+        self.session.container_move(instance.name,
+                                    {'name': self._rescue_name(instance)},
+                                    instance)
+        try:
+            self.spawn(context, instance, image_meta, injected_files=None,
+                       admin_password=None, network_info=network_info,
+                       block_device_info=None, need_vif_plugged=False,
+                       rescue=True)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE('Failed to start rescue container, '
+                              'restoring the original one'),
+                          instance=instance)
+                self._restore_rescued(instance)
 
     def unrescue(self, instance, network_info):
-        LOG.debug('Conainer unrescue')
-        old_name = '%s-backup' % instance.name
-        container_config = {
-            'name': '%s' % instance.name
-        }
+        LOG.debug('Container unrescue')
+        self._restore_rescued(instance)
+        self.session.container_start(instance.name, instance)
 
-        self.session.container_move(old_name, container_config,
-                                    instance)
+    def _rescue_name(self, instance):
+        return '%s-backup' % instance.name
+
+    def _restore_rescued(self, instance):
         self.session.container_destroy(instance.name,
                                        instance.host,
                                        instance)
+        self.session.container_move(self._rescue_name(instance),
+                                    {'name': instance.name},
+                                    instance)
 
     def _unplug_vifs(self, instance, network_info, ignore_errors):
         """Unplug VIFs from networks."""
@@ -267,22 +278,19 @@ class LXDContainerOperations(object):
 
     def get_console_output(self, context, instance):
         LOG.debug('in console output')
+        return self.container_console.get_console_output(instance)
+
+    def get_console_log(self, instance, offset=0):
+        return self.container_console.get_console_log(instance, offset)
 
-        console_log = self.container_dir.get_console_path(instance.name)
-        if not os.path.exists(console_log):
+    def rotate_console_logs(self):
+        try:
+            instances = self.list_instances()
+        except exception.NovaException as ex:
+            LOG.warn(_LW('Unable to list containers for console log '
+                         'rotation: %s'), ex)
             return
-        uid = pwd.getpwuid(os.getuid()).pw_uid
-        utils.execute('chown', '%s:%s' % (uid, uid),
-                      console_log, run_as_root=True)
-        utils.execute('chmod', '755',
-                      os.path.join(
-                          self.container_dir.get_container_dir(
-                              instance.name), instance.name),
-                      run_as_root=True)
-        with open(console_log, 'rb') as fp:
-            log_data, remaning = utils.last_bytes(fp,
-                                                  MAX_CONSOLE_BYTES)
-            return log_data
+        self.container_console.rotate_console_logs(instances)
 
     def container_attach_interface(self, instance, image_meta, vif):
         try:
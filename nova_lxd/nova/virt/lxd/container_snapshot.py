@@ -14,6 +14,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.from oslo_config import cfg
 
+import os
+import time
+
 from nova.compute import task_states
 from nova import exception
 from nova import i18n
@@ -21,41 +24,114 @@ from nova import image
 
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import units
 
+from nova_lxd.nova.virt.lxd import compression
+from nova_lxd.nova.virt.lxd import image_delta
 from nova_lxd.nova.virt.lxd.session import session
+from nova_lxd.nova.virt.lxd import utils as container_dir
 
 _ = i18n._
+_LI = i18n._LI
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
 IMAGE_API = image.API()
 
+CHUNK_SIZE = 64 * units.Ki
+PROGRESS_INTERVAL = 10
+
+
+class ImageExportReader(object):
+    """File-like view of an LXD image export being uploaded to glance
+
+    Data is handed out chunk by chunk as glance reads it, so memory
+    use does not depend on the size of the image. Progress is logged
+    every PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, response, instance):
+        self.response = response
+        self.instance = instance
+        self.size = int(response.getheader('Content-Length') or 0)
+        self.transferred = 0
+        self.started = self.reported = time.time()
+
+    def read(self, size=None):
+        # Never read the whole export at once, even when asked to.
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        data = self.response.read(size)
+        self.transferred += len(data)
+        now = time.time()
+        if not data or now - self.reported >= PROGRESS_INTERVAL:
+            self.reported = now
+            self._report(now)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read()
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        self.response.close()
+
+    def _report(self, now):
+        elapsed = max(now - self.started, 1e-3)
+        if self.size:
+            progress = '%d%%' % (self.transferred * 100 / self.size)
+        else:
+            progress = 'unknown'
+        LOG.info(_LI('Uploaded %(transferred)d bytes of the snapshot '
+                     '(%(progress)s) at %(rate).1f MB/s'),
+                 {'transferred': self.transferred,
+                  'progress': progress,
+                  'rate': self.transferred / elapsed / units.Mi},
+                 instance=self.instance)
+
 
 class LXDSnapshot(object):
 
     def __init__(self):
         self.session = session.LXDAPISession()
+        self.container_dir = container_dir.LXDContainerDirectories()
 
     def snapshot(self, context, instance, image_id, update_task_state):
+        """Snapshot a container to glance while it keeps running
+
+        The image is published from an LXD snapshot of the container,
+        so the container only has to be consistent at the instant the
+        snapshot is taken. When CONF.lxd.snapshot_freeze is set the
+        container is frozen for that instant; publishing, exporting
+        and uploading the image happen while it is running.
+        """
         LOG.debug('in snapshot')
         update_task_state(task_state=task_states.IMAGE_PENDING_UPLOAD)
 
         snapshot = IMAGE_API.get(context, image_id)
 
         ''' Create a snapshot of the running contianer'''
-        self.create_container_snapshot(snapshot, instance)
+        freeze = (CONF.lxd.snapshot_freeze and
+                  self.session.container_running(instance))
+        if freeze:
+            self.session.container_pause(instance.name, instance)
+        try:
+            self.create_container_snapshot(snapshot, instance)
+        finally:
+            if freeze:
+                self.session.container_unpause(instance.name, instance)
 
         ''' Publish the image to LXD '''
-        self.session.container_stop(instance.name, instance.host, instance)
         fingerprint = self.create_lxd_image(snapshot, instance)
-        self.create_glance_image(
-            context, image_id, snapshot, fingerprint, instance)
 
         update_task_state(task_state=task_states.IMAGE_UPLOADING,
                           expected_state=task_states.IMAGE_PENDING_UPLOAD)
-
-        self.session.container_start(instance)
+        self.create_glance_image(
+            context, image_id, snapshot, fingerprint, instance)
 
     def create_container_snapshot(self, snapshot, instance):
         LOG.debug('Creating container snapshot')
@@ -72,11 +148,13 @@ class LXDSnapshot(object):
                 'type': 'snapshot'
             }
         }
+        compression_algorithm = compression.get_publish_algorithm()
+        if compression_algorithm:
+            image['compression_algorithm'] = compression_algorithm
         LOG.debug(image)
-        (state, data) = self.session.container_publish(image, instance)
+        fingerprint = str(self.session.container_publish(image, instance))
 
         LOG.debug('Creating LXD alias')
-        fingerprint = str(data['metadata']['fingerprint'])
         snapshot_alias = {'name': snapshot['id'],
                           'target': fingerprint}
         LOG.debug(snapshot_alias)
@@ -89,9 +167,61 @@ class LXDSnapshot(object):
         image_metadata = {'name': snapshot['name'],
                           "disk_format": "raw",
                           "container_format": "bare"}
+        parent_path = self._get_delta_parent(instance)
         try:
-            data = self.session.container_export(fingerprint, instance)
-            IMAGE_API.update(context, image_id, image_metadata, data)
+            data = ImageExportReader(
+                self.session.container_export(fingerprint, instance),
+                instance)
+            try:
+                if parent_path:
+                    self._upload_delta(context, image_id, image_metadata,
+                                       data, parent_path, instance)
+                else:
+                    IMAGE_API.update(context, image_id, image_metadata,
+                                     data)
+            finally:
+                data.close()
         except Exception as ex:
             msg = _("Failed: %s") % ex
             raise exception.NovaException(msg)
+
+    def _get_delta_parent(self, instance):
+        """Return the cached rootfs the instance was booted from
+
+        :return: path to the parent rootfs tarball, or None when a
+                 full snapshot has to be uploaded
+        """
+        if not CONF.lxd.snapshot_delta:
+            return None
+        parent_path = self.container_dir.get_container_rootfs_image(
+            {'id': instance.image_ref})
+        if not os.path.exists(parent_path):
+            LOG.info(_LI('Image %(image)s is not cached, uploading a full '
+                         'snapshot'), {'image': instance.image_ref},
+                     instance=instance)
+            return None
+        return parent_path
+
+    def _upload_delta(self, context, image_id, image_metadata, data,
+                      parent_path, instance):
+        delta_path = os.path.join(self.container_dir.get_base_dir(),
+                                  '%s-delta.tar.gz' % image_id)
+        try:
+            stats = image_delta.build_delta(data, parent_path, delta_path,
+                                            instance.image_ref)
+            LOG.info(_LI('Uploading delta snapshot of %(image)s with '
+                         '%(changed)d changed and %(deleted)d deleted '
+                         'entries, %(size)d bytes'),
+                     {'image': instance.image_ref,
+                      'changed': stats['changed'],
+                      'deleted': stats['deleted'],
+                      'size': os.path.getsize(delta_path)},
+                     instance=instance)
+            image_metadata['properties'] = {
+                image_delta.PARENT_PROPERTY: instance.image_ref,
+                image_delta.DELTA_PROPERTY: 'true'}
+            with open(delta_path, 'rb') as delta:
+                IMAGE_API.update(context, image_id, image_metadata, delta)
+        finally:
+            if os.path.exists(delta_path):
+                os.unlink(delta_path)
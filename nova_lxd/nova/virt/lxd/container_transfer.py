@@ -0,0 +1,189 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import re
+import time
+
+import eventlet
+from nova import i18n
+from nova import utils
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import units
+
+from nova_lxd.nova.virt.lxd.session import session
+from nova_lxd.nova.virt.lxd import utils as container_dir
+
+_ = i18n._
+_LI = i18n._LI
+_LW = i18n._LW
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+TRANSFERRED_RE = re.compile(r'^Total transferred file size: ([\d,.]+)',
+                            re.MULTILINE)
+
+SSH = 'ssh -o BatchMode=yes'
+
+# Storage backends that keep the rootfs of a stopped container in
+# place. zfs and lvm only mount it while the container runs.
+RSYNC_STORAGE = ('btrfs', 'dir')
+
+
+class LXDContainerTransfer(object):
+    """Copy a container rootfs between hosts with rsync over ssh
+
+    The top level entries of the rootfs are spread over
+    CONF.lxd.migration_streams rsync processes that run side by side,
+    compressed with CONF.lxd.migration_compress_level and sharing the
+    CONF.lxd.migration_bandwidth cap. Every command line has a fixed
+    shape so the rootwrap filters can pin it down.
+    """
+
+    def __init__(self):
+        self.container_dir = container_dir.LXDContainerDirectories()
+        self.session = session.LXDAPISession()
+
+    def is_supported(self, src_host):
+        """Tell whether rsync can copy a rootfs from a host to this one
+
+        On zfs and lvm the rootfs of a stopped container is an empty
+        mount point, and the dataset or LV mounted over it on start
+        would hide whatever was copied there.
+
+        :param src_host: host the container is migrated from
+        :return: False when either host uses other storage than
+                 RSYNC_STORAGE, or its storage cannot be found
+        """
+        for host in (src_host, CONF.host):
+            try:
+                storage = self.session.host_config(host).get(
+                    'environment', {}).get('storage', 'dir')
+            except Exception as ex:
+                LOG.warn(_LW('Unable to find the storage backend of '
+                             '%(host)s: %(reason)s'),
+                         {'host': host, 'reason': ex})
+                return False
+            if storage not in RSYNC_STORAGE:
+                LOG.warn(_LW('LXD on %(host)s uses %(storage)s storage, '
+                             'which the rsync migration transport does '
+                             'not support'),
+                         {'host': host, 'storage': storage})
+                return False
+        return True
+
+    def transfer(self, instance, src_host):
+        """Copy the rootfs of a container from another host
+
+        The container must exist on this host, and is updated in
+        place, so calling this again only sends what changed.
+
+        :param instance: nova instance
+        :param src_host: host to copy the rootfs from
+        :return: number of bytes transferred
+        """
+        LOG.debug('transfer called for instance', instance=instance)
+        rootfs = self.container_dir.get_container_rootfs(instance.name)
+        source = '%s:%s/' % (src_host, rootfs)
+        dest = '%s/' % rootfs
+        streams = self._get_streams(source)
+
+        start = time.time()
+        pool = eventlet.GreenPool(len(streams))
+        threads = [pool.spawn(self._rsync, instance, index, len(streams),
+                              names, source, dest)
+                   for index, names in enumerate(streams)]
+        transferred = sum(thread.wait() for thread in threads)
+        if len(streams) > 1:
+            self._delete_top_level(source, dest)
+
+        elapsed = max(time.time() - start, 0.001)
+        LOG.info(_LI('Transferred %(size)d MiB of %(instance)s from '
+                     '%(host)s in %(time).1f seconds (%(rate).1f MiB/s)'),
+                 {'size': transferred // units.Mi,
+                  'instance': instance.name,
+                  'host': src_host,
+                  'time': elapsed,
+                  'rate': transferred / float(units.Mi) / elapsed},
+                 instance=instance)
+        return transferred
+
+    def _get_streams(self, source):
+        """Spread the top level rootfs entries over the rsync streams
+
+        :return: list of the entries each stream copies, a single
+                 None entry to copy the whole rootfs in one stream
+        """
+        count = max(CONF.lxd.migration_streams, 1)
+        if count == 1:
+            return [None]
+
+        out, err = utils.execute('rsync', '--list-only', '-e', SSH, source,
+                                 run_as_root=True)
+        names = []
+        for line in out.splitlines():
+            fields = line.split(None, 4)
+            if len(fields) == 5 and fields[4] != '.':
+                names.append(fields[4])
+
+        streams = [[] for i in range(min(count, len(names)))]
+        for index, name in enumerate(sorted(names)):
+            streams[index % len(streams)].append(name)
+        return streams or [None]
+
+    def _get_options(self, count):
+        # A level of 0 leaves compression off, and a limit of 0 means
+        # none, so both options are always passed.
+        bandwidth = CONF.lxd.migration_bandwidth
+        if bandwidth:
+            bandwidth = max(bandwidth // count, 1)
+        return ['-aHAX', '--numeric-ids', '--delete', '--stats',
+                '-e', SSH,
+                '--compress-level=%d' % CONF.lxd.migration_compress_level,
+                '--bwlimit=%d' % bandwidth]
+
+    def _rsync(self, instance, index, count, names, source, dest):
+        start = time.time()
+        command = ['rsync'] + self._get_options(count)
+        kwargs = {}
+        if names is not None:
+            # -a does not recurse into the entries of --files-from.
+            command.extend(['-r', '--files-from=-'])
+            kwargs['process_input'] = '\n'.join(names) + '\n'
+        out, err = utils.execute(*(command + [source, dest]),
+                                 run_as_root=True, **kwargs)
+        match = TRANSFERRED_RE.search(out)
+        transferred = int(re.sub(r'[,.]', '', match.group(1))) if match else 0
+        LOG.info(_LI('Migration stream %(stream)d/%(count)d of %(instance)s '
+                     'finished, %(size)d MiB in %(time).1f seconds'),
+                 {'stream': index + 1, 'count': count,
+                  'instance': instance.name,
+                  'size': transferred // units.Mi,
+                  'time': time.time() - start},
+                 instance=instance)
+        return transferred
+
+    def _delete_top_level(self, source, dest):
+        """Delete top level entries that are gone from the source
+
+        The streams each copy their own entries, so their --delete
+        only reaches below the top level. This pass transfers the top
+        level directory alone, without recursing.
+        """
+        utils.execute('rsync', '--dirs', '--delete', '-lptgoDAX',
+                      '--numeric-ids', '-e', SSH, source, dest,
+                      run_as_root=True)
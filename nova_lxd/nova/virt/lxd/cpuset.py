@@ -0,0 +1,46 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+def parse_cpu_list(spec):
+    """Parse a list of CPUs and ranges like "0-3,6", as found in sysfs
+
+    :return: set of CPUs
+    """
+    cpus = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if part:
+            start, sep, end = part.partition('-')
+            cpus.update(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def format_cpuset(cpus):
+    """Format a set of CPUs as a limits.cpu value
+
+    A lone number is a CPU count to LXD, so a single CPU is written
+    as a range.
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    if len(ranges) == 1:
+        return '%d-%d' % tuple(ranges[0])
+    return ','.join('%d-%d' % (start, end) if start != end else '%d' % start
+                    for start, end in ranges)
@@ -0,0 +1,190 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import json
+import os
+
+import eventlet
+from nova import exception
+from nova import i18n
+import requests
+from six.moves.urllib import parse
+
+from oslo_log import log as logging
+from oslo_utils import units
+
+_ = i18n._
+_LI = i18n._LI
+
+LOG = logging.getLogger(__name__)
+
+READ_SIZE = 64 * units.Ki
+TIMEOUT = 60
+
+
+def get_url(image_meta):
+    """Return an HTTP location of a glance image
+
+    :param image_meta: glance image dict, fetched with its locations
+    :return: URL, or None when the image has no HTTP location
+    """
+    urls = [image_meta.get('direct_url')]
+    urls.extend(location.get('url')
+                for location in image_meta.get('locations') or [])
+    for url in urls:
+        if url and parse.urlparse(url).scheme in ('http', 'https'):
+            return url
+    return None
+
+
+def probe(url):
+    """Tell whether a server answers range requests for a URL
+
+    :return: size of the file, or None without range support
+    """
+    response = requests.head(url, allow_redirects=True, timeout=TIMEOUT)
+    if (response.status_code != 200 or
+            response.headers.get('Accept-Ranges') != 'bytes' or
+            'Content-Length' not in response.headers):
+        return None
+    return int(response.headers['Content-Length'])
+
+
+def progress_path(path):
+    return path + '.parts'
+
+
+class RangedDownload(object):
+    """Download a file over HTTP with parallel range requests
+
+    The file is split in chunks fetched by a pool of workers straight
+    into their place in the preallocated file. Finished chunks are
+    recorded in a progress file next to it, so a failed download is
+    resumed from where it stopped. The md5 checksum is computed as
+    the chunks at the head of the file complete, rather than in a
+    second pass once everything is on disk.
+    """
+
+    def __init__(self, url, path, size, checksum=None, workers=4,
+                 chunk_size=64 * units.Mi):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.checksum = checksum
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.chunks = (size + chunk_size - 1) // chunk_size
+        self.done = set()
+        self.hashed = 0
+        self.md5 = hashlib.md5()
+
+    def fetch(self):
+        """Download the file, resuming a previous attempt if possible"""
+        resume = self._load_progress()
+        if resume:
+            LOG.info(_LI('Resuming download of %(url)s, %(done)d of '
+                         '%(chunks)d chunks done'),
+                     {'url': self.url, 'done': len(self.done),
+                      'chunks': self.chunks})
+        with open(self.path, 'r+b' if resume else 'wb') as fp:
+            fp.truncate(self.size)
+        self._save_progress()
+        self._update_checksum()
+
+        pool = eventlet.GreenPool(self.workers)
+        threads = [pool.spawn(self._fetch_chunk, index)
+                   for index in range(self.chunks)
+                   if index not in self.done]
+        pool.waitall()
+        for thread in threads:
+            # Re-raise the first failure, every finished chunk has
+            # been recorded by now.
+            thread.wait()
+
+        if self.checksum and self.md5.hexdigest() != self.checksum:
+            os.unlink(self.path)
+            os.unlink(progress_path(self.path))
+            raise exception.NovaException(
+                _('Checksum mismatch downloading %(url)s: expected '
+                  '%(expected)s, got %(actual)s') %
+                {'url': self.url, 'expected': self.checksum,
+                 'actual': self.md5.hexdigest()})
+        os.unlink(progress_path(self.path))
+
+    def _fetch_chunk(self, index):
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, self.size) - 1
+        response = requests.get(self.url, stream=True, timeout=TIMEOUT,
+                                headers={'Range': 'bytes=%d-%d' %
+                                         (start, end)})
+        try:
+            if response.status_code != 206:
+                raise exception.NovaException(
+                    _('Range request for %(url)s failed: %(status)s') %
+                    {'url': self.url, 'status': response.status_code})
+            written = 0
+            with open(self.path, 'r+b') as fp:
+                fp.seek(start)
+                for data in response.iter_content(READ_SIZE):
+                    fp.write(data)
+                    written += len(data)
+        finally:
+            response.close()
+        if written != end - start + 1:
+            raise exception.NovaException(
+                _('Short read downloading %(url)s at offset %(offset)d') %
+                {'url': self.url, 'offset': start})
+
+        self.done.add(index)
+        self._save_progress()
+        self._update_checksum()
+
+    def _update_checksum(self):
+        with open(self.path, 'rb') as fp:
+            fp.seek(self.hashed * self.chunk_size)
+            while self.hashed in self.done:
+                remaining = min(self.chunk_size,
+                                self.size - self.hashed * self.chunk_size)
+                while remaining:
+                    data = fp.read(min(READ_SIZE, remaining))
+                    if not data:
+                        break
+                    self.md5.update(data)
+                    remaining -= len(data)
+                self.hashed += 1
+
+    def _progress(self):
+        return {'url': self.url,
+                'size': self.size,
+                'chunk_size': self.chunk_size}
+
+    def _load_progress(self):
+        try:
+            with open(progress_path(self.path)) as fp:
+                progress = json.load(fp)
+        except (IOError, ValueError):
+            return False
+        done = progress.pop('done', [])
+        if progress != self._progress() or not os.path.exists(self.path):
+            return False
+        self.done = set(done)
+        return True
+
+    def _save_progress(self):
+        progress = self._progress()
+        progress['done'] = sorted(self.done)
+        with open(progress_path(self.path), 'w') as fp:
+            json.dump(progress, fp)
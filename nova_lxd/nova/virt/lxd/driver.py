@@ -16,6 +16,7 @@
 
 from __future__ import absolute_import
 
+from keystoneclient import auth as ks_auth
 from nova import exception
 from nova import i18n
 from nova.virt import driver
@@ -23,8 +24,12 @@ import socket
 
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_service import loopingcall
+from oslo_utils import units
 
 
+from nova_lxd.nova.virt.lxd import compression
+from nova_lxd.nova.virt.lxd import container_diagnostics
 from nova_lxd.nova.virt.lxd import container_firewall
 from nova_lxd.nova.virt.lxd import container_migrate
 from nova_lxd.nova.virt.lxd import container_ops
@@ -48,10 +53,146 @@ lxd_opts = [
                default=2,
                help='How often to retry in seconds when a'
                     'request does conflict'),
+    cfg.StrOpt('cgroup_path',
+               default='/sys/fs/cgroup',
+               help='Mount point of the host cgroup hierarchies'),
+    cfg.StrOpt('cgroup_parent',
+               default='lxc',
+               help='Parent cgroup LXD places containers under'),
+    cfg.IntOpt('diagnostics_cache_ttl',
+               default=2,
+               help='How long in seconds a host wide sweep of the '
+                    'container counters is reused for diagnostics'),
+    cfg.IntOpt('console_log_max_bytes',
+               default=10 * units.Mi,
+               help='Size in bytes at which a container console log is '
+                    'rotated into a compressed segment'),
+    cfg.IntOpt('console_log_budget',
+               default=50 * units.Mi,
+               help='Maximum number of bytes the console log and its '
+                    'rotated segments may use per instance'),
+    cfg.IntOpt('console_log_rotate_interval',
+               default=60,
+               help='How often in seconds console logs are checked for '
+                    'rotation, 0 disables the periodic check'),
+    cfg.BoolOpt('rescue_readonly',
+                default=False,
+                help='Attach the rootfs of a rescued instance read-only '
+                     'to the rescue container'),
+    cfg.BoolOpt('snapshot_freeze',
+                default=False,
+                help='Freeze a running container while the LXD snapshot '
+                     'backing an instance snapshot is taken'),
+    cfg.BoolOpt('snapshot_delta',
+                default=False,
+                help='Upload snapshots as the difference to the image '
+                     'the instance was booted from when that image is '
+                     'cached on the host'),
+    cfg.StrOpt('image_compressor',
+               choices=('xz', 'pxz', 'pigz', 'zstd'),
+               help='Compressor LXD runs on published snapshots, unset '
+                    'for the LXD default; pxz and pigz use every CPU. '
+                    'zstd, and xz on python 2.7, cannot be combined with '
+                    'snapshot_delta'),
+    cfg.ListOpt('prewarm_images',
+                default=[],
+                help='Glance images imported into the local LXD image '
+                     'store ahead of the first instance using them'),
+    cfg.StrOpt('prewarm_feed',
+               help='File listing further images to pre-warm, one image '
+                    'id per line, most popular first'),
+    cfg.IntOpt('prewarm_interval',
+               default=0,
+               help='How often in seconds images are pre-warmed, 0 '
+                    'disables pre-warming'),
+    cfg.IntOpt('prewarm_concurrency',
+               default=1,
+               help='Number of images pre-warmed at the same time'),
+    cfg.IntOpt('prewarm_bandwidth',
+               default=0,
+               help='Download rate limit in KiB/s for each pre-warmed '
+                    'image, 0 for none'),
+    cfg.ListOpt('image_peers',
+                default=[],
+                help='LXD hosts whose image stores are searched for an '
+                     'image before downloading it from glance'),
+    cfg.IntOpt('image_download_workers',
+               default=0,
+               help='Parallel range requests used to download images '
+                    'that have an HTTP location, 0 to always download '
+                    'through glance'),
+    cfg.IntOpt('image_download_chunk_size',
+               default=64,
+               help='Size in MiB of each range request of a parallel '
+                    'image download'),
+    cfg.BoolOpt('image_dedup',
+                default=False,
+                help='Share one LXD image between glance images with '
+                     'the same checksum and size instead of importing '
+                     'each of them'),
+    cfg.StrOpt('migration_transport',
+               default='lxd',
+               choices=['lxd', 'rsync'],
+               help='How a container rootfs is copied on migration: '
+                    'the LXD migration websocket, or rsync over ssh '
+                    'as root between the compute hosts, which supports '
+                    'the migration_* tuning options. rsync is only used '
+                    'between hosts with dir or btrfs storage, other '
+                    'hosts fall back to the LXD websocket'),
+    cfg.IntOpt('migration_compress_level',
+               default=0,
+               help='rsync compression level for migrations, 0 to send '
+                    'data uncompressed'),
+    cfg.IntOpt('migration_streams',
+               default=1,
+               help='Number of rsync processes copying a container '
+                    'rootfs side by side'),
+    cfg.IntOpt('migration_bandwidth',
+               default=0,
+               help='Bandwidth cap in KiB/s for a migration, shared by '
+                    'all of its streams, 0 for none'),
+    cfg.BoolOpt('migration_presync',
+                default=True,
+                help='With the rsync transport, copy the rootfs once '
+                     'while the container is still running, so only '
+                     'the changes are copied after it is stopped. Like '
+                     'the transport itself, this only applies between '
+                     'hosts with dir or btrfs storage'),
+    cfg.IntOpt('live_migration_iterations',
+               default=10,
+               help='Maximum number of memory pre-copy rounds of a live '
+                    'migration before the container is stopped for the '
+                    'final copy'),
+    cfg.IntOpt('live_migration_goal',
+               default=70,
+               help='Percentage of the container memory that must be in '
+                    'sync before a live migration stops the container '
+                    'for the final copy'),
+    cfg.IntOpt('live_migration_poll_interval',
+               default=5,
+               help='How often in seconds the progress of a live '
+                    'migration is checked'),
+    cfg.IntOpt('live_migration_max_stalls',
+               default=0,
+               help='Progress checks in a row without the pre-copy '
+                    'advancing after which a live migration freezes the '
+                    'container, so it stops dirtying memory and the '
+                    'copy converges, 0 to never freeze'),
+    cfg.IntOpt('live_migration_completion_timeout',
+               default=0,
+               help='Seconds after which a live migration that has not '
+                    'completed is cancelled, 0 for no limit'),
+    cfg.IntOpt('disk_usage_cache_ttl',
+               default=60,
+               help='How long in seconds the disk usage of the containers, '
+                    'read from the storage backend in one query, is '
+                    'reused'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(lxd_opts, 'lxd')
+# Service credentials used to pre-warm images outside of any request
+ks_auth.register_conf_options(CONF, 'lxd')
 LOG = logging.getLogger(__name__)
 
 
@@ -62,7 +203,7 @@ class LXDDriver(driver.ComputeDriver):
     capabilities = {
         "has_imagecache": False,
         "supports_recreate": False,
-        "supports_migrate_to_same_host": False,
+        "supports_migrate_to_same_host": True,
     }
 
     def __init__(self, virtapi):
@@ -74,9 +215,23 @@ class LXDDriver(driver.ComputeDriver):
         self.container_snapshot = container_snapshot.LXDSnapshot()
         self.container_firewall = container_firewall.LXDContainerFirewall()
         self.container_migrate = container_migrate.LXDContainerMigrate(virtapi)
+        self.container_diagnostics = (
+            container_diagnostics.LXDContainerDiagnostics())
         self.host = host.LXDHost()
 
     def init_host(self, host):
+        compression.check_config()
+        if CONF.lxd.console_log_rotate_interval > 0:
+            console_rotate = loopingcall.FixedIntervalLoopingCall(
+                self.container_ops.rotate_console_logs)
+            console_rotate.start(CONF.lxd.console_log_rotate_interval,
+                                 initial_delay=(
+                                     CONF.lxd.console_log_rotate_interval))
+        if CONF.lxd.prewarm_interval > 0:
+            image_prewarm = loopingcall.FixedIntervalLoopingCall(
+                self.container_ops.image.prewarm_images)
+            image_prewarm.start(CONF.lxd.prewarm_interval,
+                                initial_delay=CONF.lxd.prewarm_interval)
         return self.host.init_host(host)
 
     def get_info(self, instance):
@@ -141,14 +296,17 @@ class LXDDriver(driver.ComputeDriver):
     def get_console_output(self, context, instance):
         return self.container_ops.get_console_output(context, instance)
 
+    def get_console_log(self, context, instance, offset=0):
+        return self.container_ops.get_console_log(instance, offset)
+
     def get_diagnostics(self, instance):
-        raise NotImplementedError()
+        return self.container_diagnostics.get_diagnostics(instance)
 
     def get_instance_diagnostics(self, instance):
-        raise NotImplementedError()
+        return self.container_diagnostics.get_instance_diagnostics(instance)
 
     def get_all_bw_counters(self, instances):
-        raise NotImplementedError()
+        return self.container_diagnostics.get_all_bw_counters(instances)
 
     def get_all_volume_usage(self, context, compute_host_bdms):
         raise NotImplementedError()
@@ -201,6 +359,11 @@ class LXDDriver(driver.ComputeDriver):
                                                         instance,
                                                         network_info)
 
+    def finish_revert_migration(self, context, instance, network_info,
+                                block_device_info=None, power_on=True):
+        return self.container_migrate.finish_revert_migration(
+            context, instance, network_info, block_device_info, power_on)
+
     def pause(self, instance):
         return self.container_ops.pause(instance)
 
@@ -257,6 +420,10 @@ class LXDDriver(driver.ComputeDriver):
         return self.container_migrate.post_live_migration(context, instance,
                                                           block_device_info)
 
+    def post_live_migration_at_source(self, context, instance, network_info):
+        return self.container_migrate.post_live_migration_at_source(
+            context, instance, network_info)
+
     def post_live_migration_at_destination(self, context, instance,
                                            network_info,
                                            block_migration=False,
@@ -278,19 +445,24 @@ class LXDDriver(driver.ComputeDriver):
                                            src_compute_info, dst_compute_info,
                                            block_migration=False,
                                            disk_over_commit=False):
-        raise NotImplementedError()
+        return self.container_migrate.check_can_live_migrate_destination(
+            context, instance, src_compute_info, dst_compute_info,
+            block_migration, disk_over_commit)
 
     def check_can_live_migrate_destination_cleanup(self, context,
                                                    dest_check_data):
-        raise NotImplementedError()
+        return (self.container_migrate
+                .check_can_live_migrate_destination_cleanup(
+                    context, dest_check_data))
 
     def check_can_live_migrate_source(self, context, instance,
                                       dest_check_data, block_device_info=None):
-        raise NotImplementedError()
+        return self.container_migrate.check_can_live_migrate_source(
+            context, instance, dest_check_data)
 
     def get_instance_disk_info(self, instance,
                                block_device_info=None):
-        raise NotImplementedError()
+        return self.host.get_instance_disk_info(instance)
 
     def refresh_security_group_rules(self, security_group_id):
         return (self.container_firewall
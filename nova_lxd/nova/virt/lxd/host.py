@@ -24,7 +24,9 @@ from nova.compute import utils as compute_utils
 from nova.compute import vm_mode
 from nova import exception
 from nova import i18n
+from nova import objects
 from nova import utils
+from nova.virt import hardware
 import os
 import platform
 from pylxd import api
@@ -37,6 +39,9 @@ from oslo_serialization import jsonutils
 from oslo_utils import units
 import psutil
 
+from nova_lxd.nova.virt.lxd import container_disk
+from nova_lxd.nova.virt.lxd import numa
+
 _ = i18n._
 _LW = i18n._LW
 CONF = cfg.CONF
@@ -47,6 +52,7 @@ class LXDHost(object):
 
     def __init__(self):
         self.lxd = api.API()
+        self.container_disk = container_disk.LXDContainerDisk()
 
     def get_available_resource(self, nodename):
         LOG.debug('In get_available_resource')
@@ -59,6 +65,10 @@ class LXDHost(object):
 
         local_memory_info = self._get_memory_mb_usage()
         local_disk_info = self._get_fs_info(CONF.lxd.root_dir)
+        disk_available = self.container_disk.get_available()
+        if disk_available is None:
+            disk_available = local_disk_info['available']
+        numa_topology = self._get_numa_topology()
 
         data = {
             'vcpus': vcpus,
@@ -66,6 +76,9 @@ class LXDHost(object):
             'memory_mb_used': local_memory_info['used'] / units.Mi,
             'local_gb': local_disk_info['total'] / units.Gi,
             'local_gb_used': local_disk_info['used'] / units.Gi,
+            'disk_available_least': (
+                (disk_available -
+                 self.container_disk.get_over_committed()) // units.Gi),
             'vcpus_used': 0,
             'hypervisor_type': 'lxd',
             'hypervisor_version': '011',
@@ -76,11 +89,15 @@ class LXDHost(object):
                     (arch.X86_64, hv_type.LXD, vm_mode.EXE),
                     (arch.I686, hv_type.LXC, vm_mode.EXE),
                     (arch.X86_64, hv_type.LXC, vm_mode.EXE)]),
-            'numa_topology': None,
+            'numa_topology': (numa_topology._to_json()
+                              if numa_topology else None),
         }
 
         return data
 
+    def get_instance_disk_info(self, instance):
+        return self.container_disk.get_instance_disk_info(instance)
+
     def get_host_ip_addr(self):
         ips = compute_utils.get_machine_ips()
         if CONF.my_ip not in ips:
@@ -131,6 +148,37 @@ class LXDHost(object):
             'used': (total - avail) * 1024
         }
 
+    def _get_numa_topology(self):
+        """Build the NUMA topology of the host from sysfs
+
+        Only the CPUs in vcpu_pin_set are given to instances, as with
+        the libvirt driver.
+
+        :return: NUMATopology object, or None without NUMA nodes
+        """
+        cells = numa.get_host_cells()
+        if not cells:
+            return None
+
+        allowed = hardware.get_vcpu_pin_set()
+        page_kb = os.sysconf('SC_PAGE_SIZE') // units.Ki
+        topology_cells = []
+        for cell in cells:
+            cpus = cell['cpus']
+            if allowed:
+                cpus = cpus & allowed
+            siblings = [sibling & cpus for sibling in cell['siblings']
+                        if len(sibling & cpus) > 1]
+            mempages = [objects.NUMAPagesTopology(
+                size_kb=page_kb,
+                total=cell['memory'] * units.Ki // page_kb,
+                used=0)]
+            topology_cells.append(objects.NUMACell(
+                id=cell['id'], cpuset=cpus, memory=cell['memory'],
+                cpu_usage=0, memory_usage=0, pinned_cpus=set(),
+                siblings=siblings, mempages=mempages))
+        return objects.NUMATopology(cells=topology_cells)
+
     def _get_cpuinfo(self):
         cpuinfo = self._get_cpu_info()
 
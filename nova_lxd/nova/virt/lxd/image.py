@@ -16,32 +16,76 @@
 import hashlib
 import io
 import json
+from keystoneclient import auth as ks_auth
+from keystoneclient import session as ks_session
+from nova import context as nova_context
 from nova import exception
 from nova import i18n
 from nova import image
+from nova import rpc
 from nova import utils
 import os
 from pylxd import api
 from pylxd import exceptions as lxd_exceptions
 import tarfile
+import time
 import uuid
 
+import eventlet
+from eventlet import event
 from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
 from oslo_utils import fileutils
+from oslo_utils import units
 
+from nova_lxd.nova.virt.lxd import download
+from nova_lxd.nova.virt.lxd import image_delta
 from nova_lxd.nova.virt.lxd.session import session
 from nova_lxd.nova.virt.lxd import utils as container_dir
 
 _ = i18n._
 _LE = i18n._LE
+_LI = i18n._LI
+_LW = i18n._LW
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 IMAGE_API = image.API()
 
+FINGERPRINT_PROPERTY = 'lxd_fingerprint'
+
+# Imports in flight in this process, by image reference
+_IMPORTS = {}
+
+
+class ImageImport(object):
+    """An image import in flight in this process
+
+    Spawns that join a throttled pre-warm import lift its bandwidth
+    limit, so they do not wait on a deliberately slow download.
+    """
+
+    def __init__(self, bandwidth=0):
+        self.event = event.Event()
+        self.bandwidth = bandwidth
+
+
+class PrewarmInstance(dict):
+    """Stand-in for the instance an image is normally set up for
+
+    setup_image and the session calls it makes only need the image
+    reference and host of the instance, plus an uuid and name for
+    logging.
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
 
 class LXDContainerImage(object):
     """Upload an image from glance to the local LXD image store."""
@@ -51,25 +95,86 @@ class LXDContainerImage(object):
         self.client = session.LXDAPISession()
         self.container_dir = container_dir.LXDContainerDirectories()
         self.lock_path = str(os.path.join(CONF.instances_path, 'locks'))
+        self._auth = None
+        self._auth_session = None
 
-    def setup_image(self, context, instance, image_meta):
+    def setup_image(self, context, instance, image_meta, bandwidth=0):
         """Download an image from glance and upload it to LXD
 
+        Spawns of an image that is already being imported by this
+        process wait for that import instead of queueing up on the
+        image lock, and share its outcome.
+
         :param context: context object
         :param instance: The nova instance
         :param image_meta: Image dict returned by nova.image.glance
+        :param bandwidth: download rate limit in KiB/s, 0 for none
 
         """
         LOG.debug('setup_image called for instance', instance=instance)
+        if self.client.image_defined(instance):
+            return
+
+        image_ref = instance.image_ref
+        inflight = _IMPORTS.get(image_ref)
+        if inflight is not None:
+            if inflight.bandwidth and not bandwidth:
+                LOG.info(_LI('Lifting the bandwidth limit of the import '
+                             'of image %s'), image_ref, instance=instance)
+                inflight.bandwidth = 0
+            start = time.time()
+            try:
+                inflight.event.wait()
+            finally:
+                self._notify_wait(context, instance, 'import',
+                                  time.time() - start)
+            return
+
+        inflight = ImageImport(bandwidth)
+        _IMPORTS[image_ref] = inflight
         try:
-            with lockutils.lock(self.lock_path,
-                                lock_file_prefix=('lxd-image-%s' %
-                                                  instance.image_ref),
-                                external=True):
+            self._import_image(context, instance, image_meta, bandwidth)
+        except Exception as ex:
+            inflight.event.send_exception(ex)
+            raise
+        else:
+            inflight.event.send()
+        finally:
+            del _IMPORTS[image_ref]
+
+    def _import_image(self, context, instance, image_meta, bandwidth):
+        """Import an image into LXD under the inter-process image lock
 
+        The lock is per image, so only imports of the same image wait
+        for each other.
+
+        :param context: context object
+        :param instance: The nova instance
+        :param image_meta: Image dict returned by nova.image.glance
+        :param bandwidth: download rate limit in KiB/s, 0 for none
+
+        """
+        try:
+            start = time.time()
+            with lockutils.lock('lxd-image-%s' % instance.image_ref,
+                                external=True, lock_path=self.lock_path):
+                locked = time.time()
+                self._notify_wait(context, instance, 'lock', locked - start)
+
+                # Another process may have imported the image while
+                # we were waiting for the lock.
                 if self.client.image_defined(instance):
                     return
 
+                if self._alias_duplicate(instance, image_meta):
+                    return
+
+                fingerprint = self._fetch_from_peers(instance, image_meta)
+                if fingerprint is not None:
+                    self._setup_checksum_alias(instance, image_meta,
+                                               fingerprint)
+                    return
+
                 base_dir = self.container_dir.get_base_dir()
                 if not os.path.exists(base_dir):
                     fileutils.ensure_tree(base_dir)
@@ -77,21 +182,30 @@ class LXDContainerImage(object):
                 container_rootfs_img = (
                     self.container_dir.get_container_rootfs_image(
                         image_meta))
-                self._fetch_image(context, image_meta, instance)
+                self._fetch_image(context, image_meta, instance, bandwidth)
 
                 container_manifest_img = self._get_lxd_manifest(instance,
                                                                 image_meta)
                 utils.execute('xz', '-9', container_manifest_img)
+                container_manifest_compressed = container_manifest_img + '.xz'
 
                 self._image_upload(
-                    (container_manifest_img + '.xz', container_rootfs_img),
+                    (container_manifest_compressed, container_rootfs_img),
                     container_manifest_img.split('/')[-1],
                     instance)
 
-                self._setup_alias((container_manifest_img + '.xz',
-                                   container_rootfs_img), instance)
+                fingerprint = self._setup_alias(
+                    (container_manifest_compressed, container_rootfs_img),
+                    instance)
+                self._setup_checksum_alias(instance, image_meta,
+                                           fingerprint)
 
-                os.unlink(container_manifest_img + '.xz')
+                os.unlink(container_manifest_compressed)
+                LOG.info(_LI('Imported image %(image)s in %(time).1f '
+                             'seconds'),
+                         {'image': instance.image_ref,
+                          'time': time.time() - locked},
+                         instance=instance)
 
         except Exception as ex:
             with excutils.save_and_reraise_exception():
@@ -100,19 +214,325 @@ class LXDContainerImage(object):
                           instance=instance)
                 self._cleanup_image(image_meta, instance)
 
-    def _fetch_image(self, context, image_meta, instance):
+    def _notify_wait(self, context, instance, waited_on, wait):
+        """Report how long a spawn waited to get its image
+
+        :param waited_on: 'lock' for the inter-process image lock,
+                          'import' for an import in flight
+        :param wait: seconds waited
+        """
+        LOG.debug('Waited %(time).3f seconds for the %(waited_on)s of '
+                  'image %(image)s',
+                  {'time': wait, 'waited_on': waited_on,
+                   'image': instance.image_ref},
+                  instance=instance)
+        rpc.get_notifier('compute').info(context,
+                                         'compute.nova_lxd.image_wait',
+                                         {'image': instance.image_ref,
+                                          'host': CONF.host,
+                                          'waited_on': waited_on,
+                                          'wait': wait})
+
+    def _fetch_from_peers(self, instance, image_meta):
+        """Copy an image from the LXD image store of a peer host
+
+        Peers are tried in the order of CONF.lxd.image_peers. When the
+        glance image carries a FINGERPRINT_PROPERTY, a peer only
+        qualifies if its copy of the image has that fingerprint.
+        LXD checks the copied image against the fingerprint either way.
+
+        :param instance: nova instance
+        :param image_meta: glance image dict
+        :return: fingerprint of the copied image, or None to fall
+                 back to glance
+        """
+        properties = image_meta.get('properties') or {}
+        expected = properties.get(FINGERPRINT_PROPERTY)
+        for peer in CONF.lxd.image_peers:
+            if peer == CONF.host:
+                continue
+            try:
+                fingerprint = self.client.image_peer_fingerprint(peer,
+                                                                 instance)
+                if fingerprint is None:
+                    continue
+                if expected and fingerprint != expected:
+                    LOG.warn(_LW('Image %(image)s on %(peer)s has '
+                                 'fingerprint %(fingerprint)s, expected '
+                                 '%(expected)s'),
+                             {'image': instance.image_ref, 'peer': peer,
+                              'fingerprint': fingerprint,
+                              'expected': expected},
+                             instance=instance)
+                    continue
+                start = time.time()
+                self.client.image_copy_from_peer(peer, fingerprint,
+                                                 instance)
+                self.client.create_alias({'name': instance.image_ref,
+                                          'target': fingerprint},
+                                         instance)
+                LOG.info(_LI('Copied image %(image)s from %(peer)s in '
+                             '%(time).1f seconds'),
+                         {'image': instance.image_ref, 'peer': peer,
+                          'time': time.time() - start},
+                         instance=instance)
+                return fingerprint
+            except Exception as ex:
+                LOG.warn(_LW('Unable to copy image %(image)s from '
+                             '%(peer)s: %(reason)s'),
+                         {'image': instance.image_ref, 'peer': peer,
+                          'reason': ex},
+                         instance=instance)
+        return None
+
+    def _checksum_alias(self, image_meta):
+        """Return the alias naming the content of a glance image
+
+        The glance checksum is an md5, so the image size is part of
+        the alias as well.
+
+        :return: alias name, or None when deduplication is disabled
+        """
+        if not CONF.lxd.image_dedup:
+            return None
+        checksum = image_meta.get('checksum')
+        size = image_meta.get('size')
+        if not checksum or not size:
+            return None
+        return 'checksum-%s-%s' % (checksum, size)
+
+    def _alias_duplicate(self, instance, image_meta):
+        """Reuse an imported image with the same content
+
+        :param instance: nova instance
+        :param image_meta: glance image dict
+        :return: True if the image was aliased to an existing one
+        """
+        alias = self._checksum_alias(image_meta)
+        if alias is None:
+            return False
+        fingerprint = self.client.alias_target(alias, instance)
+        if fingerprint is None:
+            return False
+        self.client.create_alias({'name': instance.image_ref,
+                                  'target': fingerprint}, instance)
+        LOG.info(_LI('Image %(image)s has the same content as LXD image '
+                     '%(fingerprint)s, skipping the import'),
+                 {'image': instance.image_ref, 'fingerprint': fingerprint},
+                 instance=instance)
+        return True
+
+    def _setup_checksum_alias(self, instance, image_meta, fingerprint):
+        alias = self._checksum_alias(image_meta)
+        if alias is None:
+            return
+        try:
+            self.client.create_alias({'name': alias,
+                                      'target': fingerprint}, instance)
+        except exception.NovaException as ex:
+            # An image with the same content was imported under another
+            # glance id at the same time.
+            LOG.debug('Unable to create alias %(alias)s: %(reason)s',
+                      {'alias': alias, 'reason': ex}, instance=instance)
+
+    def _fetch_image(self, context, image_meta, instance, bandwidth=0):
         """Fetch an image from glance
 
         :param context: nova security object
         :param image_meta: glance image dict
         :param instance: the nova instance object
+        :param bandwidth: download rate limit in KiB/s, 0 for none
 
         """
         LOG.debug('_fetch_iamge called for instance', instance=instance)
         path = self.container_dir.get_container_rootfs_image(
             image_meta)
+        if (CONF.lxd.image_download_workers and not bandwidth and
+                not image_delta.is_delta(image_meta) and
+                self._download_ranged(context, instance, path)):
+            return
+
         with fileutils.remove_path_on_error(path):
-            IMAGE_API.download(context, instance.image_ref, dest_path=path)
+            if image_delta.is_delta(image_meta):
+                self._fetch_delta(context, image_meta, instance, path)
+            elif bandwidth:
+                self._download_throttled(context, instance.image_ref, path,
+                                         bandwidth)
+            else:
+                IMAGE_API.download(context, instance.image_ref,
+                                   dest_path=path)
+
+    def _download_ranged(self, context, instance, path):
+        """Download an image with parallel range requests
+
+        A failed download is left in place and resumed by the next
+        attempt.
+
+        :param context: nova security object
+        :param instance: the nova instance object
+        :param path: where to write the image
+        :return: False when the image has no location serving ranges
+
+        """
+        image_meta = IMAGE_API.get(context, instance.image_ref,
+                                   include_locations=True)
+        url = download.get_url(image_meta)
+        if url is None:
+            return False
+        size = download.probe(url)
+        if size is None:
+            LOG.debug('%s does not serve range requests', url,
+                      instance=instance)
+            return False
+
+        start = time.time()
+        download.RangedDownload(
+            url, path, size,
+            checksum=image_meta.get('checksum'),
+            workers=CONF.lxd.image_download_workers,
+            chunk_size=CONF.lxd.image_download_chunk_size * units.Mi).fetch()
+        LOG.info(_LI('Downloaded image %(image)s in %(time).1f seconds'),
+                 {'image': instance.image_ref, 'time': time.time() - start},
+                 instance=instance)
+        return True
+
+    def _download_throttled(self, context, image_id, path, bandwidth):
+        rate = float(bandwidth * units.Ki)
+        start = time.time()
+        written = 0
+        with open(path, 'wb') as fp:
+            for chunk in IMAGE_API.download(context, image_id):
+                fp.write(chunk)
+                written += len(chunk)
+                inflight = _IMPORTS.get(image_id)
+                if inflight is not None and not inflight.bandwidth:
+                    # A spawn is waiting on this import.
+                    continue
+                delay = written / rate - (time.time() - start)
+                if delay > 0:
+                    eventlet.sleep(delay)
+
+    def prewarm_images(self):
+        """Import hot images before the first instance needs them
+
+        Images listed in CONF.lxd.prewarm_images and in the
+        CONF.lxd.prewarm_feed file are set up exactly like on first
+        boot, at most CONF.lxd.prewarm_concurrency at a time and each
+        downloaded at no more than CONF.lxd.prewarm_bandwidth KiB/s.
+        Images already in the LXD image store are skipped.
+        """
+        image_ids = self._get_prewarm_images()
+        if not image_ids:
+            return
+
+        LOG.debug('Pre-warming images %s', image_ids)
+        try:
+            context = self._get_service_context()
+        except Exception as ex:
+            LOG.warn(_LW('Unable to authenticate to pre-warm images: '
+                         '%s'), ex)
+            return
+        pool = eventlet.GreenPool(CONF.lxd.prewarm_concurrency)
+        for image_id in image_ids:
+            pool.spawn_n(self._prewarm_image, context, image_id)
+        pool.waitall()
+
+    def _get_service_context(self):
+        """Build a context carrying a token of the service user
+
+        Pre-warming runs outside of any request, so there is no user
+        token to hand to glance. The credentials come from the auth
+        plugin configured in the lxd section; the plugin renews the
+        token when it expires.
+
+        :return: nova request context
+        """
+        if self._auth is None:
+            self._auth = ks_auth.load_from_conf_options(CONF, 'lxd')
+            if self._auth is None:
+                LOG.warn(_LW('No auth_plugin set in the lxd section, '
+                             'pre-warming images without a token'))
+                return nova_context.get_admin_context()
+            self._auth_session = ks_session.Session(auth=self._auth)
+        return nova_context.RequestContext(
+            user_id=self._auth.get_user_id(self._auth_session),
+            project_id=self._auth.get_project_id(self._auth_session),
+            auth_token=self._auth.get_token(self._auth_session),
+            is_admin=True)
+
+    def _get_prewarm_images(self):
+        image_ids = list(CONF.lxd.prewarm_images)
+        if CONF.lxd.prewarm_feed:
+            try:
+                with open(CONF.lxd.prewarm_feed) as fp:
+                    for line in fp:
+                        # One image per line, most popular first;
+                        # anything after the id is ignored.
+                        fields = line.split('#', 1)[0].split()
+                        if fields:
+                            image_ids.append(fields[0])
+            except IOError as ex:
+                LOG.warn(_LW('Unable to read image feed %(feed)s: '
+                             '%(reason)s'),
+                         {'feed': CONF.lxd.prewarm_feed, 'reason': ex})
+
+        seen = set()
+        return [image_id for image_id in image_ids
+                if not (image_id in seen or seen.add(image_id))]
+
+    def _prewarm_image(self, context, image_id):
+        instance = PrewarmInstance(uuid=image_id,
+                                   name='prewarm-%s' % image_id,
+                                   image_ref=image_id,
+                                   host=CONF.host)
+        try:
+            if self.client.image_defined(instance):
+                return
+            image_meta = IMAGE_API.get(context, image_id)
+            start = time.time()
+            self.setup_image(context, instance, image_meta,
+                             bandwidth=CONF.lxd.prewarm_bandwidth)
+            LOG.info(_LI('Pre-warmed image %(image)s in %(time).1f seconds'),
+                     {'image': image_id, 'time': time.time() - start})
+        except Exception as ex:
+            LOG.warn(_LW('Failed to pre-warm image %(image)s: %(reason)s'),
+                     {'image': image_id, 'reason': ex})
+
+    def _fetch_delta(self, context, image_meta, instance, path):
+        """Rebuild the rootfs of a delta snapshot from its parent
+
+        :param context: nova security object
+        :param image_meta: glance image dict of the delta snapshot
+        :param instance: the nova instance object
+        :param path: where to write the rebuilt rootfs tarball
+
+        """
+        LOG.debug('_fetch_delta called for instance', instance=instance)
+        parent_id = image_meta['properties'][image_delta.PARENT_PROPERTY]
+        parent_meta = IMAGE_API.get(context, parent_id)
+        parent_path = self.container_dir.get_container_rootfs_image(
+            parent_meta)
+        # The lock of the parent, not of the image being imported: the
+        # in-process lock is keyed by name and is not reentrant.
+        with lockutils.lock('lxd-image-%s' % parent_id, external=True,
+                            lock_path=self.lock_path):
+            if not os.path.exists(parent_path):
+                with fileutils.remove_path_on_error(parent_path):
+                    if image_delta.is_delta(parent_meta):
+                        self._fetch_delta(context, parent_meta, instance,
+                                          parent_path)
+                    else:
+                        IMAGE_API.download(context, parent_id,
+                                           dest_path=parent_path)
+
+        delta_path = path + '.delta'
+        try:
+            IMAGE_API.download(context, image_meta['id'],
+                               dest_path=delta_path)
+            image_delta.apply_delta(parent_path, delta_path, path)
+        finally:
+            if os.path.exists(delta_path):
+                os.unlink(delta_path)
 
     def _get_lxd_manifest(self, instance, image_meta):
         """Creates the LXD manifest, needed for split images
@@ -212,6 +632,7 @@ class LXDContainerImage(object):
 
         :param path: fileystem path of the glance image
         :param instance: nova instance
+        :return: fingerprint of the image
         """
         LOG.debug('_setup_alias called for instance', instance=instance)
 
@@ -226,6 +647,7 @@ class LXDContainerImage(object):
                 'target': fingerprint
             }
             self.client.create_alias(alias_config, instance)
+            return fingerprint
         except lxd_exceptions.APIError as ex:
             raise exception.ImageUnacceptable(
                 image_id=instance.image_ref,
@@ -245,7 +667,10 @@ class LXDContainerImage(object):
             self.container_dir.get_container_manifest_image(
                 image_meta))
 
-        if os.path.exists(container_rootfs_img):
+        # Keep partial parallel downloads around to resume them
+        if (os.path.exists(container_rootfs_img) and
+                not os.path.exists(
+                    download.progress_path(container_rootfs_img))):
             os.unlink(container_rootfs_img)
 
         if os.path.exists(container_manifest):
@@ -0,0 +1,166 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import io
+import json
+import os
+import tarfile
+import time
+
+from oslo_utils import strutils
+
+DELTA_MANIFEST = '.nova-lxd-delta.json'
+PARENT_PROPERTY = 'lxd_parent_image'
+DELTA_PROPERTY = 'lxd_delta'
+
+
+def is_delta(image_meta):
+    """Tell whether a glance image is a delta snapshot
+
+    :param image_meta: glance image dict
+    """
+    properties = image_meta.get('properties') or {}
+    return strutils.bool_from_string(properties.get(DELTA_PROPERTY))
+
+
+def _normalize(name):
+    return os.path.normpath(name)
+
+
+def _rootfs_name(name):
+    """Map an LXD image export entry to its name in the rootfs
+
+    :return: the rootfs relative name, or None for entries outside
+             the rootfs such as metadata.yaml and templates
+    """
+    name = _normalize(name)
+    if name == 'rootfs':
+        return '.'
+    if name.startswith('rootfs/'):
+        return name[len('rootfs/'):]
+    return None
+
+
+def _signature(member, linkname):
+    return (member.type,
+            member.size if member.isfile() else 0,
+            int(member.mtime),
+            member.mode,
+            member.uid,
+            member.gid,
+            linkname,
+            member.devmajor,
+            member.devminor)
+
+
+def _linkname(member, rename):
+    if member.islnk():
+        return rename(member.linkname)
+    return member.linkname
+
+
+def _copy_member(dst, src, member):
+    fileobj = src.extractfile(member) if member.isfile() else None
+    dst.addfile(member, fileobj)
+
+
+def index_rootfs(path):
+    """Index the entries of a rootfs tarball by name
+
+    :param path: path to the rootfs tarball
+    :return: dictionary of entry name to header signature
+    """
+    index = {}
+    with tarfile.open(path, 'r|*') as tar:
+        for member in tar:
+            index[_normalize(member.name)] = _signature(
+                member, _linkname(member, _normalize))
+    return index
+
+
+def build_delta(export, parent_path, delta_path, parent_id):
+    """Write the difference between an image export and its parent
+
+    The delta is a gzipped rootfs tarball holding the entries that
+    differ from the parent, plus a DELTA_MANIFEST entry naming the
+    parent and listing the entries that were removed. Entries are
+    compared on their tar headers (type, size, mtime, mode, ownership
+    and link target), the quick check rsync uses, so nothing is read
+    from the parent but its headers. The export is read as a stream,
+    so it can come straight from the LXD export endpoint.
+
+    :param export: file-like object with the LXD image export
+    :param parent_path: path to the parent rootfs tarball
+    :param delta_path: where to write the delta
+    :param parent_id: glance id of the parent image
+    :return: dictionary with the number of changed and deleted entries
+    """
+    parent = index_rootfs(parent_path)
+    seen = set()
+    changed = set()
+    src = tarfile.open(fileobj=export, mode='r|*')
+    dst = tarfile.open(delta_path, 'w:gz')
+    try:
+        for member in src:
+            name = _rootfs_name(member.name)
+            if name is None:
+                continue
+            seen.add(name)
+            linkname = _linkname(member, _rootfs_name)
+            # A hard link must travel with its target, or the target
+            # would be extracted after the link on restore.
+            if (parent.get(name) == _signature(member, linkname) and
+                    not (member.islnk() and linkname in changed)):
+                continue
+            changed.add(name)
+            member.name = name
+            member.linkname = linkname
+            _copy_member(dst, src, member)
+
+        deleted = sorted(set(parent) - seen)
+        manifest = json.dumps({'parent': parent_id,
+                               'deleted': deleted}).encode('utf-8')
+        info = tarfile.TarInfo(DELTA_MANIFEST)
+        info.size = len(manifest)
+        info.mtime = time.time()
+        dst.addfile(info, io.BytesIO(manifest))
+    finally:
+        dst.close()
+        src.close()
+    return {'changed': len(changed), 'deleted': len(deleted)}
+
+
+def apply_delta(parent_path, delta_path, target_path):
+    """Rebuild a full rootfs tarball from its parent and a delta
+
+    :param parent_path: path to the parent rootfs tarball
+    :param delta_path: path to the delta
+    :param target_path: where to write the rebuilt rootfs tarball
+    """
+    with tarfile.open(delta_path, 'r:*') as delta:
+        manifest = json.loads(
+            delta.extractfile(DELTA_MANIFEST).read().decode('utf-8'))
+        members = [member for member in delta.getmembers()
+                   if member.name != DELTA_MANIFEST]
+        skip = set(manifest['deleted'])
+        skip.update(member.name for member in members)
+
+        with tarfile.open(target_path, 'w:gz') as dst:
+            with tarfile.open(parent_path, 'r|*') as parent:
+                for member in parent:
+                    if _normalize(member.name) not in skip:
+                        _copy_member(dst, parent, member)
+            for member in members:
+                _copy_member(dst, delta, member)
@@ -0,0 +1,118 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import re
+import zlib
+
+from oslo_utils import units
+
+from nova_lxd.nova.virt.lxd import cpuset
+
+NODE_DIR = '/sys/devices/system/node'
+CPU_DIR = '/sys/devices/system/cpu'
+
+NODE_RE = re.compile(r'^node(\d+)$')
+MEMTOTAL_RE = re.compile(r'MemTotal:\s+(\d+) kB')
+
+
+def _read(path):
+    with open(path) as fp:
+        return fp.read()
+
+
+def _get_siblings(cpus):
+    siblings = []
+    for cpu in sorted(cpus):
+        path = os.path.join(CPU_DIR, 'cpu%d' % cpu, 'topology',
+                            'thread_siblings_list')
+        try:
+            thread = cpuset.parse_cpu_list(_read(path))
+        except (IOError, OSError):
+            continue
+        if len(thread) > 1 and thread not in siblings:
+            siblings.append(thread)
+    return siblings
+
+
+def get_host_cells():
+    """Read the NUMA cells of the host from sysfs
+
+    :return: list of cells sorted by id, each a dictionary with the
+             id, the set of CPUs, the memory in MiB and the sets of
+             thread siblings; empty when the kernel shows no NUMA nodes
+    """
+    try:
+        names = os.listdir(NODE_DIR)
+    except OSError:
+        return []
+
+    cells = []
+    for name in names:
+        match = NODE_RE.match(name)
+        if not match:
+            continue
+        path = os.path.join(NODE_DIR, name)
+        cpus = cpuset.parse_cpu_list(_read(os.path.join(path, 'cpulist')))
+        memory = MEMTOTAL_RE.search(_read(os.path.join(path, 'meminfo')))
+        cells.append({'id': int(match.group(1)),
+                      'cpus': cpus,
+                      'memory': int(memory.group(1)) // units.Ki,
+                      'siblings': _get_siblings(cpus)})
+    return sorted(cells, key=lambda cell: cell['id'])
+
+
+def _pick_cpus(cpus, count, instance_uuid):
+    """Pick CPUs of a host cell for an instance cell without pinning
+
+    The CPUs are not reserved. The first one is derived from the
+    instance, so containers spread over the cell and a container gets
+    the same CPUs every time its config is built.
+    """
+    cpus = sorted(cpus)
+    count = min(count, len(cpus))
+    start = zlib.crc32(str(instance_uuid).encode('utf-8')) % len(cpus)
+    return set((cpus + cpus)[start:start + count])
+
+
+def get_placement(numa_topology):
+    """Work out where a container goes from its NUMA topology
+
+    The cells of the topology have been fitted to the host cells by
+    the resource tracker. A cell with dedicated CPUs runs on exactly
+    the CPUs picked for it, other cells on as many CPUs of their host
+    cell as they have vcpus.
+
+    :param numa_topology: InstanceNUMATopology of the instance, or None
+    :return: tuple of the sets of CPUs and memory nodes, or None when
+             the container is not confined to NUMA cells
+    """
+    if not numa_topology:
+        return None
+    host_cells = dict((cell['id'], cell) for cell in get_host_cells())
+    if not host_cells:
+        return None
+
+    cpus = set()
+    mems = set()
+    for cell in numa_topology.cells:
+        mems.add(cell.id)
+        if cell.cpu_pinning:
+            cpus.update(cell.cpu_pinning.values())
+        else:
+            cpus.update(_pick_cpus(host_cells[cell.id]['cpus'],
+                                   len(cell.cpuset),
+                                   numa_topology.instance_uuid))
+    return cpus, mems
@@ -56,6 +56,28 @@ class ContainerMixin(object):
                 LOG.error(_LE('Error from LXD during container_list: '
                               '%(reason)s') % {'reason': ex})
 
+    def host_config(self, host=None):
+        """Configuration and environment of an LXD host
+
+        :param host: LXD host to query, the local one by default
+        :return: dictionary with the config and environment of the
+                 LXD daemon, including the storage backend it uses
+        """
+        LOG.debug('host_config called')
+        try:
+            client = self.get_session(host)
+            (state, data) = client.connection.get_object('GET', '/1.0')
+            return data['metadata']
+        except lxd_exceptions.APIError as ex:
+            msg = _('Failed to communicate with LXD API: %(reason)s') \
+                % {'reason': ex}
+            LOG.error(msg)
+            raise exception.NovaException(msg)
+        except Exception as ex:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE('Error from LXD during host_config: '
+                              '%(reason)s') % {'reason': ex})
+
     def container_update(self, config, instance):
         """Update the LXD configuration of a given container
 
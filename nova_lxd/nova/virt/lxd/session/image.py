@@ -14,6 +14,8 @@
 #    the License for the specific language governing permissions and
 #    limitations under the License.
 
+import json
+
 from nova import exception
 from nova import i18n
 from pylxd import exceptions as lxd_exceptions
@@ -113,3 +115,117 @@ class ImageMixin(object):
                               '%(instance)s: %(reason)s'),
                           {'instance': instance.image_ref, 'reason': e},
                           instance=instance)
+
+    def alias_target(self, alias, instance):
+        """Look up the image an alias points to in the local image store
+
+        :param alias: name of the alias
+        :param instance: The nova instance
+        :return: fingerprint of the image, or None if the alias does
+                 not exist
+
+        """
+        LOG.debug('alias_target called for instance', instance=instance)
+        try:
+            client = self.get_session(instance.host)
+            (state, data) = client.alias_show(alias)
+            return data['metadata']['target']
+        except lxd_exceptions.APIError as ex:
+            if ex.status_code == 404:
+                return None
+            msg = _('Failed to communicate with LXD API %(instance)s:'
+                    ' %(reason)s') % {'instance': instance.image_ref,
+                                      'reason': ex}
+            LOG.error(msg)
+            raise exception.NovaException(msg)
+        except Exception as e:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE('Error from LXD during alias lookup '
+                              '%(instance)s: %(reason)s'),
+                          {'instance': instance.image_ref, 'reason': e},
+                          instance=instance)
+
+    def image_peer_fingerprint(self, peer, instance):
+        """Look up the image of an instance in the image store of a peer
+
+        :param peer: LXD host to ask
+        :param instance: The nova instance
+        :return: fingerprint the image alias points to on the peer, or
+                 None if the peer does not have the image
+
+        """
+        LOG.debug('image_peer_fingerprint called for instance',
+                  instance=instance)
+        try:
+            client = self.get_session(peer)
+            (state, data) = client.alias_show(instance.image_ref)
+            return data['metadata']['target']
+        except lxd_exceptions.APIError as ex:
+            if ex.status_code == 404:
+                return None
+            msg = _('Failed to communicate with LXD API %(instance)s:'
+                    ' %(reason)s') % {'instance': instance.image_ref,
+                                      'reason': ex}
+            LOG.error(msg)
+            raise exception.NovaException(msg)
+        except Exception as e:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE('Error from LXD during image lookup on '
+                              '%(peer)s %(instance)s: %(reason)s'),
+                          {'peer': peer, 'instance': instance.image_ref,
+                           'reason': e},
+                          instance=instance)
+
+    def image_copy_from_peer(self, peer, fingerprint, instance):
+        """Copy an image from a peer into the local LXD image store
+
+        The local LXD daemon pulls the image straight from the peer
+        with a one-time secret issued by the peer, and checks the
+        downloaded image against its fingerprint.
+
+        :param peer: LXD host holding the image
+        :param fingerprint: fingerprint of the image on the peer
+        :param instance: The nova instance
+
+        """
+        LOG.debug('image_copy_from_peer called for instance',
+                  instance=instance)
+        try:
+            peer_client = self.get_session(peer)
+            (state, data) = peer_client.connection.get_object('GET', '/1.0')
+            certificate = data['metadata']['environment']['certificate']
+            (state, data) = peer_client.connection.get_object(
+                'POST', '/1.0/images/%s/secret' % fingerprint)
+            secret = data['metadata']['metadata']['secret']
+
+            source = {
+                'type': 'image',
+                'mode': 'pull',
+                'protocol': 'lxd',
+                'server': 'https://%s:8443' % peer,
+                'certificate': certificate,
+                'secret': secret,
+                'fingerprint': fingerprint
+            }
+            client = self.get_session(instance.host)
+            (state, data) = client.connection.get_object(
+                'POST', '/1.0/images', json.dumps({'source': source}))
+            operation = data.get('operation')
+            self.operation_wait(operation, instance)
+            status, data = self.operation_info(operation, instance)
+            data = data.get('metadata')
+            if not data['status_code'] == 200:
+                raise exception.NovaException(data['metadata'])
+        except lxd_exceptions.APIError as ex:
+            msg = _('Failed to communicate with LXD API %(instance)s:'
+                    ' %(reason)s') % {'instance': instance.image_ref,
+                                      'reason': ex}
+            LOG.error(msg)
+            raise exception.NovaException(msg)
+        except Exception as e:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE('Error from LXD during image copy from '
+                              '%(peer)s %(instance)s: %(reason)s'),
+                          {'peer': peer, 'instance': instance.image_ref,
+                           'reason': e},
+                          instance=instance)
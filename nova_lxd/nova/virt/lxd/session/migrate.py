@@ -67,3 +67,149 @@ class MigrateMixin(object):
                     _LE('Failed to migrate container %(instance)s: %('
                         'reason)s'), {'instance': instance.name,
                                       'reason': ex}, instance=instance)
+
+    def container_live_migrate(self, instance_name, host, instance):
+        """Initialize a live migration of a running container
+
+        LXD checkpoints the container with CRIU and streams its memory
+        along with the rootfs, so it keeps running until the final
+        dump.
+
+        :param instance_name: container name
+        :param host: host to move container from
+        :param instance: nova instance object
+        :return: dictionary with the migration operation and secrets
+
+        """
+        LOG.debug('container_live_migrate called for instance',
+                  instance=instance)
+        try:
+            client = self.get_session(host)
+            (state, data) = client.container_local_move(
+                instance_name, {'migration': True, 'live': True})
+            container_ws = {
+                'operation': str(
+                    data['operation'].split('/1.0/operations/')[-1])
+            }
+            container_ws.update(data['metadata'])
+            return container_ws
+        except lxd_exceptions.APIError as ex:
+            msg = _('Failed to communicate with LXD API %(instance)s:'
+                    ' %(reason)s') % {'instance': instance.name,
+                                      'reason': ex}
+            raise exception.NovaException(msg)
+        except Exception as ex:
+            with excutils.save_and_reraise_exception():
+                LOG.error(
+                    _LE('Failed to live migrate container %(instance)s: '
+                        '%(reason)s'), {'instance': instance.name,
+                                        'reason': ex}, instance=instance)
+
+    def container_migrate_init(self, config, instance, host):
+        """Start creating a container from a migration source
+
+        Unlike container_init this does not wait for the container,
+        so the caller can follow the migration as it runs.
+
+        :param config: LXD container config with the migration source
+        :param instance: nova instance object
+        :param host: host to create the container on
+        :return: the migration operation on host
+
+        """
+        LOG.debug('container_migrate_init called for instance',
+                  instance=instance)
+        try:
+            client = self.get_session(host)
+            (state, data) = client.container_init(config)
+            return data.get('operation')
+        except lxd_exceptions.APIError as ex:
+            msg = _('Failed to communicate with LXD API %(instance)s:'
+                    ' %(reason)s') % {'instance': instance.name,
+                                      'reason': ex}
+            raise exception.NovaException(msg)
+        except Exception as ex:
+            with excutils.save_and_reraise_exception():
+                LOG.error(
+                    _LE('Failed to create container %(instance)s: '
+                        '%(reason)s'), {'instance': instance.name,
+                                        'reason': ex}, instance=instance)
+
+    def migration_status(self, operation, host, instance):
+        """Return the state of a migration operation
+
+        :param operation: the migration operation
+        :param host: host running the operation
+        :param instance: nova instance object
+        :return: operation dictionary with status_code and metadata
+
+        """
+        LOG.debug('migration_status called for instance', instance=instance)
+        try:
+            client = self.get_session(host)
+            (state, data) = client.operation_info(operation)
+            return data.get('metadata')
+        except lxd_exceptions.APIError as ex:
+            msg = _('Failed to communicate with LXD API %(instance)s:'
+                    ' %(reason)s') % {'instance': instance.name,
+                                      'reason': ex}
+            raise exception.NovaException(msg)
+        except Exception as ex:
+            with excutils.save_and_reraise_exception():
+                LOG.error(
+                    _LE('Failed to get migration status of %(instance)s: '
+                        '%(reason)s'), {'instance': instance.name,
+                                        'reason': ex}, instance=instance)
+
+    def migration_cancel(self, operation, host, instance):
+        """Cancel a migration operation
+
+        :param operation: the migration operation
+        :param host: host running the operation
+        :param instance: nova instance object
+
+        """
+        LOG.debug('migration_cancel called for instance', instance=instance)
+        try:
+            client = self.get_session(host)
+            client.operation_delete(operation)
+        except lxd_exceptions.APIError as ex:
+            msg = _('Failed to communicate with LXD API %(instance)s:'
+                    ' %(reason)s') % {'instance': instance.name,
+                                      'reason': ex}
+            raise exception.NovaException(msg)
+        except Exception as ex:
+            with excutils.save_and_reraise_exception():
+                LOG.error(
+                    _LE('Failed to cancel migration of %(instance)s: '
+                        '%(reason)s'), {'instance': instance.name,
+                                        'reason': ex}, instance=instance)
+
+    def migration_resume(self, instance_name, host, instance):
+        """Thaw a container that was frozen while it migrated
+
+        The instance does not live on host yet, so container_unpause
+        would look for the container on the wrong host.
+
+        :param instance_name: container name
+        :param host: host the container migrated to
+        :param instance: nova instance object
+
+        """
+        LOG.debug('migration_resume called for instance', instance=instance)
+        try:
+            client = self.get_session(host)
+            (state, data) = client.container_resume(instance_name,
+                                                    CONF.lxd.timeout)
+            client.wait_container_operation(data.get('operation'), 200, -1)
+        except lxd_exceptions.APIError as ex:
+            msg = _('Failed to communicate with LXD API %(instance)s:'
+                    ' %(reason)s') % {'instance': instance.name,
+                                      'reason': ex}
+            raise exception.NovaException(msg)
+        except Exception as ex:
+            with excutils.save_and_reraise_exception():
+                LOG.error(
+                    _LE('Failed to resume container %(instance)s: '
+                        '%(reason)s'), {'instance': instance.name,
+                                        'reason': ex}, instance=instance)
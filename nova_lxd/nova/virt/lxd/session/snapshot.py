@@ -137,15 +137,22 @@ class SnapshotMixin(object):
     def container_publish(self, image, instance):
         """Publish a container to the local LXD image store
 
-        :param image: LXD fingerprint
+        :param image: image configuration with the publish source
         :param instance: nova instance object
-        :return: True if published, False otherwise
+        :return: fingerprint of the published image
 
         """
         LOG.debug('container_publish called for instance', instance=instance)
         try:
             client = self.get_session(instance.host)
-            return client.image_export(image)
+            (state, data) = client.container_publish(image)
+            operation = data.get('operation')
+            self.operation_wait(operation, instance)
+            status, data = self.operation_info(operation, instance)
+            data = data.get('metadata')
+            if not data['status_code'] == 200:
+                raise exception.NovaException(data['metadata'])
+            return data['metadata']['fingerprint']
         except lxd_exceptions.APIError as ex:
             msg = _('Failed to communicate with LXD API %(instance)s:'
                     ' %(reason)s') % {'instance': instance.name,
@@ -160,9 +167,34 @@ class SnapshotMixin(object):
                      'reason': ex}, instance=instance)
 
     def container_export(self, image, instance):
+        """Stream an image out of the LXD image store
+
+        The export is not read into memory. The caller reads the
+        returned response in chunks and closes it when done.
+
+        :param image: LXD fingerprint
+        :param instance: nova instance object
+        :return: HTTP response carrying the image export
+
+        """
+        LOG.debug('container_export called for instance', instance=instance)
         try:
             client = self.get_session(instance.host)
-            return client.image_export(image)
+            conn = client.connection.get_connection()
+            conn.request('GET', '/1.0/images/%s/export' % image)
+            response = conn.getresponse()
+            if response.status != 200:
+                reason = response.read()
+                conn.close()
+                msg = _('Failed to export image %(image)s: '
+                        '%(reason)s') % {'image': image, 'reason': reason}
+                raise exception.NovaException(msg)
+            return response
         except lxd_exceptions.APIError as ex:
             msg = _('Failed to export image: %s') % ex
             raise exception.NovaException(msg)
+        except Exception as ex:
+            with excutils.save_and_reraise_exception():
+                LOG.error(
+                    _LE('Failed to export image %(image)s: %(reason)s'),
+                    {'image': image, 'reason': ex}, instance=instance)
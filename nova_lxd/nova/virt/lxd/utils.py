@@ -60,6 +60,11 @@ class LXDContainerDirectories(object):
                             instance,
                             'console.log')
 
+    def get_console_segment_dir(self, instance):
+        return os.path.join(CONF.instances_path,
+                            instance,
+                            'console')
+
     def get_container_dir(self, instance):
         return os.path.join(CONF.lxd.root_dir,
                             'containers')
@@ -72,6 +72,36 @@ class SessionContainerTest(test.NoDBTestCase):
             exception.NovaException,
             self.session.container_list)
 
+    def test_host_config(self):
+        """
+        host_config returns the metadata of the LXD host.
+        """
+        metadata = {'config': {}, 'environment': {'storage': 'zfs'}}
+        self.ml.connection.get_object.return_value = (
+            200, {'metadata': metadata})
+        self.assertEqual(metadata, self.session.host_config())
+        self.ml.connection.get_object.assert_called_once_with('GET', '/1.0')
+
+    def test_host_config_remote(self):
+        """
+        host_config queries the LXD daemon of the given host.
+        """
+        with mock.patch.object(self.session, 'get_session') as gs:
+            gs.return_value.connection.get_object.return_value = (
+                200, {'metadata': {}})
+            self.assertEqual({}, self.session.host_config('fake-host'))
+            gs.assert_called_once_with('fake-host')
+
+    def test_host_config_fail(self):
+        """
+        host_config returns an exception.NovaException,
+        if pylxd raises an APIError.
+        """
+        self.ml.connection.get_object.side_effect = (
+            lxd_exceptions.APIError('Fake', 500))
+        self.assertRaises(exception.NovaException,
+                          self.session.host_config)
+
     @stubs.annotated_data(
         ('1', (200, fake_api.fake_operation_info_ok()),
               (200, fake_api.fake_container_state(200)))
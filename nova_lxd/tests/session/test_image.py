@@ -13,12 +13,17 @@
 #    implied. See the License for the specific language governing
 #    permissions and limitations under the License.
 
+import json
+
 import ddt
 import mock
 
+from nova import exception
 from nova import test
+from pylxd import exceptions as lxd_exceptions
 
 from nova_lxd.nova.virt.lxd.session import session
+from nova_lxd.tests import fake_api
 from nova_lxd.tests import stubs
 
 
@@ -52,3 +57,77 @@ class SessionImageTest(test.NoDBTestCase):
         self.assertTrue(self.session.create_alias(alias, instance))
         calls = [mock.call.alias_create(alias)]
         self.assertEqual(calls, self.ml.method_calls)
+
+    @stubs.annotated_data(
+        ('found', {'metadata': {'target': 'abcdef'}}, None, 'abcdef'),
+        ('missing', None, lxd_exceptions.APIError('Not found', 404), None),
+    )
+    def test_image_peer_fingerprint(self, tag, data, side_effect, expected):
+        instance = stubs._fake_instance()
+        self.ml.alias_show.return_value = (200, data)
+        self.ml.alias_show.side_effect = side_effect
+        self.assertEqual(expected,
+                         self.session.image_peer_fingerprint('peer-a',
+                                                             instance))
+        self.ml.alias_show.assert_called_once_with(instance.image_ref)
+
+    def test_image_peer_fingerprint_fail(self):
+        instance = stubs._fake_instance()
+        self.ml.alias_show.side_effect = lxd_exceptions.APIError('Fake', 500)
+        self.assertRaises(exception.NovaException,
+                          self.session.image_peer_fingerprint,
+                          'peer-a', instance)
+
+    def test_image_copy_from_peer(self):
+        instance = stubs._fake_instance()
+        secret = fake_api.fake_operation_info_ok()
+        secret['metadata']['metadata'] = {'secret': 'fake-secret'}
+        self.ml.connection.get_object.side_effect = [
+            (200, {'metadata': {'environment': {'certificate': 'fake-cert'}}}),
+            (202, secret),
+            (202, fake_api.fake_operation_info_ok())]
+        self.ml.operation_info.return_value = (
+            200, fake_api.fake_operation_info_ok())
+        self.session.image_copy_from_peer('peer-a', 'abcdef', instance)
+
+        calls = self.ml.connection.get_object.call_args_list
+        self.assertEqual(mock.call('GET', '/1.0'), calls[0])
+        self.assertEqual(mock.call('POST', '/1.0/images/abcdef/secret'),
+                         calls[1])
+        self.assertEqual('POST', calls[2][0][0])
+        self.assertEqual('/1.0/images', calls[2][0][1])
+        self.assertEqual({'source': {'type': 'image',
+                                     'mode': 'pull',
+                                     'protocol': 'lxd',
+                                     'server': 'https://peer-a:8443',
+                                     'certificate': 'fake-cert',
+                                     'secret': 'fake-secret',
+                                     'fingerprint': 'abcdef'}},
+                         json.loads(calls[2][0][2]))
+        self.ml.wait_container_operation.assert_called_once_with(
+            '/1.0/operation/1234', 200, -1)
+
+    def test_image_copy_from_peer_fail(self):
+        instance = stubs._fake_instance()
+        self.ml.connection.get_object.side_effect = [
+            (200, {'metadata': {'environment': {'certificate': 'fake-cert'}}}),
+            (202, fake_api.fake_operation_info_ok()),
+            (202, fake_api.fake_operation_info_ok())]
+        self.ml.operation_info.return_value = (
+            200, fake_api.fake_operation_info_failed())
+        self.assertRaises(Exception,
+                          self.session.image_copy_from_peer,
+                          'peer-a', 'abcdef', instance)
+
+    @stubs.annotated_data(
+        ('found', {'metadata': {'target': 'abcdef'}}, None, 'abcdef'),
+        ('missing', None, lxd_exceptions.APIError('Not found', 404), None),
+    )
+    def test_alias_target(self, tag, data, side_effect, expected):
+        instance = stubs._fake_instance()
+        self.ml.alias_show.return_value = (200, data)
+        self.ml.alias_show.side_effect = side_effect
+        self.assertEqual(expected,
+                         self.session.alias_target('checksum-abc-10',
+                                                   instance))
+        self.ml.alias_show.assert_called_once_with('checksum-abc-10')
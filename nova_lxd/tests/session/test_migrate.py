@@ -16,9 +16,12 @@
 import ddt
 import mock
 
+from nova import exception
 from nova import test
+from pylxd import exceptions as lxd_exceptions
 
 from nova_lxd.nova.virt.lxd.session import session
+from nova_lxd.tests import fake_api
 from nova_lxd.tests import stubs
 
 
@@ -36,3 +39,74 @@ class SessionMigrateTest(test.NoDBTestCase):
         self.addCleanup(lxd_patcher.stop)
 
         self.session = session.LXDAPISession()
+
+    def test_container_live_migrate(self):
+        instance = stubs._fake_instance()
+        self.ml.container_local_move.return_value = (
+            202, {'operation': '/1.0/operations/1234',
+                  'metadata': {'control': 'fake-control', 'fs': 'fake-fs',
+                               'criu': 'fake-criu'}})
+        self.assertEqual({'operation': '1234', 'control': 'fake-control',
+                          'fs': 'fake-fs', 'criu': 'fake-criu'},
+                         self.session.container_live_migrate(
+                             instance.name, 'fake-host', instance))
+        self.ml.container_local_move.assert_called_once_with(
+            instance.name, {'migration': True, 'live': True})
+
+    def test_container_live_migrate_fail(self):
+        instance = stubs._fake_instance()
+        self.ml.container_local_move.side_effect = (
+            lxd_exceptions.APIError('Fake', 500))
+        self.assertRaises(exception.NovaException,
+                          self.session.container_live_migrate,
+                          instance.name, 'fake-host', instance)
+
+    def test_container_migrate_init(self):
+        instance = stubs._fake_instance()
+        config = mock.Mock()
+        self.ml.container_init.return_value = (
+            202, fake_api.fake_operation_info_ok())
+        self.assertEqual('/1.0/operation/1234',
+                         self.session.container_migrate_init(
+                             config, instance, 'fake-dest'))
+        self.assertEqual([mock.call.container_init(config)],
+                         self.ml.method_calls)
+
+    def test_migration_status(self):
+        instance = stubs._fake_instance()
+        operation = fake_api.fake_operation_info_ok()
+        self.ml.operation_info.return_value = (200, operation)
+        self.assertEqual(operation['metadata'],
+                         self.session.migration_status(
+                             '/1.0/operation/1234', 'fake-dest', instance))
+
+    def test_migration_cancel(self):
+        instance = stubs._fake_instance()
+        self.session.migration_cancel('/1.0/operation/1234', 'fake-dest',
+                                      instance)
+        self.ml.operation_delete.assert_called_once_with(
+            '/1.0/operation/1234')
+
+    def test_migration_resume(self):
+        instance = stubs._fake_instance()
+        self.ml.container_resume.return_value = (
+            202, {'operation': '/1.0/operation/1234'})
+        self.session.migration_resume(instance.name, 'fake-dest', instance)
+        self.assertEqual(
+            [mock.call.container_resume(instance.name, 5),
+             mock.call.wait_container_operation('/1.0/operation/1234',
+                                                200, -1)],
+            self.ml.method_calls)
+
+    @stubs.annotated_data(
+        ('cancel', 'migration_cancel', 'operation_delete',
+         ('/1.0/operation/1234',)),
+        ('resume', 'migration_resume', 'container_resume', ('fake-name',)),
+    )
+    def test_migration_fail(self, tag, method, client_method, args):
+        instance = stubs._fake_instance()
+        getattr(self.ml, client_method).side_effect = (
+            lxd_exceptions.APIError('Fake', 500))
+        self.assertRaises(exception.NovaException,
+                          getattr(self.session, method),
+                          *(args + ('fake-dest', instance)))
@@ -73,9 +73,43 @@ class SessionSnapshotTest(test.NoDBTestCase):
     def test_container_publish(self, tag, side_effect):
         image = mock.Mock()
         instance = stubs._fake_instance()
-        self.ml.image_export.return_value = True
-        self.assertTrue(
-            self.session.container_publish(image, instance))
+        operation = fake_api.fake_operation_info_ok()
+        operation['metadata']['metadata'] = {'fingerprint': 'abcdef'}
+        self.ml.container_publish.return_value = side_effect
+        self.ml.operation_info.return_value = (200, operation)
+        self.assertEqual('abcdef',
+                         self.session.container_publish(image, instance))
         calls = [
-            mock.call.image_export(image)]
+            mock.call.container_publish(image),
+            mock.call.wait_container_operation(
+                '/1.0/operation/1234', 200, -1),
+            mock.call.operation_info('/1.0/operation/1234')]
         self.assertEqual(calls, self.ml.method_calls)
+
+    def test_container_publish_fail(self):
+        image = mock.Mock()
+        instance = stubs._fake_instance()
+        self.ml.container_publish.return_value = (
+            200, fake_api.fake_operation_info_ok())
+        self.ml.operation_info.return_value = (
+            200, fake_api.fake_operation_info_failed())
+        self.assertRaises(exception.NovaException,
+                          self.session.container_publish, image, instance)
+
+    def test_container_export(self):
+        instance = stubs._fake_instance()
+        conn = self.ml.connection.get_connection.return_value
+        conn.getresponse.return_value.status = 200
+        self.assertEqual(conn.getresponse.return_value,
+                         self.session.container_export('abcdef', instance))
+        conn.request.assert_called_once_with(
+            'GET', '/1.0/images/abcdef/export')
+        self.assertFalse(conn.getresponse.return_value.read.called)
+
+    def test_container_export_fail(self):
+        instance = stubs._fake_instance()
+        conn = self.ml.connection.get_connection.return_value
+        conn.getresponse.return_value.status = 404
+        self.assertRaises(exception.NovaException,
+                          self.session.container_export, 'abcdef', instance)
+        conn.close.assert_called_once_with()
@@ -39,7 +39,37 @@ class MockConf(mock.Mock):
             'default_profile': 'fake_profile',
             'root_dir': '/fake/lxd/root',
             'timeout': 20,
-            'retry_interval': 2
+            'retry_interval': 2,
+            'cgroup_path': '/fake/cgroup',
+            'cgroup_parent': 'lxc',
+            'diagnostics_cache_ttl': 2,
+            'console_log_max_bytes': 10 * 1024 * 1024,
+            'console_log_budget': 50 * 1024 * 1024,
+            'console_log_rotate_interval': 0,
+            'rescue_readonly': False,
+            'snapshot_freeze': False,
+            'snapshot_delta': False,
+            'image_compressor': None,
+            'prewarm_images': [],
+            'prewarm_feed': None,
+            'prewarm_interval': 0,
+            'prewarm_concurrency': 1,
+            'prewarm_bandwidth': 0,
+            'image_peers': [],
+            'image_download_workers': 0,
+            'image_download_chunk_size': 64,
+            'image_dedup': False,
+            'migration_transport': 'lxd',
+            'migration_compress_level': 0,
+            'migration_streams': 1,
+            'migration_bandwidth': 0,
+            'migration_presync': True,
+            'live_migration_iterations': 10,
+            'live_migration_goal': 70,
+            'live_migration_poll_interval': 5,
+            'live_migration_max_stalls': 0,
+            'live_migration_completion_timeout': 0,
+            'disk_usage_cache_ttl': 60,
         }
         lxd_default.update(lxd_kwargs)
         self.lxd = mock.Mock(lxd_args, **lxd_default)
@@ -49,7 +79,7 @@ class MockInstance(mock.Mock):
 
     def __init__(self, name='fake-uuid', uuid='fake-uuid',
                  image_ref='mock_image', ephemeral_gb=0, memory_mb=-1,
-                 vcpus=0, *args, **kwargs):
+                 vcpus=0, root_gb=0, *args, **kwargs):
         super(MockInstance, self).__init__(
             uuid=uuid,
             image_ref=image_ref,
@@ -57,7 +87,9 @@ class MockInstance(mock.Mock):
             *args, **kwargs)
         self.uuid = uuid
         self.name = name
-        self.flavor = mock.Mock(memory_mb=memory_mb, vcpus=vcpus)
+        self.flavor = mock.Mock(memory_mb=memory_mb, vcpus=vcpus,
+                                root_gb=root_gb, extra_specs={})
+        self.numa_topology = None
 
 
 def lxd_mock(*args, **kwargs):
@@ -105,7 +137,7 @@ def _fake_instance():
         'memory_mb': 512,
         'root_gb': 10,
         'host': 'fake_host',
-        'expected_attrs': ['system_metadata'],
+        'expected_attrs': ['system_metadata', 'numa_topology'],
     }
     return fake_instance.fake_instance_obj(
         ctxt, **_instance_values)
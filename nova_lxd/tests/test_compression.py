@@ -0,0 +1,62 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import ddt
+import mock
+
+from nova import exception
+from nova import test
+
+from nova_lxd.nova.virt.lxd import compression
+from nova_lxd.tests import stubs
+
+
+@ddt.ddt
+class LXDTestCompression(test.NoDBTestCase):
+
+    def _conf(self, **kwargs):
+        return mock.patch.object(compression, 'CONF',
+                                 stubs.MockConf(lxd_kwargs=kwargs))
+
+    def test_get_publish_algorithm(self):
+        with self._conf():
+            self.assertIsNone(compression.get_publish_algorithm())
+        with self._conf(image_compressor='pigz'):
+            self.assertEqual('pigz', compression.get_publish_algorithm())
+
+    @stubs.annotated_data(
+        ('pigz', 'pigz', {'gz': 'gzopen'}, True),
+        ('pxz', 'pxz', {'gz': 'gzopen', 'xz': 'xzopen'}, True),
+        ('xz_py27', 'xz', {'gz': 'gzopen'}, False),
+        ('zstd', 'zstd', {'gz': 'gzopen', 'xz': 'xzopen'}, False),
+    )
+    def test_is_readable(self, tag, name, open_meth, expected):
+        with mock.patch.object(compression.tarfile.TarFile, 'OPEN_METH',
+                               open_meth):
+            self.assertEqual(expected, compression.is_readable(name))
+
+    @stubs.annotated_data(
+        ('unset', {'snapshot_delta': True}),
+        ('no_delta', {'image_compressor': 'zstd'}),
+        ('readable', {'image_compressor': 'pigz', 'snapshot_delta': True}),
+    )
+    def test_check_config(self, tag, conf):
+        with self._conf(**conf):
+            compression.check_config()
+
+    def test_check_config_unreadable(self):
+        with self._conf(image_compressor='zstd', snapshot_delta=True):
+            self.assertRaises(exception.NovaException,
+                              compression.check_config)
@@ -57,12 +57,167 @@ class LXDTestContainerConfig(test.NoDBTestCase):
             self.container_config.configure_container_config({},
                                                              instance))
 
+    @stubs.annotated_data(
+        ('vcpus', {}, {'limits.cpu': '2'}),
+        ('allowance', {'quota:cpu_quota': '50000'},
+         {'limits.cpu': '2', 'limits.cpu.allowance': '50000us/100000us'}),
+        ('period', {'quota:cpu_quota': '5000', 'quota:cpu_period': '20000'},
+         {'limits.cpu': '2', 'limits.cpu.allowance': '5000us/20000us'}),
+        ('priority', {'lxd:cpu_priority': '3'},
+         {'limits.cpu': '2', 'limits.cpu.priority': '3'}),
+    )
+    def test_get_container_limits(self, tag, extra_specs, expected):
+        instance = stubs.MockInstance()
+        flavor = mock.Mock(memory_mb=-1, vcpus=2, root_gb=0,
+                           extra_specs=extra_specs)
+        self.assertEqual(
+            expected,
+            self.container_config.get_container_limits(instance, flavor))
+
+    @stubs.annotated_data(
+        ('none', {}, None),
+        ('bytes', {'quota:disk_read_bytes_sec': '1048576',
+                   'quota:disk_write_bytes_sec': '524288'},
+         {'limits.read': '1048576', 'limits.write': '524288'}),
+        ('iops', {'quota:disk_write_iops_sec': '100'},
+         {'limits.write': '100iops'}),
+        ('bytes_over_iops', {'quota:disk_read_bytes_sec': '1048576',
+                             'quota:disk_read_iops_sec': '100'},
+         {'limits.read': '1048576'}),
+        ('total', {'quota:disk_total_iops_sec': '200',
+                   'quota:disk_read_iops_sec': '300'},
+         {'limits.read': '300iops', 'limits.write': '200iops'}),
+    )
+    def test_get_container_root_device(self, tag, extra_specs, expected):
+        if expected is not None:
+            expected.update({'path': '/', 'type': 'disk'})
+        flavor = mock.Mock(root_gb=0, extra_specs=extra_specs)
+        self.assertEqual(
+            expected,
+            self.container_config.get_container_root_device(flavor))
+
+    @stubs.annotated_data(
+        ('quota', True, {'size': '10737418240'}),
+        ('no_quota', False, None),
+    )
+    def test_get_container_root_device_size(self, tag, supported, expected):
+        if expected is not None:
+            expected.update({'path': '/', 'type': 'disk'})
+        flavor = mock.Mock(root_gb=10, extra_specs={})
+        with mock.patch.object(self.container_config.disk,
+                               'supports_quota',
+                               mock.Mock(return_value=supported)):
+            self.assertEqual(
+                expected,
+                self.container_config.get_container_root_device(flavor))
+
+    @stubs.annotated_data(
+        ('limited', {'quota:disk_read_iops_sec': '100'},
+         {'root': {'path': '/', 'type': 'disk',
+                   'limits.read': '100iops'}}),
+        ('unlimited', {}, {}),
+    )
+    def test_update_container_limits_disk(self, tag, extra_specs, expected):
+        instance = stubs.MockInstance()
+        flavor = mock.Mock(memory_mb=-1, vcpus=0, root_gb=0,
+                           extra_specs=extra_specs)
+        container_config = {'config': {},
+                            'devices': {'root': {'path': '/',
+                                                 'type': 'disk',
+                                                 'limits.read': '10iops'}}}
+        self.assertEqual(
+            expected,
+            self.container_config.update_container_limits(
+                container_config, instance, flavor)['devices'])
+
+    @mock.patch.object(container_config.numa, 'get_placement')
+    def test_get_container_limits_numa(self, mp):
+        mp.return_value = (set([2, 3, 6, 7]), set([1]))
+        instance = stubs.MockInstance()
+        flavor = mock.Mock(memory_mb=-1, vcpus=2,
+                           extra_specs={'hw:cpu_policy': 'dedicated'})
+        self.assertEqual(
+            {'limits.cpu': '2-3,6-7'},
+            self.container_config.get_container_limits(instance, flavor))
+        self.assertEqual(
+            'lxc.console.logfile=/fake/lxd/root/containers/fake-uuid/'
+            'console.log\n'
+            'lxc.cgroup.cpuset.mems=1\n',
+            self.container_config.get_container_raw_lxc(instance))
+        mp.assert_called_with(instance.numa_topology)
+
+    @mock.patch.object(container_config.numa, 'get_host_cells')
+    def test_get_container_limits_numa_shared(self, mh):
+        mh.return_value = [{'id': 0, 'cpus': set(range(16))}]
+        instance = stubs.MockInstance()
+        instance.numa_topology = mock.Mock(
+            instance_uuid=instance.uuid,
+            cells=[mock.Mock(id=0, cpuset=set([0, 1]), cpu_pinning=None)])
+        flavor = mock.Mock(memory_mb=-1, vcpus=2, extra_specs={})
+        limits = self.container_config.get_container_limits(instance, flavor)
+        cpus = container_config.cpuset.parse_cpu_list(limits['limits.cpu'])
+        self.assertEqual(2, len(cpus))
+        self.assertTrue(cpus <= set(range(16)))
+
     def test_configure_network_devices(self):
         instance = stubs._fake_instance()
         self.assertEqual(None,
                          self.container_config.configure_network_devices(
                              {}, instance, network_info=[]))
 
+    @stubs.annotated_data(
+        ('none', {}, {}),
+        ('inbound', {'quota:vif_inbound_average': '1000',
+                     'quota:vif_inbound_peak': '2000'},
+         {'limits.ingress': '8192kbit'}),
+        ('both', {'quota:vif_inbound_average': '125',
+                  'quota:vif_outbound_average': '250'},
+         {'limits.ingress': '1024kbit', 'limits.egress': '2048kbit'}),
+    )
+    def test_get_network_limits(self, tag, extra_specs, expected):
+        flavor = mock.Mock(extra_specs=extra_specs)
+        self.assertEqual(expected,
+                         self.container_config.get_network_limits(flavor))
+
+    def test_configure_network_devices_limits(self):
+        instance = stubs.MockInstance()
+        instance.flavor.extra_specs = {'quota:vif_outbound_average': '125'}
+        with test.nested(
+            mock.patch.object(self.container_config, 'vif_driver'),
+            mock.patch.object(self.container_config, 'session'),
+        ) as (
+            vif_driver,
+            session
+        ):
+            vif_driver.get_config.return_value = {
+                'bridge': 'fake-br', 'mac_address': 'fake-mac'}
+            vif_driver.get_vif_devname.return_value = 'fake-veth'
+            container_config = self.container_config.configure_network_devices(
+                {}, instance, [mock.Mock()])
+            session.container_update.assert_called_once_with(
+                container_config, instance)
+        self.assertEqual({'fake-br': {'nictype': 'bridged',
+                                      'hwaddr': 'fake-mac',
+                                      'parent': 'fake-br',
+                                      'type': 'nic',
+                                      'host_name': 'fake-veth',
+                                      'limits.egress': '1024kbit'}},
+                         container_config['devices'])
+
+    def test_update_container_limits_network(self):
+        instance = stubs.MockInstance()
+        flavor = mock.Mock(memory_mb=-1, vcpus=0, root_gb=0, extra_specs={
+            'quota:vif_inbound_average': '125'})
+        container_config = {'config': {},
+                            'devices': {'fake-br': {'type': 'nic',
+                                                    'limits.egress': '1kbit'},
+                                        'rescue': {'type': 'disk'}}}
+        self.assertEqual(
+            {'fake-br': {'type': 'nic', 'limits.ingress': '1024kbit'},
+             'rescue': {'type': 'disk'}},
+            self.container_config.update_container_limits(
+                container_config, instance, flavor)['devices'])
+
     def test_configure_container_rescuedisk(self):
         instance = stubs.MockInstance()
         self.assertEqual({
@@ -74,6 +229,49 @@ class LXDTestContainerConfig(test.NoDBTestCase):
             self.container_config.configure_container_rescuedisk(
                 {}, instance))
 
+    def test_configure_container_rescuedisk_readonly(self):
+        instance = stubs.MockInstance()
+        with mock.patch.object(container_config.CONF.lxd,
+                               'rescue_readonly', True):
+            config = self.container_config.configure_container_rescuedisk(
+                {}, instance)
+        self.assertEqual('true', config['devices']['rescue']['readonly'])
+
+    @stubs.annotated_data(
+        ('cold', {}, None, {}),
+        ('live', {'criu': 'fake-criu'}, None, {'live': True}),
+        ('base_image', {}, 'abcdef', {'base-image': 'abcdef'}),
+    )
+    def test_configure_lxd_ws(self, tag, extra, base_image, expected):
+        container_ws = {'operation': '1234', 'control': 'fake-control',
+                        'fs': 'fake-fs'}
+        container_ws.update(extra)
+        source = {'base-image': '',
+                  'mode': 'pull',
+                  'operation': 'wss://fake-host:8443/1.0/operations/1234/'
+                               'websocket',
+                  'secrets': dict({'control': 'fake-control',
+                                   'fs': 'fake-fs'}, **extra),
+                  'type': 'migration'}
+        source.update(expected)
+        self.assertEqual(
+            {'source': source},
+            self.container_config.configure_lxd_ws({}, container_ws,
+                                                   'fake-host', base_image))
+
+    @stubs.annotated_data(
+        ('empty', None, {'type': 'none'}),
+        ('base_image', 'abcdef', {'type': 'image', 'fingerprint': 'abcdef'}),
+    )
+    def test_configure_container_transfer(self, tag, base_image, expected):
+        instance = stubs.MockInstance()
+        with mock.patch.object(self.container_config, 'get_container_config',
+                               mock.Mock(return_value={})):
+            self.assertEqual(
+                {'source': expected},
+                self.container_config.configure_container_transfer(
+                    instance, 'fake-host', base_image))
+
     def test_configure_container_configdrive_wrong_format(self):
         instance = stubs.MockInstance()
         with mock.patch.object(container_config.CONF, 'config_drive_format',
@@ -129,3 +327,22 @@ class LXDTestContainerConfig(test.NoDBTestCase):
              '/fake/instances/path/fake-uuid/config-drive'))
         mi.assert_called_once_with(
             instance, content=injected_files, extra_md={})
+
+    def test_configure_container_resize(self):
+        instance = stubs.MockInstance()
+        flavor = mock.Mock(memory_mb=1024, vcpus=2, root_gb=0,
+                           extra_specs={})
+        with mock.patch.object(self.container_config,
+                               'get_container_config') as mc:
+            mc.return_value = {'config': {'limits.memory': '536870912',
+                                          'limits.cpu': '1',
+                                          'raw.lxc': 'fake'},
+                               'devices': {}}
+            self.assertEqual(
+                {'config': {'limits.memory': '1073741824',
+                            'limits.cpu': '2',
+                            'raw.lxc': 'lxc.console.logfile=/fake/lxd/root/'
+                                       'containers/fake-uuid/console.log\n'},
+                 'devices': {}},
+                self.container_config.configure_container_resize(
+                    instance, flavor))
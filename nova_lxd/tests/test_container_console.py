@@ -0,0 +1,134 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import ddt
+import fixtures
+import mock
+
+from nova import test
+
+from nova_lxd.nova.virt.lxd import container_console
+from nova_lxd.nova.virt.lxd import utils as container_dir
+from nova_lxd.tests import stubs
+
+
+@ddt.ddt
+@mock.patch.object(container_dir, 'CONF', stubs.MockConf())
+class LXDTestContainerConsole(test.NoDBTestCase):
+
+    def setUp(self):
+        super(LXDTestContainerConsole, self).setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        conf_patcher = mock.patch.object(
+            container_console, 'CONF',
+            stubs.MockConf(lxd_kwargs={'console_log_max_bytes': 8,
+                                       'console_log_budget': 1024}))
+        conf_patcher.start()
+        self.addCleanup(conf_patcher.stop)
+
+        self.console = container_console.LXDContainerConsole()
+        self.console_log = os.path.join(self.tempdir, 'console.log')
+        self.segment_dir = os.path.join(self.tempdir, 'console')
+        for name, value in (('get_console_path', self.console_log),
+                            ('get_console_segment_dir', self.segment_dir)):
+            patcher = mock.patch.object(self.console.container_dir, name,
+                                        mock.Mock(return_value=value))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.instance = stubs.MockInstance()
+
+    def _write(self, data):
+        with open(self.console_log, 'ab') as fp:
+            fp.write(data)
+
+    def test_get_console_output_missing(self):
+        self.assertEqual(None,
+                         self.console.get_console_output(self.instance))
+
+    @mock.patch('nova.utils.execute')
+    @mock.patch('pwd.getpwuid',
+                mock.Mock(return_value=mock.Mock(pw_uid=1234, pw_gid=4321)))
+    @mock.patch('os.access', mock.Mock(return_value=False))
+    def test_get_console_output_unreadable(self, me):
+        self._write(b'0123')
+        self.assertEqual(b'0123',
+                         self.console.get_console_output(self.instance))
+        self.assertEqual(
+            [mock.call('chmod', '755',
+                       '/fake/lxd/root/containers/fake-uuid',
+                       run_as_root=True),
+             mock.call('touch', self.console_log, run_as_root=True),
+             mock.call('chown', '1234:4321', self.console_log,
+                       run_as_root=True)],
+            me.call_args_list)
+
+    def test_rotate(self):
+        self._write(b'0123456789')
+        self.console.rotate_console_logs([self.instance.name])
+        self.assertEqual(0, os.path.getsize(self.console_log))
+        self.assertEqual(['console.log.0-10.gz'],
+                         os.listdir(self.segment_dir))
+
+        self._write(b'abcdefghij')
+        self.console.rotate_console_logs([self.instance.name])
+        self.assertEqual(['console.log.0-10.gz', 'console.log.10-20.gz'],
+                         sorted(os.listdir(self.segment_dir)))
+
+    def test_rotate_below_threshold(self):
+        self._write(b'0123')
+        self.console.rotate_console_logs([self.instance.name])
+        self.assertEqual(4, os.path.getsize(self.console_log))
+        self.assertFalse(os.path.exists(self.segment_dir))
+
+    def test_get_console_output_across_segments(self):
+        self._write(b'0123456789')
+        self.console.rotate_console_logs([self.instance.name])
+        self._write(b'abc')
+        with mock.patch.object(container_console, 'MAX_CONSOLE_BYTES', 6):
+            self.assertEqual(b'789abc',
+                             self.console.get_console_output(self.instance))
+
+    @stubs.annotated_data(
+        ('start', 0, b'0123456789abc', 13),
+        ('segment', 4, b'456789abc', 13),
+        ('live', 11, b'bc', 13),
+        ('up_to_date', 13, b'', 13),
+        ('reset', 20, b'0123456789abc', 13),
+    )
+    def test_get_console_log(self, tag, offset, expected, next_offset):
+        self._write(b'0123456789')
+        self.console.rotate_console_logs([self.instance.name])
+        self._write(b'abc')
+        self.assertEqual((expected, next_offset),
+                         self.console.get_console_log(self.instance, offset))
+
+    def test_get_console_log_capped(self):
+        self._write(b'0123')
+        with mock.patch.object(container_console, 'MAX_CONSOLE_BYTES', 2):
+            self.assertEqual((b'23', 4),
+                             self.console.get_console_log(self.instance, 1))
+
+    def test_budget(self):
+        with mock.patch.object(container_console.CONF.lxd,
+                               'console_log_budget', 0):
+            for data in (b'0123456789', b'abcdefghij'):
+                self._write(data)
+                self.console.rotate_console_logs([self.instance.name])
+        self.assertEqual(['console.log.10-20.gz'],
+                         os.listdir(self.segment_dir))
+        self.assertEqual((b'abcdefghij', 20),
+                         self.console.get_console_log(self.instance, 0))
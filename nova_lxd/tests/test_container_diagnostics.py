@@ -0,0 +1,146 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+import mock
+
+from nova import test
+
+from nova_lxd.nova.virt.lxd import container_diagnostics
+from nova_lxd.tests import stubs
+
+NET_DEV = (
+    'Inter-|   Receive                            |  Transmit\n'
+    ' face |bytes    packets errs drop fifo frame compressed multicast|'
+    'bytes    packets errs drop fifo colls carrier compressed\n'
+    '    lo: 100 1 0 0 0 0 0 0 100 1 0 0 0 0 0 0\n'
+    'nicfake-vif: 2000 20 1 2 0 0 0 0 1000 10 3 4 0 0 0 0\n')
+
+
+class LXDTestContainerDiagnostics(test.NoDBTestCase):
+
+    def setUp(self):
+        super(LXDTestContainerDiagnostics, self).setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        conf_patcher = mock.patch.object(
+            container_diagnostics, 'CONF',
+            stubs.MockConf(lxd_kwargs={'cgroup_path': self.tempdir}))
+        conf_patcher.start()
+        self.addCleanup(conf_patcher.stop)
+
+        net_dev = os.path.join(self.tempdir, 'net_dev')
+        with open(net_dev, 'w') as fp:
+            fp.write(NET_DEV)
+        net_patcher = mock.patch.object(container_diagnostics,
+                                        'PROC_NET_DEV', net_dev)
+        net_patcher.start()
+        self.addCleanup(net_patcher.stop)
+
+        self._write_cgroup('cpuacct', 'cpuacct.usage', '300\n')
+        self._write_cgroup('cpuacct', 'cpuacct.usage_percpu', '100 200 \n')
+        self._write_cgroup('memory', 'memory.usage_in_bytes', '1048576\n')
+        self._write_cgroup('memory', 'memory.limit_in_bytes', '2097152\n')
+        self._write_cgroup('blkio', 'blkio.throttle.io_service_bytes',
+                           '8:0 Read 4096\n8:0 Write 8192\n'
+                           '8:0 Total 12288\nTotal 12288\n')
+        self._write_cgroup('blkio', 'blkio.throttle.io_serviced',
+                           '8:0 Read 1\n8:0 Write 2\n'
+                           '8:0 Total 3\nTotal 3\n')
+
+        self.diagnostics = container_diagnostics.LXDContainerDiagnostics()
+        self.instance = stubs.MockInstance(memory_mb=0)
+        self.instance.get_network_info.return_value = [
+            {'id': 'fake-vif', 'address': 'ca:fe:de:ad:be:ef'}]
+
+    def _write_cgroup(self, controller, name, data):
+        path = os.path.join(self.tempdir, controller, 'lxc', 'fake-uuid')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, name), 'w') as fp:
+            fp.write(data)
+
+    def test_parse_net_dev(self):
+        interfaces = container_diagnostics.parse_net_dev(NET_DEV)
+        self.assertEqual(['lo', 'nicfake-vif'], sorted(interfaces))
+        self.assertEqual(2000, interfaces['nicfake-vif']['rx_bytes'])
+        self.assertEqual(10, interfaces['nicfake-vif']['tx_packets'])
+
+    def test_parse_blkio(self):
+        self.assertEqual({'read': 4096, 'write': 8192},
+                         container_diagnostics.parse_blkio(
+                             '8:0 Read 4096\n8:0 Write 8192\n'
+                             '8:0 Total 12288\nTotal 12288\n'))
+
+    def test_get_diagnostics(self):
+        self.assertEqual(
+            {'cpu0_time': 100,
+             'cpu1_time': 200,
+             'root_read': 4096,
+             'root_read_req': 1,
+             'root_write': 8192,
+             'root_write_req': 2,
+             'nicfake-vif_rx': 1000,
+             'nicfake-vif_rx_packets': 10,
+             'nicfake-vif_rx_errors': 3,
+             'nicfake-vif_rx_drop': 4,
+             'nicfake-vif_tx': 2000,
+             'nicfake-vif_tx_packets': 20,
+             'nicfake-vif_tx_errors': 1,
+             'nicfake-vif_tx_drop': 2,
+             'memory': 2048,
+             'memory-actual': 1024},
+            self.diagnostics.get_diagnostics(self.instance))
+
+    def test_get_diagnostics_not_running(self):
+        instance = stubs.MockInstance(name='other-instance')
+        self.assertEqual({}, self.diagnostics.get_diagnostics(instance))
+
+    @mock.patch('nova.virt.configdrive.required_by',
+                mock.Mock(return_value=False))
+    def test_get_instance_diagnostics(self):
+        diags = self.diagnostics.get_instance_diagnostics(
+            self.instance).serialize()
+        self.assertEqual('running', diags['state'])
+        self.assertEqual('lxd', diags['driver'])
+        self.assertEqual([{'time': 100}, {'time': 200}],
+                         diags['cpu_details'])
+        self.assertEqual('ca:fe:de:ad:be:ef',
+                         diags['nic_details'][0]['mac_address'])
+        self.assertEqual(1000, diags['nic_details'][0]['rx_octets'])
+        self.assertEqual(2000, diags['nic_details'][0]['tx_octets'])
+        self.assertEqual(4096, diags['disk_details'][0]['read_bytes'])
+        self.assertEqual({'maximum': 2, 'used': 1},
+                         diags['memory_details'])
+
+    def test_get_all_bw_counters(self):
+        other = stubs.MockInstance(name='other', uuid='other-uuid')
+        other.get_network_info.return_value = [
+            {'id': 'missing-vif', 'address': 'ca:fe:de:ad:be:00'}]
+        self.assertEqual(
+            [{'uuid': 'fake-uuid',
+              'mac_address': 'ca:fe:de:ad:be:ef',
+              'bw_in': 1000,
+              'bw_out': 2000}],
+            self.diagnostics.get_all_bw_counters([self.instance, other]))
+
+    def test_get_host_stats_cached(self):
+        with mock.patch.object(self.diagnostics,
+                               '_sweep_cgroups') as sweep:
+            sweep.return_value = {}
+            self.diagnostics.get_host_stats()
+            self.diagnostics.get_host_stats()
+            self.assertEqual(1, sweep.call_count)
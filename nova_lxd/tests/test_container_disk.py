@@ -0,0 +1,199 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+import ddt
+import mock
+
+from nova import exception
+from nova import test
+
+from nova_lxd.nova.virt.lxd import container_disk
+from nova_lxd.tests import stubs
+
+
+@ddt.ddt
+@mock.patch.object(container_disk, 'CONF', stubs.MockConf())
+class LXDTestContainerDisk(test.NoDBTestCase):
+
+    def setUp(self):
+        super(LXDTestContainerDisk, self).setUp()
+        self.container_disk = container_disk.LXDContainerDisk()
+        session_patcher = mock.patch.object(self.container_disk, 'session')
+        self.ms = session_patcher.start()
+        self.addCleanup(session_patcher.stop)
+        self.ms.container_list.return_value = ['one', 'two-b']
+
+        execute_patcher = mock.patch.object(container_disk.utils, 'execute')
+        self.me = execute_patcher.start()
+        self.addCleanup(execute_patcher.stop)
+
+    def _set_storage(self, backend, config=None):
+        self.ms.host_config.return_value = {
+            'config': config or {},
+            'environment': {'storage': backend}}
+
+    @stubs.annotated_data(
+        ('zfs', 'zfs', {'storage.zfs_pool_name': 'lxd'}, ('zfs', 'lxd')),
+        ('lvm', 'lvm', {'storage.lvm_vg_name': 'vg'}, ('lvm', 'vg')),
+        ('dir', 'dir', {}, ('dir', None)),
+    )
+    def test_get_storage(self, tag, backend, config, expected):
+        self._set_storage(backend, config)
+        self.assertEqual(expected, self.container_disk.get_storage())
+        self.container_disk.get_storage()
+        self.assertEqual(1, self.ms.host_config.call_count)
+
+    @stubs.annotated_data(
+        ('zfs', 'zfs', True),
+        ('btrfs', 'btrfs', True),
+        ('dir', 'dir', False),
+    )
+    def test_supports_quota(self, tag, backend, expected):
+        self._set_storage(backend)
+        self.assertEqual(expected, self.container_disk.supports_quota())
+
+    def test_supports_quota_fail(self):
+        self.ms.host_config.side_effect = exception.NovaException
+        self.assertFalse(self.container_disk.supports_quota())
+
+    def test_get_usage_zfs(self):
+        self._set_storage('zfs', {'storage.zfs_pool_name': 'lxd'})
+        self.me.return_value = ('lxd/containers\t300\t0\n'
+                                'lxd/containers/one\t100\t1073741824\n'
+                                'lxd/containers/two-b\t200\t-\n'
+                                'lxd/containers/gone\t50\t0\n', '')
+        self.assertEqual({'one': {'used': 100, 'quota': 1073741824},
+                          'two-b': {'used': 200, 'quota': None}},
+                         self.container_disk.get_usage())
+        self.me.assert_called_once_with(
+            'zfs', 'list', '-H', '-p', '-o', 'name,used,refquota',
+            '-r', 'lxd/containers', run_as_root=True)
+
+    def test_get_usage_lvm(self):
+        self._set_storage('lvm', {'storage.lvm_vg_name': 'vg'})
+        self.me.return_value = ('  one:2147483648:25.00\n'
+                                '  two--b:1073741824:\n'
+                                '  LXDPool:10737418240:10.00\n', '')
+        self.assertEqual({'one': {'used': 536870912, 'quota': 2147483648},
+                          'two-b': {'used': 1073741824,
+                                    'quota': 1073741824}},
+                         self.container_disk.get_usage())
+        self.me.assert_called_once_with(
+            'lvs', '--noheadings', '--units', 'b', '--nosuffix',
+            '--separator', ':', '-o', 'lv_name,lv_size,data_percent', 'vg',
+            run_as_root=True)
+
+    def test_get_usage_btrfs(self):
+        self._set_storage('btrfs')
+        self.me.side_effect = [
+            ('ID 257 gen 10 top level 5 path containers/one\n'
+             'ID 258 gen 11 top level 5 path containers/two-b\n', ''),
+            ('qgroupid rfer excl max_rfer\n'
+             '-------- ---- ---- --------\n'
+             '0/5 16384 16384 none\n'
+             '0/257 4096 4096 1073741824\n'
+             '0/258 8192 8192 none\n', '')]
+        self.assertEqual({'one': {'used': 4096, 'quota': 1073741824},
+                          'two-b': {'used': 8192, 'quota': None}},
+                         self.container_disk.get_usage())
+
+    def test_get_usage_dir(self):
+        self._set_storage('dir')
+        self.me.return_value = (
+            '4096\t/var/lib/lxd/containers/one\n'
+            '8192\t/var/lib/lxd/containers/two-b\n'
+            '1024\t/var/lib/lxd/containers/gone\n'
+            '13312\t/var/lib/lxd/containers\n', '')
+        self.assertEqual({'one': {'used': 4096, 'quota': None},
+                          'two-b': {'used': 8192, 'quota': None}},
+                         self.container_disk.get_usage())
+        self.me.assert_called_once_with(
+            'du', '-x', '-B1', '-d', '1', '/var/lib/lxd/containers',
+            run_as_root=True, check_exit_code=[0, 1])
+
+    def test_get_available_zfs(self):
+        self._set_storage('zfs', {'storage.zfs_pool_name': 'lxd'})
+        self.me.return_value = ('53687091200\n', '')
+        self.assertEqual(53687091200, self.container_disk.get_available())
+        self.me.assert_called_once_with(
+            'zfs', 'get', '-H', '-p', '-o', 'value', 'available', 'lxd',
+            run_as_root=True)
+
+    @stubs.annotated_data(
+        ('default', {}, 9663676416),
+        ('thinpool', {'storage.lvm_thinpool_name': 'pool'}, 1073741824),
+        ('missing', {'storage.lvm_thinpool_name': 'other'}, None),
+    )
+    def test_get_available_lvm(self, tag, config, expected):
+        config['storage.lvm_vg_name'] = 'vg'
+        self._set_storage('lvm', config)
+        self.me.return_value = ('  one:2147483648:25.00\n'
+                                '  pool:2147483648:50.00\n'
+                                '  LXDPool:10737418240:10.00\n', '')
+        self.assertEqual(expected, self.container_disk.get_available())
+
+    @stubs.annotated_data(
+        ('dir', 'dir'),
+        ('btrfs', 'btrfs'),
+    )
+    def test_get_available_fs(self, tag, backend):
+        self._set_storage(backend)
+        self.assertIsNone(self.container_disk.get_available())
+        self.assertFalse(self.me.called)
+
+    def test_get_available_fail(self):
+        self._set_storage('zfs', {'storage.zfs_pool_name': 'lxd'})
+        self.me.side_effect = (
+            container_disk.processutils.ProcessExecutionError)
+        self.assertIsNone(self.container_disk.get_available())
+
+    @mock.patch.object(container_disk, 'time')
+    def test_get_usage_cached(self, mt):
+        self._set_storage('dir')
+        self.me.return_value = ('', '')
+        mt.time.side_effect = [100, 130, 170]
+        for i in range(3):
+            self.container_disk.get_usage()
+        self.assertEqual(2, self.me.call_count)
+
+    def test_get_instance_disk_info(self):
+        instance = stubs._fake_instance()
+        with mock.patch.object(self.container_disk, 'get_usage') as mu:
+            mu.return_value = {instance.name: {'used': 1024,
+                                               'quota': 4096}}
+            disk_info = json.loads(
+                self.container_disk.get_instance_disk_info(instance))
+        self.assertEqual([{'type': 'lxd',
+                           'path': '/var/lib/lxd/containers/%s/rootfs'
+                                   % instance.name,
+                           'virt_disk_size': 4096,
+                           'disk_size': 1024,
+                           'backing_file': '',
+                           'over_committed_disk_size': 3072}], disk_info)
+
+    @stubs.annotated_data(
+        ('usage', None, 3072),
+        ('fail', exception.NovaException, 0),
+    )
+    def test_get_over_committed(self, tag, side_effect, expected):
+        with mock.patch.object(self.container_disk, 'get_usage') as mu:
+            mu.return_value = {'one': {'used': 1024, 'quota': 4096},
+                               'two': {'used': 8192, 'quota': 4096},
+                               'three': {'used': 1024, 'quota': None}}
+            mu.side_effect = side_effect
+            self.assertEqual(expected,
+                             self.container_disk.get_over_committed())
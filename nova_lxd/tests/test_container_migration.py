@@ -13,8 +13,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import ddt
 import mock
 
+from nova import exception
 from nova import test
 from nova.virt import fake
 
@@ -25,6 +27,7 @@ from nova_lxd.nova.virt.lxd.session import session
 from nova_lxd.tests import stubs
 
 
+@ddt.ddt
 @mock.patch.object(container_migrate, 'CONF', stubs.MockConf())
 @mock.patch.object(session, 'CONF', stubs.MockConf())
 class LXDTestContainerMigrate(test.NoDBTestCase):
@@ -57,12 +60,15 @@ class LXDTestContainerMigrate(test.NoDBTestCase):
                               'container_init'),
             mock.patch.object(container_ops.LXDContainerOperations,
                               'start_container'),
+            mock.patch.object(session.LXDAPISession,
+                              'image_peer_fingerprint'),
         ) as (
             container_defined,
             container_stop,
             container_migrate,
             container_init,
-            container_start
+            container_start,
+            image_peer_fingerprint
         ):
             def side_effect(*args, **kwargs):
                 # XXX: rockstar (7 Dec 2015) - This mock is a little greedy,
@@ -79,3 +85,521 @@ class LXDTestContainerMigrate(test.NoDBTestCase):
                                                             disk_info,
                                                             network_info,
                                                             bdevice_info)))
+
+    @stubs.annotated_data(
+        ('presync', True, ['is_supported', 'transfer', 'container_stop',
+                           'transfer']),
+        ('no_presync', False, ['is_supported', 'container_stop',
+                               'transfer']),
+    )
+    @mock.patch.object(session.LXDAPISession, 'container_migrate')
+    def test_finish_migration_rsync(self, tag, presync, calls, mo):
+        migration = {'source_compute': 'fake-source',
+                     'dest_compute': 'fake-dest'}
+        instance = stubs._fake_instance()
+        conf = stubs.MockConf(lxd_kwargs={'migration_transport': 'rsync',
+                                          'migration_presync': presync})
+        with test.nested(
+            mock.patch.object(container_migrate, 'CONF', conf),
+            mock.patch.object(session.LXDAPISession,
+                              'container_defined'),
+            mock.patch.object(session.LXDAPISession,
+                              'container_stop'),
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'configure_container_transfer'),
+            mock.patch.object(session.LXDAPISession,
+                              'container_init'),
+            mock.patch.object(self.migrate.transfer, 'transfer'),
+            mock.patch.object(container_ops.LXDContainerOperations,
+                              'start_container'),
+            mock.patch.object(session.LXDAPISession,
+                              'container_destroy'),
+            mock.patch.object(session.LXDAPISession,
+                              'image_peer_fingerprint',
+                              mock.Mock(return_value='abcdef')),
+            mock.patch.object(self.migrate.transfer, 'is_supported',
+                              mock.Mock(return_value=True)),
+        ) as (
+            mock_conf,
+            container_defined,
+            container_stop,
+            configure_transfer,
+            container_init,
+            transfer,
+            container_start,
+            container_destroy,
+            image_peer_fingerprint,
+            is_supported
+        ):
+            container_defined.return_value = False
+            manager = mock.Mock()
+            manager.attach_mock(container_stop, 'container_stop')
+            manager.attach_mock(transfer, 'transfer')
+            manager.attach_mock(is_supported, 'is_supported')
+            self.migrate.finish_migration(mock.Mock(), migration, instance,
+                                          mock.Mock(), mock.Mock(),
+                                          mock.Mock())
+            self.assertFalse(mo.called)
+            self.assertEqual(calls,
+                             [call[0] for call in manager.mock_calls])
+            configure_transfer.assert_called_once_with(instance,
+                                                       'fake-source',
+                                                       'abcdef')
+            image_peer_fingerprint.assert_called_once_with('fake-dest',
+                                                           instance)
+            container_init.assert_called_once_with(
+                configure_transfer.return_value, instance, 'fake-dest')
+            transfer.assert_called_with(instance, 'fake-source')
+            container_destroy.assert_called_once_with(
+                instance.name, 'fake-source', instance)
+
+    @mock.patch.object(session.LXDAPISession, 'container_migrate')
+    def test_finish_migration_rsync_unsupported(self, mo):
+        migration = {'source_compute': 'fake-source',
+                     'dest_compute': 'fake-dest'}
+        instance = stubs._fake_instance()
+        conf = stubs.MockConf(lxd_kwargs={'migration_transport': 'rsync',
+                                          'migration_presync': True})
+        with test.nested(
+            mock.patch.object(container_migrate, 'CONF', conf),
+            mock.patch.object(session.LXDAPISession, 'container_defined',
+                              mock.Mock(return_value=False)),
+            mock.patch.object(session.LXDAPISession, 'container_stop'),
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'configure_container_migrate'),
+            mock.patch.object(session.LXDAPISession, 'container_init'),
+            mock.patch.object(self.migrate.transfer, 'transfer'),
+            mock.patch.object(container_ops.LXDContainerOperations,
+                              'start_container'),
+            mock.patch.object(session.LXDAPISession, 'container_destroy'),
+            mock.patch.object(session.LXDAPISession,
+                              'image_peer_fingerprint',
+                              mock.Mock(return_value=None)),
+            mock.patch.object(self.migrate.transfer, 'is_supported',
+                              mock.Mock(return_value=False)),
+        ) as (
+            mock_conf,
+            container_defined,
+            container_stop,
+            configure_migrate,
+            container_init,
+            transfer,
+            container_start,
+            container_destroy,
+            image_peer_fingerprint,
+            is_supported
+        ):
+            self.migrate.finish_migration(mock.Mock(), migration, instance,
+                                          mock.Mock(), mock.Mock(),
+                                          mock.Mock())
+            is_supported.assert_called_once_with('fake-source')
+            self.assertFalse(transfer.called)
+            mo.assert_called_once_with(instance.name, 'fake-source',
+                                       instance)
+            container_init.assert_called_once_with(
+                configure_migrate.return_value, instance, 'fake-dest')
+
+    @stubs.annotated_data(
+        ('ok', None),
+        ('fail', exception.NovaException),
+    )
+    def test_live_migration(self, tag, side_effect):
+        context = mock.Mock()
+        instance = stubs._fake_instance()
+        post_method = mock.Mock()
+        recover_method = mock.Mock()
+        with mock.patch.object(self.migrate, '_live_migration') as lm:
+            lm.side_effect = side_effect
+            if side_effect:
+                self.assertRaises(side_effect, self.migrate.live_migration,
+                                  context, instance, 'fake-dest',
+                                  post_method, recover_method)
+                recover_method.assert_called_once_with(
+                    context, instance, 'fake-dest', False)
+                self.assertFalse(post_method.called)
+            else:
+                self.migrate.live_migration(context, instance, 'fake-dest',
+                                            post_method, recover_method)
+                post_method.assert_called_once_with(
+                    context, instance, 'fake-dest', False)
+                self.assertFalse(recover_method.called)
+            lm.assert_called_once_with(context, instance, 'fake-dest')
+
+    def test_live_migration_engine(self):
+        context = mock.Mock()
+        instance = stubs._fake_instance()
+        container_ws = {'operation': '1234', 'control': 'fake-control',
+                        'fs': 'fake-fs', 'criu': 'fake-criu'}
+        with test.nested(
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'get_container_config'),
+            mock.patch.object(session.LXDAPISession, 'container_update'),
+            mock.patch.object(session.LXDAPISession,
+                              'container_live_migrate'),
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'configure_container_migrate'),
+            mock.patch.object(session.LXDAPISession,
+                              'container_migrate_init'),
+            mock.patch.object(self.migrate, '_monitor_migration'),
+            mock.patch.object(session.LXDAPISession,
+                              'image_peer_fingerprint',
+                              mock.Mock(return_value='abcdef'))
+        ) as (
+            get_container_config,
+            container_update,
+            container_live_migrate,
+            configure_container_migrate,
+            container_migrate_init,
+            monitor_migration,
+            image_peer_fingerprint
+        ):
+            get_container_config.return_value = {
+                'config': {'migration.incremental.memory.goal': '50'}}
+            container_live_migrate.return_value = container_ws
+            configure_container_migrate.return_value = {
+                'config': {'migration.incremental.memory': 'true',
+                           'migration.incremental.memory.iterations': '10',
+                           'migration.incremental.memory.goal': '70'}}
+            self.migrate._live_migration(context, instance, 'fake-dest')
+            container_update.assert_called_once_with(
+                {'config': {'migration.incremental.memory': 'true',
+                            'migration.incremental.memory.iterations': '10',
+                            'migration.incremental.memory.goal': '70'}},
+                instance)
+            self.assertEqual(
+                {'config': {'migration.incremental.memory.goal': '50'}},
+                configure_container_migrate.return_value)
+            configure_container_migrate.assert_called_once_with(
+                instance, container_ws, container_migrate.CONF.host,
+                'abcdef')
+            container_migrate_init.assert_called_once_with(
+                configure_container_migrate.return_value, instance,
+                'fake-dest')
+            monitor_migration.assert_called_once_with(
+                context, container_migrate_init.return_value, 'fake-dest',
+                instance)
+
+    def test_live_migration_engine_fail(self):
+        instance = stubs._fake_instance()
+        configs = [{'config': {}}, {'config': {}}]
+        with test.nested(
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'get_container_config'),
+            mock.patch.object(session.LXDAPISession, 'container_update'),
+            mock.patch.object(session.LXDAPISession,
+                              'container_live_migrate'),
+        ) as (
+            get_container_config,
+            container_update,
+            container_live_migrate
+        ):
+            get_container_config.side_effect = configs
+            container_live_migrate.side_effect = exception.NovaException
+            self.assertRaises(exception.NovaException,
+                              self.migrate._live_migration,
+                              mock.Mock(), instance, 'fake-dest')
+            self.assertEqual(
+                [mock.call(configs[0], instance),
+                 mock.call({'config': {}}, instance)],
+                container_update.call_args_list)
+
+    @stubs.annotated_data(
+        ('converged', 0, [True, True, False], False),
+        ('stalled', 1, [True, True, True], True),
+    )
+    @mock.patch('eventlet.sleep')
+    @mock.patch('nova.rpc.get_notifier')
+    def test_monitor_migration(self, tag, max_stalls, running, paused,
+                               get_notifier, sleep):
+        context = mock.Mock()
+        instance = mock.Mock()
+        conf = stubs.MockConf(
+            lxd_kwargs={'live_migration_max_stalls': max_stalls})
+        with test.nested(
+            mock.patch.object(container_migrate, 'CONF', conf),
+            mock.patch.object(session.LXDAPISession, 'migration_status'),
+            mock.patch.object(session.LXDAPISession, 'container_running'),
+            mock.patch.object(session.LXDAPISession, 'container_pause'),
+            mock.patch.object(session.LXDAPISession, 'container_unpause'),
+            mock.patch.object(session.LXDAPISession, 'migration_resume'),
+            mock.patch.object(container_migrate, 'time')
+        ) as (
+            mock_conf,
+            migration_status,
+            container_running,
+            container_pause,
+            container_unpause,
+            migration_resume,
+            mock_time
+        ):
+            migration_status.side_effect = [
+                {'status_code': 103,
+                 'metadata': {'live_migrate_progress': 'memory 40%'}},
+                {'status_code': 103,
+                 'metadata': {'live_migrate_progress': 'memory 40%'}},
+                {'status_code': 200, 'metadata': {}}]
+            container_running.side_effect = running
+            mock_time.time.side_effect = [100, 110, 120, 130]
+            self.migrate._monitor_migration(context, '/1.0/operations/1234',
+                                            'fake-dest', instance)
+            self.assertEqual(paused, container_pause.called)
+            self.assertEqual(paused, migration_resume.called)
+            self.assertFalse(container_unpause.called)
+        self.assertEqual(40, instance.progress)
+        self.assertEqual(2, sleep.call_count)
+        get_notifier.return_value.info.assert_called_once_with(
+            context, 'compute.nova_lxd.live_migration',
+            {'instance_id': instance.uuid,
+             'source': conf.host,
+             'dest': 'fake-dest',
+             'total_time': 30,
+             'downtime': 10 if paused else 0,
+             'paused': paused})
+
+    @stubs.annotated_data(
+        ('error', [{'status_code': 103, 'metadata': {}},
+                   {'status_code': 400, 'err': 'CRIU dump failed'}],
+         {}, False),
+        ('timeout', [{'status_code': 103, 'metadata': {}},
+                     {'status_code': 103, 'metadata': {}}],
+         {'live_migration_completion_timeout': 15}, True),
+    )
+    def test_monitor_migration_fail(self, tag, status, lxd_kwargs,
+                                    cancelled):
+        instance = stubs._fake_instance()
+        lxd_kwargs['live_migration_max_stalls'] = 1
+        conf = stubs.MockConf(lxd_kwargs=lxd_kwargs)
+        with test.nested(
+            mock.patch.object(container_migrate, 'CONF', conf),
+            mock.patch.object(session.LXDAPISession, 'migration_status'),
+            mock.patch.object(session.LXDAPISession, 'container_running'),
+            mock.patch.object(session.LXDAPISession, 'container_pause'),
+            mock.patch.object(session.LXDAPISession, 'container_unpause'),
+            mock.patch.object(session.LXDAPISession, 'migration_cancel'),
+            mock.patch.object(container_migrate, 'time'),
+            mock.patch('eventlet.sleep')
+        ) as (
+            mock_conf,
+            migration_status,
+            container_running,
+            container_pause,
+            container_unpause,
+            migration_cancel,
+            mock_time,
+            sleep
+        ):
+            mock_time.time.side_effect = [100, 110, 120]
+            migration_status.side_effect = status
+            container_running.return_value = True
+            self.assertRaises(exception.NovaException,
+                              self.migrate._monitor_migration,
+                              mock.Mock(), '/1.0/operations/1234',
+                              'fake-dest', instance)
+            container_pause.assert_called_once_with(instance.name, instance)
+            container_unpause.assert_called_once_with(instance.name,
+                                                      instance)
+            self.assertEqual(cancelled, migration_cancel.called)
+
+    def test_monitor_migration_aborted(self):
+        instance = stubs._fake_instance()
+        conf = stubs.MockConf(lxd_kwargs={'live_migration_max_stalls': 1})
+        with test.nested(
+            mock.patch.object(container_migrate, 'CONF', conf),
+            mock.patch.object(session.LXDAPISession, 'migration_status'),
+            mock.patch.object(session.LXDAPISession, 'container_running',
+                              mock.Mock(return_value=True)),
+            mock.patch.object(session.LXDAPISession, 'container_pause'),
+            mock.patch.object(session.LXDAPISession, 'container_unpause'),
+            mock.patch('eventlet.sleep')
+        ) as (
+            mock_conf,
+            migration_status,
+            container_running,
+            container_pause,
+            container_unpause,
+            sleep
+        ):
+            migration_status.return_value = {
+                'status_code': 103, 'metadata': {}}
+            sleep.side_effect = KeyboardInterrupt
+            self.assertRaises(KeyboardInterrupt,
+                              self.migrate._monitor_migration,
+                              mock.Mock(), '/1.0/operations/1234',
+                              'fake-dest', instance)
+            container_unpause.assert_called_once_with(instance.name,
+                                                      instance)
+
+    @stubs.annotated_data(
+        ('running', True, None),
+        ('stopped', False, exception.MigrationPreCheckError),
+    )
+    @mock.patch('nova.utils.execute')
+    def test_check_can_live_migrate_source(self, tag, running, expected,
+                                           me):
+        instance = stubs._fake_instance()
+        with mock.patch.object(session.LXDAPISession,
+                               'container_running') as container_running:
+            container_running.return_value = running
+            if expected:
+                self.assertRaises(
+                    expected, self.migrate.check_can_live_migrate_source,
+                    mock.Mock(), instance, {})
+            else:
+                self.assertEqual(
+                    {}, self.migrate.check_can_live_migrate_source(
+                        mock.Mock(), instance, {}))
+        me.assert_called_once_with('criu', '--version')
+
+    @mock.patch('nova.utils.execute')
+    def test_check_can_live_migrate_destination_no_criu(self, me):
+        me.side_effect = OSError
+        self.assertRaises(exception.MigrationPreCheckError,
+                          self.migrate.check_can_live_migrate_destination,
+                          mock.Mock(), stubs._fake_instance(), None, None)
+
+    def test_post_live_migration(self):
+        instance = stubs._fake_instance()
+        with test.nested(
+            mock.patch.object(session.LXDAPISession, 'container_defined'),
+            mock.patch.object(session.LXDAPISession, 'container_destroy')
+        ) as (
+            container_defined,
+            container_destroy
+        ):
+            container_defined.return_value = True
+            self.migrate.post_live_migration(mock.Mock(), instance, None)
+            container_destroy.assert_called_once_with(
+                instance.name, container_migrate.CONF.host, instance)
+
+    @stubs.annotated_data(
+        ('shared', 'abcdef', None, 'abcdef'),
+        ('missing', None, None, None),
+        ('fail', None, exception.NovaException, None),
+    )
+    def test_get_base_image(self, tag, fingerprint, side_effect, expected):
+        instance = stubs._fake_instance()
+        with mock.patch.object(session.LXDAPISession,
+                               'image_peer_fingerprint') as mf:
+            mf.return_value = fingerprint
+            mf.side_effect = side_effect
+            self.assertEqual(expected,
+                             self.migrate._get_base_image(instance,
+                                                          'fake-dest'))
+            mf.assert_called_once_with('fake-dest', instance)
+
+    @stubs.annotated_data(
+        ('same_host', '1.2.3.4', True),
+        ('other_host', '5.6.7.8', False),
+    )
+    def test_migrate_disk_and_power_off(self, tag, dest, in_place):
+        instance = stubs._fake_instance()
+        instance.system_metadata = {}
+        flavor = mock.Mock(memory_mb=1024)
+        with test.nested(
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'configure_container_resize'),
+            mock.patch.object(session.LXDAPISession, 'container_update'),
+            mock.patch.object(session.LXDAPISession, 'container_stop'),
+        ) as (
+            configure_container_resize,
+            container_update,
+            container_stop
+        ):
+            self.assertEqual({}, self.migrate.migrate_disk_and_power_off(
+                mock.Mock(), instance, dest, flavor, None))
+            self.assertEqual(in_place, container_update.called)
+            self.assertEqual(
+                in_place,
+                container_ops.RESIZE_IN_PLACE in instance.system_metadata)
+            self.assertFalse(container_stop.called)
+            if in_place:
+                configure_container_resize.assert_called_once_with(
+                    instance, flavor)
+                container_update.assert_called_once_with(
+                    configure_container_resize.return_value, instance)
+
+    def test_migrate_disk_and_power_off_fail(self):
+        instance = stubs._fake_instance()
+        instance.system_metadata = {}
+        with test.nested(
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'configure_container_resize'),
+            mock.patch.object(session.LXDAPISession, 'container_update'),
+        ) as (
+            configure_container_resize,
+            container_update
+        ):
+            container_update.side_effect = exception.NovaException
+            self.assertRaises(exception.InstanceFaultRollback,
+                              self.migrate.migrate_disk_and_power_off,
+                              mock.Mock(), instance, '1.2.3.4',
+                              mock.Mock(), None)
+        self.assertNotIn(container_ops.RESIZE_IN_PLACE,
+                         instance.system_metadata)
+
+    def test_finish_migration_in_place(self):
+        migration = {'source_compute': 'fake_host',
+                     'dest_compute': 'fake_host'}
+        with mock.patch.object(self.migrate, '_migration') as mm:
+            self.migrate.finish_migration(mock.Mock(), migration,
+                                          stubs._fake_instance(), None,
+                                          None, None)
+            self.assertFalse(mm.called)
+
+    @stubs.annotated_data(
+        ('in_place', True),
+        ('migrated', False),
+    )
+    def test_finish_revert_migration(self, tag, in_place):
+        instance = stubs._fake_instance()
+        instance.system_metadata = {}
+        if in_place:
+            instance.system_metadata[container_ops.RESIZE_IN_PLACE] = 'True'
+        with test.nested(
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'configure_container_resize'),
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'get_container_config'),
+            mock.patch.object(session.LXDAPISession, 'container_update'),
+            mock.patch.object(container_ops.LXDContainerOperations,
+                              'start_container'),
+        ) as (
+            configure_container_resize,
+            get_container_config,
+            container_update,
+            start_container
+        ):
+            self.migrate.finish_revert_migration(mock.Mock(), instance,
+                                                 None)
+            self.assertEqual(in_place, container_update.called)
+            self.assertNotEqual(in_place, start_container.called)
+            if in_place:
+                configure_container_resize.assert_called_once_with(
+                    instance, instance.flavor)
+        self.assertNotIn(container_ops.RESIZE_IN_PLACE,
+                         instance.system_metadata)
+
+    def test_update_limits(self):
+        instance = stubs._fake_instance()
+        config = {'config': {'limits.memory': '1', 'limits.cpu': '0-1',
+                             'raw.lxc': 'lxc.cgroup.cpuset.mems=1\n'},
+                  'devices': {}}
+        with test.nested(
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'get_container_limits'),
+            mock.patch.object(container_config.LXDContainerConfig,
+                              'get_container_raw_lxc'),
+        ) as (
+            get_container_limits,
+            get_container_raw_lxc
+        ):
+            get_container_limits.return_value = {'limits.memory': '2',
+                                                 'limits.cpu': '2'}
+            get_container_raw_lxc.return_value = 'fake'
+            self.migrate._update_limits(config, instance)
+            get_container_limits.assert_called_once_with(instance,
+                                                         instance.flavor)
+        self.assertEqual({'config': {'limits.memory': '2',
+                                     'limits.cpu': '2',
+                                     'raw.lxc': 'fake'},
+                          'devices': {}}, config)
@@ -0,0 +1,182 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import io
+import os
+
+import ddt
+import fixtures
+import mock
+
+from nova.compute import task_states
+from nova import test
+
+from nova_lxd.nova.virt.lxd import container_snapshot
+from nova_lxd.tests import stubs
+
+
+class FakeExportResponse(io.BytesIO):
+
+    def getheader(self, name, default=None):
+        if name == 'Content-Length':
+            return str(len(self.getvalue()))
+        return default
+
+
+@ddt.ddt
+class LXDTestContainerSnapshot(test.NoDBTestCase):
+
+    def setUp(self):
+        super(LXDTestContainerSnapshot, self).setUp()
+        self.container_snapshot = container_snapshot.LXDSnapshot()
+        session_patcher = mock.patch.object(self.container_snapshot,
+                                            'session')
+        self.ms = session_patcher.start()
+        self.addCleanup(session_patcher.stop)
+        self.ms.container_publish.return_value = 'abcdef'
+        self.response = FakeExportResponse(b'0123456789')
+        self.ms.container_export.return_value = self.response
+
+        image_patcher = mock.patch.object(container_snapshot, 'IMAGE_API')
+        self.mi = image_patcher.start()
+        self.addCleanup(image_patcher.stop)
+        self.mi.get.return_value = {'id': 'fake-image', 'name': 'snap'}
+
+    @stubs.annotated_data(
+        ('no_freeze', False, True, False),
+        ('freeze', True, True, True),
+        ('freeze_stopped', True, False, False),
+    )
+    def test_snapshot(self, tag, freeze, running, frozen):
+        context = mock.Mock()
+        instance = stubs._fake_instance()
+        update_task_state = mock.Mock()
+        self.ms.container_running.return_value = running
+        conf = stubs.MockConf(lxd_kwargs={'snapshot_freeze': freeze})
+        with mock.patch.object(container_snapshot, 'CONF', conf):
+            self.container_snapshot.snapshot(context, instance,
+                                             'fake-image', update_task_state)
+
+        self.assertFalse(self.ms.container_stop.called)
+        self.assertFalse(self.ms.container_start.called)
+        self.assertEqual(frozen, self.ms.container_pause.called)
+        self.assertEqual(frozen, self.ms.container_unpause.called)
+        self.ms.container_snapshot.assert_called_once_with(
+            {'name': 'snap', 'stateful': False}, instance)
+        self.ms.container_publish.assert_called_once_with(
+            {'source': {'name': '%s/snap' % instance.name,
+                        'type': 'snapshot'}}, instance)
+        self.ms.create_alias.assert_called_once_with(
+            {'name': 'fake-image', 'target': 'abcdef'}, instance)
+        self.ms.container_export.assert_called_once_with('abcdef', instance)
+        update_task_state.assert_called_with(
+            task_state=task_states.IMAGE_UPLOADING,
+            expected_state=task_states.IMAGE_PENDING_UPLOAD)
+        self.assertEqual(1, self.mi.update.call_count)
+        data = self.mi.update.call_args[0][3]
+        self.assertIsInstance(data, container_snapshot.ImageExportReader)
+        self.assertTrue(self.response.closed)
+
+    def test_snapshot_freeze_fail(self):
+        instance = stubs._fake_instance()
+        self.ms.container_running.return_value = True
+        self.ms.container_snapshot.side_effect = Exception
+        conf = stubs.MockConf(lxd_kwargs={'snapshot_freeze': True})
+        with mock.patch.object(container_snapshot, 'CONF', conf):
+            self.assertRaises(Exception,
+                              self.container_snapshot.snapshot,
+                              mock.Mock(), instance, 'fake-image',
+                              mock.Mock())
+        self.ms.container_unpause.assert_called_once_with(instance.name,
+                                                          instance)
+        self.assertFalse(self.ms.container_publish.called)
+
+    def test_snapshot_upload_state(self):
+        calls = []
+        update_task_state = mock.Mock(
+            side_effect=lambda **kw: calls.append(kw['task_state']))
+        self.mi.update.side_effect = lambda *args: calls.append('upload')
+        self.container_snapshot.snapshot(mock.Mock(),
+                                         stubs._fake_instance(),
+                                         'fake-image', update_task_state)
+        self.assertEqual([task_states.IMAGE_PENDING_UPLOAD,
+                          task_states.IMAGE_UPLOADING,
+                          'upload'], calls)
+
+    def test_image_export_reader(self):
+        reader = container_snapshot.ImageExportReader(
+            self.response, stubs._fake_instance())
+        with mock.patch.object(container_snapshot, 'CHUNK_SIZE', 4):
+            self.assertEqual(b'0123', reader.read())
+            self.assertEqual(b'4567', reader.read(-1))
+            self.assertEqual([b'89'], list(reader))
+        self.assertEqual(10, reader.size)
+        self.assertEqual(10, reader.transferred)
+
+    @mock.patch.object(container_snapshot.image_delta, 'build_delta')
+    def test_snapshot_delta(self, build_delta):
+        context = mock.Mock()
+        instance = stubs._fake_instance()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        parent_path = os.path.join(tempdir, 'parent-rootfs.tar.gz')
+        delta_path = os.path.join(tempdir, 'fake-image-delta.tar.gz')
+        open(parent_path, 'w').close()
+
+        def _build_delta(data, parent, delta, parent_id):
+            open(delta, 'w').close()
+            return {'changed': 1, 'deleted': 0}
+        build_delta.side_effect = _build_delta
+
+        conf = stubs.MockConf(lxd_kwargs={'snapshot_delta': True})
+        with test.nested(
+                mock.patch.object(container_snapshot, 'CONF', conf),
+                mock.patch.object(self.container_snapshot.container_dir,
+                                  'get_container_rootfs_image',
+                                  mock.Mock(return_value=parent_path)),
+                mock.patch.object(self.container_snapshot.container_dir,
+                                  'get_base_dir',
+                                  mock.Mock(return_value=tempdir))):
+            self.container_snapshot.snapshot(context, instance,
+                                             'fake-image', mock.Mock())
+
+        build_delta.assert_called_once_with(
+            mock.ANY, parent_path, delta_path, instance.image_ref)
+        metadata = self.mi.update.call_args[0][2]
+        self.assertEqual({'lxd_parent_image': instance.image_ref,
+                          'lxd_delta': 'true'}, metadata['properties'])
+        self.assertFalse(os.path.exists(delta_path))
+
+    def test_snapshot_delta_not_cached(self):
+        conf = stubs.MockConf(lxd_kwargs={'snapshot_delta': True})
+        with test.nested(
+                mock.patch.object(container_snapshot, 'CONF', conf),
+                mock.patch.object(self.container_snapshot.container_dir,
+                                  'get_container_rootfs_image',
+                                  mock.Mock(return_value='/missing'))):
+            self.container_snapshot.snapshot(mock.Mock(),
+                                             stubs._fake_instance(),
+                                             'fake-image', mock.Mock())
+        self.assertNotIn('properties', self.mi.update.call_args[0][2])
+
+    def test_create_lxd_image_compression(self):
+        instance = stubs._fake_instance()
+        conf = stubs.MockConf(lxd_kwargs={'image_compressor': 'pigz'})
+        with mock.patch.object(container_snapshot.compression, 'CONF', conf):
+            self.container_snapshot.create_lxd_image(
+                {'id': 'fake-image', 'name': 'snap'}, instance)
+        self.ms.container_publish.assert_called_once_with(
+            {'source': {'name': '%s/snap' % instance.name,
+                        'type': 'snapshot'},
+             'compression_algorithm': 'pigz'}, instance)
@@ -0,0 +1,144 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import ddt
+import mock
+
+from nova import exception
+from nova import test
+
+from nova_lxd.nova.virt.lxd import container_transfer
+from nova_lxd.tests import stubs
+
+LISTING = """drwxr-xr-x          4,096 2015/12/01 10:00:00 .
+drwxr-xr-x          4,096 2015/12/01 10:00:00 bin
+drwxr-xr-x          4,096 2015/12/01 10:00:00 etc
+drwxr-xr-x          4,096 2015/12/01 10:00:00 usr
+drwxr-xr-x          4,096 2015/12/01 10:00:00 var
+"""
+
+STATS = """Number of files: 10
+Total file size: 4,194,304 bytes
+Total transferred file size: 2,097,152 bytes
+"""
+
+
+@ddt.ddt
+class LXDTestContainerTransfer(test.NoDBTestCase):
+
+    def setUp(self):
+        super(LXDTestContainerTransfer, self).setUp()
+        self.transfer = container_transfer.LXDContainerTransfer()
+        self.source = 'fake-source:/fake/lxd/containers/fake-uuid/rootfs/'
+
+    @stubs.annotated_data(
+        ('single', 1, [None]),
+        ('two', 2, [['bin', 'usr'], ['etc', 'var']]),
+        ('more_than_entries', 8, [['bin'], ['etc'], ['usr'], ['var']]),
+    )
+    @mock.patch('nova.utils.execute')
+    def test_get_streams(self, tag, count, expected, me):
+        me.return_value = (LISTING, '')
+        conf = stubs.MockConf(lxd_kwargs={'migration_streams': count})
+        with mock.patch.object(container_transfer, 'CONF', conf):
+            self.assertEqual(expected,
+                             self.transfer._get_streams(self.source))
+        if count > 1:
+            me.assert_called_once_with('rsync', '--list-only',
+                                       '-e', 'ssh -o BatchMode=yes',
+                                       self.source, run_as_root=True)
+
+    @stubs.annotated_data(
+        ('plain', {}, ['--compress-level=0', '--bwlimit=0']),
+        ('compress', {'migration_compress_level': 3},
+         ['--compress-level=3', '--bwlimit=0']),
+        ('bandwidth', {'migration_bandwidth': 1000},
+         ['--compress-level=0', '--bwlimit=250']),
+    )
+    def test_get_options(self, tag, lxd_kwargs, expected):
+        conf = stubs.MockConf(lxd_kwargs=lxd_kwargs)
+        with mock.patch.object(container_transfer, 'CONF', conf):
+            self.assertEqual(['-aHAX', '--numeric-ids', '--delete',
+                              '--stats', '-e', 'ssh -o BatchMode=yes'] +
+                             expected,
+                             self.transfer._get_options(4))
+
+    @stubs.annotated_data(
+        ('dir', ['dir', 'dir'], True),
+        ('btrfs', ['btrfs', 'dir'], True),
+        ('zfs_source', ['zfs', 'dir'], False),
+        ('lvm_dest', ['dir', 'lvm'], False),
+    )
+    def test_is_supported(self, tag, storage, expected):
+        with mock.patch.object(self.transfer.session,
+                               'host_config') as host_config:
+            host_config.side_effect = [{'environment': {'storage': backend}}
+                                       for backend in storage]
+            self.assertEqual(expected,
+                             self.transfer.is_supported('fake-source'))
+            self.assertEqual(mock.call('fake-source'),
+                             host_config.call_args_list[0])
+
+    def test_is_supported_fail(self):
+        with mock.patch.object(self.transfer.session,
+                               'host_config') as host_config:
+            host_config.side_effect = exception.NovaException
+            self.assertFalse(self.transfer.is_supported('fake-source'))
+
+    @mock.patch('nova.utils.execute')
+    def test_transfer(self, me):
+        instance = stubs._fake_instance()
+        me.side_effect = [(LISTING, ''), (STATS, ''), (STATS, ''), ('', '')]
+        conf = stubs.MockConf(lxd_kwargs={'migration_streams': 2})
+        with test.nested(
+            mock.patch.object(container_transfer, 'CONF', conf),
+            mock.patch.object(self.transfer.container_dir,
+                              'get_container_rootfs',
+                              mock.Mock(return_value='/fake/rootfs'))
+        ):
+            self.assertEqual(2 * 2097152,
+                             self.transfer.transfer(instance, 'fake-source'))
+        self.assertEqual(
+            mock.call('rsync', '-aHAX', '--numeric-ids', '--delete',
+                      '--stats', '-e', 'ssh -o BatchMode=yes',
+                      '--compress-level=0', '--bwlimit=0',
+                      '-r', '--files-from=-',
+                      'fake-source:/fake/rootfs/', '/fake/rootfs/',
+                      run_as_root=True, process_input='bin\nusr\n'),
+            me.call_args_list[1])
+        self.assertEqual(
+            mock.call('rsync', '--dirs', '--delete', '-lptgoDAX',
+                      '--numeric-ids', '-e', 'ssh -o BatchMode=yes',
+                      'fake-source:/fake/rootfs/', '/fake/rootfs/',
+                      run_as_root=True),
+            me.call_args_list[3])
+
+    @mock.patch('nova.utils.execute')
+    def test_transfer_single(self, me):
+        instance = stubs._fake_instance()
+        me.return_value = (STATS, '')
+        with test.nested(
+            mock.patch.object(container_transfer, 'CONF', stubs.MockConf()),
+            mock.patch.object(self.transfer.container_dir,
+                              'get_container_rootfs',
+                              mock.Mock(return_value='/fake/rootfs'))
+        ):
+            self.assertEqual(2097152,
+                             self.transfer.transfer(instance, 'fake-source'))
+        me.assert_called_once_with(
+            'rsync', '-aHAX', '--numeric-ids', '--delete', '--stats',
+            '-e', 'ssh -o BatchMode=yes', '--compress-level=0',
+            '--bwlimit=0', 'fake-source:/fake/rootfs/', '/fake/rootfs/',
+            run_as_root=True)
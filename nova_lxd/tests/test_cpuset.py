@@ -0,0 +1,42 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import ddt
+
+from nova import test
+
+from nova_lxd.nova.virt.lxd import cpuset
+from nova_lxd.tests import stubs
+
+
+@ddt.ddt
+class LXDTestCPUSet(test.NoDBTestCase):
+
+    @stubs.annotated_data(
+        ('empty', '', set()),
+        ('single', '3', set([3])),
+        ('ranges', '0-2,5,7-8\n', set([0, 1, 2, 5, 7, 8])),
+    )
+    def test_parse_cpu_list(self, tag, spec, expected):
+        self.assertEqual(expected, cpuset.parse_cpu_list(spec))
+
+    @stubs.annotated_data(
+        ('single', set([3]), '3-3'),
+        ('range', set([0, 1, 2]), '0-2'),
+        ('ranges', set([0, 1, 2, 5, 7, 8]), '0-2,5,7-8'),
+    )
+    def test_format_cpuset(self, tag, cpus, expected):
+        self.assertEqual(expected, cpuset.format_cpuset(cpus))
+        self.assertEqual(cpus, cpuset.parse_cpu_list(expected))
@@ -0,0 +1,110 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import os
+
+import ddt
+import fixtures
+import mock
+
+from nova import exception
+from nova import test
+
+from nova_lxd.nova.virt.lxd import download
+from nova_lxd.tests import stubs
+
+DATA = b''.join(bytes(bytearray([i] * 10)) for i in range(10))
+URL = 'http://images.example.com/fake-image'
+
+
+@ddt.ddt
+class LXDTestDownload(test.NoDBTestCase):
+
+    def setUp(self):
+        super(LXDTestDownload, self).setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(self.tempdir, 'fake-image-rootfs.tar.gz')
+        self.ranges = []
+        self.failures = set()
+
+        get_patcher = mock.patch.object(download.requests, 'get',
+                                        side_effect=self._get)
+        get_patcher.start()
+        self.addCleanup(get_patcher.stop)
+
+    def _get(self, url, stream, timeout, headers):
+        start, end = headers['Range'][len('bytes='):].split('-')
+        start, end = int(start), int(end)
+        self.ranges.append(start)
+        response = mock.Mock(status_code=206)
+        if start in self.failures:
+            response.status_code = 503
+        response.iter_content.return_value = [DATA[start:end + 1]]
+        return response
+
+    def _download(self, checksum=None):
+        return download.RangedDownload(
+            URL, self.path, len(DATA),
+            checksum=checksum or hashlib.md5(DATA).hexdigest(),
+            workers=3, chunk_size=30)
+
+    @stubs.annotated_data(
+        ('direct_url', {'direct_url': URL}, URL),
+        ('location', {'direct_url': 'rbd://pool/image',
+                      'locations': [{'url': 'file:///images/image'},
+                                    {'url': URL}]}, URL),
+        ('none', {'locations': [{'url': 'rbd://pool/image'}]}, None),
+    )
+    def test_get_url(self, tag, image_meta, expected):
+        self.assertEqual(expected, download.get_url(image_meta))
+
+    @stubs.annotated_data(
+        ('ranges', 200, {'Accept-Ranges': 'bytes',
+                         'Content-Length': '100'}, 100),
+        ('no_ranges', 200, {'Content-Length': '100'}, None),
+        ('error', 404, {}, None),
+    )
+    def test_probe(self, tag, status_code, headers, expected):
+        with mock.patch.object(download.requests, 'head') as head:
+            head.return_value = mock.Mock(status_code=status_code,
+                                          headers=headers)
+            self.assertEqual(expected, download.probe(URL))
+
+    def test_fetch(self):
+        self._download().fetch()
+        self.assertEqual([0, 30, 60, 90], sorted(self.ranges))
+        with open(self.path, 'rb') as fp:
+            self.assertEqual(DATA, fp.read())
+        self.assertFalse(os.path.exists(download.progress_path(self.path)))
+
+    def test_fetch_resume(self):
+        self.failures.add(60)
+        self.assertRaises(exception.NovaException, self._download().fetch)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertTrue(os.path.exists(download.progress_path(self.path)))
+
+        self.failures.clear()
+        self.ranges = []
+        self._download().fetch()
+        self.assertEqual([60], self.ranges)
+        with open(self.path, 'rb') as fp:
+            self.assertEqual(DATA, fp.read())
+
+    def test_fetch_checksum_mismatch(self):
+        self.assertRaises(exception.NovaException,
+                          self._download('0' * 32).fetch)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(download.progress_path(self.path)))
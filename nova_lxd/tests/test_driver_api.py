@@ -22,17 +22,20 @@ from pylxd import exceptions as lxd_exceptions
 import ddt
 import mock
 from oslo_config import cfg
+from oslo_utils import units
 import six
 
 from nova.compute import arch
 from nova.compute import hv_type
 from nova.compute import power_state
+from nova.compute import task_states
 from nova.compute import vm_mode
 from nova import exception
 from nova import test
 from nova.virt import fake
 from nova.virt import hardware
 
+from nova_lxd.nova.virt.lxd import container_disk
 from nova_lxd.nova.virt.lxd import container_ops
 from nova_lxd.nova.virt.lxd import driver
 from nova_lxd.nova.virt.lxd import host
@@ -72,7 +75,7 @@ class LXDTestDriver(test.NoDBTestCase):
     def test_capabilities(self):
         self.assertFalse(self.connection.capabilities['has_imagecache'])
         self.assertFalse(self.connection.capabilities['supports_recreate'])
-        self.assertFalse(
+        self.assertTrue(
             self.connection.capabilities['supports_migrate_to_same_host'])
 
     def test_init_host(self):
@@ -237,6 +240,23 @@ class LXDTestDriver(test.NoDBTestCase):
             unplug_vifs.assert_called_with(instance, network_info,
                                            True)
 
+    def test_destroy_resize_revert_in_place(self):
+        instance = stubs._fake_instance()
+        instance.task_state = task_states.RESIZE_REVERTING
+        instance.system_metadata = {container_ops.RESIZE_IN_PLACE: 'True'}
+        with test.nested(
+                mock.patch.object(session.LXDAPISession,
+                                  'container_destroy'),
+                mock.patch.object(container_ops.LXDContainerOperations,
+                                  'cleanup'),
+        ) as (
+                container_destroy,
+                cleanup
+        ):
+            self.connection.destroy(mock.Mock(), instance, mock.Mock())
+            self.assertFalse(container_destroy.called)
+            self.assertFalse(cleanup.called)
+
     @mock.patch('os.path.exists', mock.Mock(return_value=True))
     @mock.patch('shutil.rmtree')
     def test_cleanup(self, mr):
@@ -247,25 +267,48 @@ class LXDTestDriver(test.NoDBTestCase):
         mr.assert_called_once_with(
             '/fake/instances/path/fake-uuid')
 
-    @mock.patch('six.moves.builtins.open')
-    @mock.patch.object(container_ops.utils, 'execute')
-    @mock.patch('pwd.getpwuid', mock.Mock(return_value=mock.Mock(pw_uid=1234)))
-    @mock.patch('os.getuid', mock.Mock())
-    @mock.patch('os.path.exists', mock.Mock(return_value=True))
-    def test_get_console_output(self, me, mo):
+    def test_get_console_output(self):
         instance = stubs.MockInstance()
-        mo.return_value.__enter__.return_value = six.BytesIO(b'fake contents')
-        self.assertEqual(b'fake contents',
-                         self.connection.get_console_output({}, instance))
-        calls = [
-            mock.call('chown', '1234:1234',
-                      '/fake/lxd/root/containers/fake-uuid/console.log',
-                      run_as_root=True),
-            mock.call('chmod', '755',
-                      '/fake/lxd/root/containers/fake-uuid',
-                      run_as_root=True)
-        ]
-        self.assertEqual(calls, me.call_args_list)
+        with mock.patch.object(self.connection.container_ops.container_console,
+                               'get_console_output') as mg:
+            mg.return_value = b'fake contents'
+            self.assertEqual(b'fake contents',
+                             self.connection.get_console_output({}, instance))
+            mg.assert_called_once_with(instance)
+
+    def test_get_console_log(self):
+        instance = stubs.MockInstance()
+        with mock.patch.object(self.connection.container_ops.container_console,
+                               'get_console_log') as mg:
+            mg.return_value = (b'fake contents', 13)
+            self.assertEqual((b'fake contents', 13),
+                             self.connection.get_console_log({}, instance, 0))
+            mg.assert_called_once_with(instance, 0)
+
+    @mock.patch.object(driver.loopingcall, 'FixedIntervalLoopingCall')
+    def test_init_host_console_rotate(self, ml):
+        with mock.patch.object(driver.CONF.lxd,
+                               'console_log_rotate_interval', 60):
+            self.assertEqual(True, self.connection.init_host(None))
+        ml.assert_called_once_with(
+            self.connection.container_ops.rotate_console_logs)
+        ml.return_value.start.assert_called_once_with(60, initial_delay=60)
+
+    @mock.patch.object(driver.loopingcall, 'FixedIntervalLoopingCall')
+    def test_init_host_prewarm(self, ml):
+        with mock.patch.object(driver.CONF.lxd, 'prewarm_interval', 600):
+            self.assertEqual(True, self.connection.init_host(None))
+        ml.assert_called_once_with(
+            self.connection.container_ops.image.prewarm_images)
+        ml.return_value.start.assert_called_once_with(600,
+                                                      initial_delay=600)
+
+    def test_init_host_compression_fail(self):
+        conf = stubs.MockConf(lxd_kwargs={'image_compressor': 'zstd',
+                                          'snapshot_delta': True})
+        with mock.patch.object(driver.compression, 'CONF', conf):
+            self.assertRaises(exception.NovaException,
+                              self.connection.init_host, None)
 
     @mock.patch.object(host.compute_utils, 'get_machine_ips')
     @stubs.annotated_data(
@@ -285,8 +328,8 @@ class LXDTestDriver(test.NoDBTestCase):
         with test.nested(
                 mock.patch.object(session.LXDAPISession,
                                   'container_stop'),
-                mock.patch.object(self.connection.container_ops,
-                                  '_container_local_copy'),
+                mock.patch.object(session.LXDAPISession,
+                                  'container_move'),
                 mock.patch.object(session.LXDAPISession,
                                   'container_destroy'),
                 mock.patch.object(self.connection.container_ops,
@@ -294,16 +337,55 @@ class LXDTestDriver(test.NoDBTestCase):
 
         ) as (
                 container_stop,
-                container_local_copy,
+                container_move,
                 container_destroy,
                 spawn
         ):
             self.connection.rescue(context, instance, network_info,
                                    image_meta, 'secret')
-            self.assertTrue(container_stop)
-            self.assertTrue(container_local_copy)
-            self.assertTrue(container_destroy)
-            self.assertTrue(spawn)
+            container_stop.assert_called_once_with(
+                'fake-uuid', instance.host, instance)
+            container_move.assert_called_once_with(
+                'fake-uuid', {'name': 'fake-uuid-backup'}, instance)
+            self.assertFalse(container_destroy.called)
+            spawn.assert_called_once_with(
+                context, instance, image_meta, injected_files=None,
+                admin_password=None, network_info=network_info,
+                block_device_info=None, need_vif_plugged=False,
+                rescue=True)
+
+    def test_rescue_fail(self):
+        context = mock.Mock()
+        instance = stubs.MockInstance()
+        self.ml.container_defined.return_value = True
+        with test.nested(
+                mock.patch.object(session.LXDAPISession,
+                                  'container_stop'),
+                mock.patch.object(session.LXDAPISession,
+                                  'container_move'),
+                mock.patch.object(session.LXDAPISession,
+                                  'container_destroy'),
+                mock.patch.object(self.connection.container_ops,
+                                  'spawn')
+
+        ) as (
+                container_stop,
+                container_move,
+                container_destroy,
+                spawn
+        ):
+            spawn.side_effect = exception.NovaException
+            self.assertRaises(exception.NovaException,
+                              self.connection.rescue, context, instance,
+                              mock.Mock(), mock.Mock(), 'secret')
+            container_destroy.assert_called_once_with(
+                'fake-uuid', instance.host, instance)
+            self.assertEqual(
+                [mock.call('fake-uuid', {'name': 'fake-uuid-backup'},
+                           instance),
+                 mock.call('fake-uuid-backup', {'name': 'fake-uuid'},
+                           instance)],
+                container_move.call_args_list)
 
     def test_container_unrescue(self):
         instance = stubs.MockInstance()
@@ -312,16 +394,28 @@ class LXDTestDriver(test.NoDBTestCase):
                 mock.patch.object(session.LXDAPISession,
                                   'container_move'),
                 mock.patch.object(session.LXDAPISession,
-                                  'container_destroy')
+                                  'container_destroy'),
+                mock.patch.object(session.LXDAPISession,
+                                  'container_start')
         ) as (
                 container_move,
-                container_destroy
+                container_destroy,
+                container_start
         ):
             self.connection.unrescue(instance, network_info)
-            self.assertTrue(container_move)
-            self.assertTrue(container_destroy)
+            container_destroy.assert_called_once_with(
+                'fake-uuid', instance.host, instance)
+            container_move.assert_called_once_with(
+                'fake-uuid-backup', {'name': 'fake-uuid'}, instance)
+            container_start.assert_called_once_with('fake-uuid', instance)
 
     @mock.patch('socket.gethostname', mock.Mock(return_value='fake_hostname'))
+    @mock.patch.object(host.LXDHost, '_get_numa_topology',
+                       mock.Mock(return_value=None))
+    @mock.patch.object(container_disk.LXDContainerDisk, 'get_over_committed',
+                       mock.Mock(return_value=100 * units.Gi))
+    @mock.patch.object(container_disk.LXDContainerDisk, 'get_available',
+                       mock.Mock(return_value=None))
     @mock.patch('os.statvfs', return_value=mock.Mock(f_blocks=131072000,
                                                      f_bsize=8192,
                                                      f_bavail=65536000))
@@ -363,6 +457,7 @@ class LXDTestDriver(test.NoDBTestCase):
                     'hypervisor_version': '011',
                     'local_gb': 1000,
                     'local_gb_used': 500,
+                    'disk_available_least': 400,
                     'memory_mb': 10000,
                     'memory_mb_used': 8000,
                     'numa_topology': None,
@@ -383,6 +478,46 @@ class LXDTestDriver(test.NoDBTestCase):
                          mo.call_args_list)
         ms.assert_called_once_with('/fake/lxd/root')
 
+    @mock.patch.object(host.hardware, 'get_vcpu_pin_set',
+                       mock.Mock(return_value=set([0, 1, 2, 4])))
+    @mock.patch.object(host.numa, 'get_host_cells')
+    @mock.patch.object(host, 'objects')
+    def test_get_numa_topology(self, mo, mc):
+        mc.return_value = [
+            {'id': 0, 'cpus': set([0, 1, 4, 5]), 'memory': 8000,
+             'siblings': [set([0, 4]), set([1, 5])]},
+            {'id': 1, 'cpus': set([2, 3, 6, 7]), 'memory': 4000,
+             'siblings': [set([2, 6]), set([3, 7])]}]
+        with mock.patch('os.sysconf', mock.Mock(return_value=4096)):
+            topology = self.connection.host._get_numa_topology()
+        self.assertEqual(mo.NUMATopology.return_value, topology)
+        self.assertEqual(
+            [mock.call(id=0, cpuset=set([0, 1, 4]), memory=8000,
+                       cpu_usage=0, memory_usage=0, pinned_cpus=set(),
+                       siblings=[set([0, 4])],
+                       mempages=[mo.NUMAPagesTopology.return_value]),
+             mock.call(id=1, cpuset=set([2]), memory=4000,
+                       cpu_usage=0, memory_usage=0, pinned_cpus=set(),
+                       siblings=[],
+                       mempages=[mo.NUMAPagesTopology.return_value])],
+            mo.NUMACell.call_args_list)
+        mo.NUMAPagesTopology.assert_called_with(size_kb=4, total=1024000,
+                                                used=0)
+
+    @mock.patch.object(host.numa, 'get_host_cells',
+                       mock.Mock(return_value=[]))
+    def test_get_numa_topology_no_numa(self):
+        self.assertIsNone(self.connection.host._get_numa_topology())
+
+    def test_get_instance_disk_info(self):
+        instance = stubs._fake_instance()
+        with mock.patch.object(container_disk.LXDContainerDisk,
+                               'get_instance_disk_info') as mi:
+            self.assertEqual(
+                mi.return_value,
+                self.connection.get_instance_disk_info(instance))
+            mi.assert_called_once_with(instance)
+
     def test_container_reboot(self):
         instance = stubs._fake_instance()
         context = mock.Mock()
@@ -472,21 +607,12 @@ class LXDTestDriverNoops(test.NoDBTestCase):
 
     @ddt.data(
         'list_instance_uuids',
-        'get_diagnostics',
-        'get_instance_diagnostics',
-        'get_all_bw_counters',
         'get_all_volume_usage',
         'attach_volume',
         'detach_volume',
-        'finish_revert_migration',
         'soft_delete',
-        'post_live_migration_at_source',
         'check_instance_shared_storage_local',
         'check_instance_shared_storage_remote',
-        'check_can_live_migrate_destination',
-        'check_can_live_migrate_destination_cleanup',
-        'check_can_live_migrate_source',
-        'get_instance_disk_info',
         'poll_rebooting_instances',
         'host_power_action',
         'host_maintenance_mode',
@@ -510,7 +636,6 @@ class LXDTestDriverNoops(test.NoDBTestCase):
 
     @ddt.data(
         'post_interrupted_snapshot_cleanup',
-        'post_live_migration',
         'check_instance_shared_storage_cleanup',
         'manage_image_cache',
     )
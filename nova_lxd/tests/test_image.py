@@ -13,14 +13,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from nova import exception
 from nova import test
 import os
+import threading
 
 import ddt
 import fixtures
 import mock
 from oslo_concurrency import lockutils
 from oslo_config import fixture as config_fixture
+from oslo_utils import units
 
 
 from nova_lxd.nova.virt.lxd import image
@@ -117,3 +120,511 @@ class LXDTestContainerImage(test.NoDBTestCase):
                                                     instance,
                                                     image_meta))
             self.assertFalse(mock_image_manifest.called)
+
+    @mock.patch('os.path.exists', mock.Mock(return_value=False))
+    @mock.patch.object(image.image_delta, 'apply_delta')
+    def test_fetch_image_delta(self, apply_delta):
+        context = mock.Mock()
+        instance = stubs._fake_instance()
+        image_meta = {'id': 'delta_image',
+                      'properties': {'lxd_delta': 'true',
+                                     'lxd_parent_image': 'parent_image'}}
+        with test.nested(
+            mock.patch.object(image.IMAGE_API, 'get'),
+            mock.patch.object(image.IMAGE_API, 'download')
+        ) as (
+            image_get,
+            image_download
+        ):
+            image_get.return_value = {'id': 'parent_image'}
+            base_dir = self.image.container_dir.get_base_dir()
+            parent_path = os.path.join(base_dir,
+                                       'parent_image-rootfs.tar.gz')
+            path = os.path.join(base_dir, 'delta_image-rootfs.tar.gz')
+            self.image._fetch_image(context, image_meta, instance)
+            image_get.assert_called_once_with(context, 'parent_image')
+            self.assertEqual(
+                [mock.call(context, 'parent_image', dest_path=parent_path),
+                 mock.call(context, 'delta_image',
+                           dest_path=path + '.delta')],
+                image_download.call_args_list)
+            apply_delta.assert_called_once_with(
+                parent_path, path + '.delta', path)
+
+    def test_get_prewarm_images(self):
+        feed = os.path.join(self.tempdir, 'feed')
+        with open(feed, 'w') as fp:
+            fp.write('# most popular first\nimage-b 120\n\nimage-c\n')
+        with test.nested(
+            mock.patch.object(image.CONF.lxd, 'prewarm_images',
+                              ['image-a', 'image-b']),
+            mock.patch.object(image.CONF.lxd, 'prewarm_feed', feed)
+        ):
+            self.assertEqual(['image-a', 'image-b', 'image-c'],
+                             self.image._get_prewarm_images())
+
+    @mock.patch.object(image.LXDContainerImage, '_get_service_context')
+    def test_prewarm_images(self, mc):
+        with test.nested(
+            mock.patch.object(image.CONF.lxd, 'prewarm_images',
+                              ['image-a', 'image-b']),
+            mock.patch.object(image.CONF.lxd, 'prewarm_bandwidth', 512),
+            mock.patch.object(session.LXDAPISession, 'image_defined'),
+            mock.patch.object(image.IMAGE_API, 'get'),
+            mock.patch.object(self.image, 'setup_image')
+        ) as (
+            prewarm_images,
+            prewarm_bandwidth,
+            image_defined,
+            image_get,
+            setup_image
+        ):
+            image_defined.side_effect = [True, False]
+            self.image.prewarm_images()
+            image_get.assert_called_once_with(mc.return_value, 'image-b')
+            self.assertEqual(1, setup_image.call_count)
+            context, instance, image_meta = setup_image.call_args[0]
+            self.assertEqual('image-b', instance.image_ref)
+            self.assertEqual(image_get.return_value, image_meta)
+            self.assertEqual({'bandwidth': 512}, setup_image.call_args[1])
+
+    def test_prewarm_images_auth_fail(self):
+        with test.nested(
+            mock.patch.object(image.CONF.lxd, 'prewarm_images', ['image-a']),
+            mock.patch.object(image.ks_auth, 'load_from_conf_options'),
+            mock.patch.object(self.image, '_prewarm_image')
+        ) as (
+            prewarm_images,
+            load_auth,
+            prewarm_image
+        ):
+            load_auth.side_effect = Exception
+            self.image.prewarm_images()
+            self.assertFalse(prewarm_image.called)
+
+    @mock.patch.object(image.ks_session, 'Session')
+    @mock.patch.object(image.ks_auth, 'load_from_conf_options')
+    def test_get_service_context(self, load_auth, ks_session):
+        auth = load_auth.return_value
+        auth.get_user_id.return_value = 'nova'
+        auth.get_project_id.return_value = 'service'
+        auth.get_token.return_value = 'fake-token'
+        for i in range(2):
+            context = self.image._get_service_context()
+            self.assertEqual('nova', context.user_id)
+            self.assertEqual('service', context.project_id)
+            self.assertEqual('fake-token', context.auth_token)
+            self.assertTrue(context.is_admin)
+        load_auth.assert_called_once_with(image.CONF, 'lxd')
+        ks_session.assert_called_once_with(auth=auth)
+        auth.get_token.assert_called_with(ks_session.return_value)
+
+    @mock.patch('nova.context.get_admin_context')
+    @mock.patch.object(image.ks_auth, 'load_from_conf_options',
+                       mock.Mock(return_value=None))
+    def test_get_service_context_no_auth(self, mc):
+        self.assertEqual(mc.return_value,
+                         self.image._get_service_context())
+
+    def test_prewarm_image_fail(self):
+        with mock.patch.object(session.LXDAPISession,
+                               'image_defined') as image_defined:
+            image_defined.side_effect = Exception
+            self.assertEqual(None,
+                             self.image._prewarm_image(mock.Mock(),
+                                                       'image-a'))
+
+    @mock.patch('eventlet.sleep')
+    def test_download_throttled(self, ms):
+        path = os.path.join(self.tempdir, 'rootfs')
+        with test.nested(
+            mock.patch.object(image.IMAGE_API, 'download'),
+            mock.patch('time.time')
+        ) as (
+            image_download,
+            mock_time
+        ):
+            image_download.return_value = [b'0' * 1024, b'1' * 1024]
+            mock_time.return_value = 100
+            self.image._download_throttled(mock.Mock(), 'image-a', path, 1)
+        self.assertEqual(2048, os.path.getsize(path))
+        self.assertEqual([mock.call(1.0), mock.call(2.0)],
+                         ms.call_args_list)
+
+    @mock.patch('eventlet.sleep')
+    def test_download_throttled_lifted(self, ms):
+        path = os.path.join(self.tempdir, 'rootfs')
+        inflight = image.ImageImport(bandwidth=1)
+
+        def chunks():
+            yield b'0' * 1024
+            inflight.bandwidth = 0
+            yield b'1' * 1024
+
+        with test.nested(
+            mock.patch.object(image.IMAGE_API, 'download'),
+            mock.patch('time.time'),
+            mock.patch.dict(image._IMPORTS, {'image-a': inflight})
+        ) as (
+            image_download,
+            mock_time,
+            imports
+        ):
+            image_download.return_value = chunks()
+            mock_time.return_value = 100
+            self.image._download_throttled(mock.Mock(), 'image-a', path, 1)
+        self.assertEqual(2048, os.path.getsize(path))
+        self.assertEqual([mock.call(1.0)], ms.call_args_list)
+
+    @stubs.annotated_data(
+        ('copied', {}, ['abcdef'], 'abcdef'),
+        ('expected', {'lxd_fingerprint': 'abcdef'}, ['abcdef'], 'abcdef'),
+        ('mismatch', {'lxd_fingerprint': '123456'}, ['abcdef', 'abcdef'],
+         None),
+        ('second_peer', {}, [None, 'abcdef'], 'abcdef'),
+        ('missing', {}, [None, None], None),
+    )
+    def test_fetch_from_peers(self, tag, properties, fingerprints, copied):
+        instance = stubs._fake_instance()
+        image_meta = {'id': 'fake_image', 'properties': properties}
+        with test.nested(
+            mock.patch.object(image.CONF.lxd, 'image_peers',
+                              [image.CONF.host, 'peer-a', 'peer-b']),
+            mock.patch.object(session.LXDAPISession,
+                              'image_peer_fingerprint'),
+            mock.patch.object(session.LXDAPISession, 'image_copy_from_peer'),
+            mock.patch.object(session.LXDAPISession, 'create_alias')
+        ) as (
+            image_peers,
+            image_peer_fingerprint,
+            image_copy_from_peer,
+            create_alias
+        ):
+            image_peer_fingerprint.side_effect = fingerprints
+            self.assertEqual(copied,
+                             self.image._fetch_from_peers(instance,
+                                                          image_meta))
+            self.assertEqual(len(fingerprints),
+                             image_peer_fingerprint.call_count)
+            if copied:
+                peer = 'peer-a' if fingerprints[0] else 'peer-b'
+                image_copy_from_peer.assert_called_once_with(
+                    peer, 'abcdef', instance)
+                create_alias.assert_called_once_with(
+                    {'name': instance.image_ref, 'target': 'abcdef'},
+                    instance)
+            else:
+                self.assertFalse(image_copy_from_peer.called)
+
+    def test_fetch_from_peers_fail(self):
+        instance = stubs._fake_instance()
+        with test.nested(
+            mock.patch.object(image.CONF.lxd, 'image_peers',
+                              ['peer-a', 'peer-b']),
+            mock.patch.object(session.LXDAPISession,
+                              'image_peer_fingerprint'),
+            mock.patch.object(session.LXDAPISession, 'image_copy_from_peer'),
+            mock.patch.object(session.LXDAPISession, 'create_alias')
+        ) as (
+            image_peers,
+            image_peer_fingerprint,
+            image_copy_from_peer,
+            create_alias
+        ):
+            image_peer_fingerprint.return_value = 'abcdef'
+            image_copy_from_peer.side_effect = [Exception, None]
+            self.assertEqual('abcdef', self.image._fetch_from_peers(
+                instance, {'id': 'fake_image'}))
+            self.assertEqual(
+                [mock.call('peer-a', 'abcdef', instance),
+                 mock.call('peer-b', 'abcdef', instance)],
+                image_copy_from_peer.call_args_list)
+            create_alias.assert_called_once_with(
+                {'name': instance.image_ref, 'target': 'abcdef'}, instance)
+
+    def _import_locked(self, func, *args, **kwargs):
+        # Import images through func with the real image locks,
+        # stopping short of anything that talks to LXD. The import runs
+        # in a thread so a lock that never comes fails the test instead
+        # of hanging it.
+        self.image.lock_path = self.tempdir
+        errors = []
+
+        def _import():
+            try:
+                func(*args, **kwargs)
+            except Exception as ex:
+                errors.append(ex)
+
+        with test.nested(
+            mock.patch.object(session.LXDAPISession, 'image_defined',
+                              mock.Mock(return_value=False)),
+            mock.patch.object(self.image, '_notify_wait'),
+            mock.patch.object(self.image, '_alias_duplicate',
+                              mock.Mock(return_value=False)),
+            mock.patch.object(self.image, '_fetch_from_peers',
+                              mock.Mock(return_value=None)),
+            mock.patch.object(self.image, '_get_lxd_manifest'),
+            mock.patch.object(self.image, '_image_upload'),
+            mock.patch.object(self.image, '_setup_alias'),
+            mock.patch.object(self.image, '_setup_checksum_alias'),
+            mock.patch.object(image.utils, 'execute'),
+            mock.patch.object(os, 'unlink')
+        ):
+            thread = threading.Thread(target=_import)
+            thread.daemon = True
+            thread.start()
+            thread.join(10)
+        self.assertFalse(thread.is_alive(), 'image import deadlocked')
+        if errors:
+            raise errors[0]
+
+    @mock.patch('os.path.exists', mock.Mock(return_value=False))
+    @mock.patch('oslo_utils.fileutils.ensure_tree', mock.Mock())
+    @mock.patch.object(image.image_delta, 'apply_delta')
+    def test_setup_image_delta(self, apply_delta):
+        context = mock.Mock()
+        instance = stubs._fake_instance()
+        image_meta = {'id': instance.image_ref,
+                      'properties': {'lxd_delta': 'true',
+                                     'lxd_parent_image': 'parent_image'}}
+        with test.nested(
+            mock.patch.object(image.IMAGE_API, 'get',
+                              mock.Mock(return_value={'id': 'parent_image'})),
+            mock.patch.object(image.IMAGE_API, 'download')
+        ) as (
+            image_get,
+            image_download
+        ):
+            self._import_locked(self.image.setup_image, context, instance,
+                                image_meta)
+            self.assertEqual(2, image_download.call_count)
+        self.assertTrue(apply_delta.called)
+
+    @mock.patch('os.path.exists', mock.Mock(return_value=False))
+    @mock.patch('oslo_utils.fileutils.ensure_tree', mock.Mock())
+    def test_setup_image_concurrent(self):
+        context = mock.Mock()
+        instance_a = stubs._fake_instance()
+        instance_a.image_ref = 'image-a'
+        instance_b = stubs._fake_instance()
+        instance_b.image_ref = 'image-b'
+        fetched = []
+
+        def _fetch_image(context, image_meta, instance, bandwidth=0):
+            # Image b is imported while the import of image a still
+            # holds its lock.
+            if instance.image_ref == 'image-a':
+                self.image.setup_image(context, instance_b,
+                                       {'id': 'image-b'})
+            fetched.append(instance.image_ref)
+
+        with mock.patch.object(self.image, '_fetch_image',
+                               side_effect=_fetch_image):
+            self._import_locked(self.image.setup_image, context,
+                                instance_a, {'id': 'image-a'})
+        self.assertEqual(['image-b', 'image-a'], fetched)
+
+    @mock.patch('os.path.exists', mock.Mock(return_value=False))
+    @mock.patch('oslo_utils.fileutils.ensure_tree', mock.Mock())
+    def test_prewarm_image_concurrent_spawn(self):
+        context = mock.Mock()
+        spawn_instance = stubs._fake_instance()
+        spawn_instance.image_ref = 'image-b'
+        fetched = []
+
+        def _fetch_image(context, image_meta, instance, bandwidth=0):
+            # A spawn of image b comes in while the throttled pre-warm
+            # of image a holds its lock.
+            if instance.image_ref == 'image-a':
+                self.image.setup_image(context, spawn_instance,
+                                       {'id': 'image-b'})
+                self.assertEqual(512, image._IMPORTS['image-a'].bandwidth)
+            fetched.append((instance.image_ref, bandwidth))
+
+        with test.nested(
+            mock.patch.object(image.CONF.lxd, 'prewarm_bandwidth', 512),
+            mock.patch.object(image.IMAGE_API, 'get'),
+            mock.patch.object(self.image, '_fetch_image',
+                              side_effect=_fetch_image)
+        ):
+            self._import_locked(self.image._prewarm_image, context,
+                                'image-a')
+        self.assertEqual([('image-b', 0), ('image-a', 512)], fetched)
+
+    @stubs.annotated_data(
+        ('ok', None),
+        ('fail', Exception),
+    )
+    def test_setup_image_single_flight(self, tag, side_effect):
+        instance = stubs._fake_instance()
+        inflight = image.ImageImport()
+        with test.nested(
+            mock.patch.object(session.LXDAPISession, 'image_defined'),
+            mock.patch.object(self.image, '_import_image'),
+            mock.patch.dict(image._IMPORTS, {instance.image_ref: inflight})
+        ) as (
+            image_defined,
+            import_image,
+            imports
+        ):
+            image_defined.return_value = False
+            if side_effect:
+                inflight.event.send_exception(side_effect())
+                self.assertRaises(side_effect, self.image.setup_image,
+                                  mock.Mock(), instance, {})
+            else:
+                inflight.event.send()
+                self.image.setup_image(mock.Mock(), instance, {})
+            self.assertFalse(import_image.called)
+
+    @stubs.annotated_data(
+        ('spawn', 0, 0),
+        ('prewarm', 256, 512),
+    )
+    def test_setup_image_join_throttled(self, tag, bandwidth, expected):
+        instance = stubs._fake_instance()
+        inflight = image.ImageImport(bandwidth=512)
+        inflight.event.send()
+        with test.nested(
+            mock.patch.object(session.LXDAPISession, 'image_defined'),
+            mock.patch.dict(image._IMPORTS, {instance.image_ref: inflight})
+        ) as (
+            image_defined,
+            imports
+        ):
+            image_defined.return_value = False
+            with mock.patch.object(self.image, '_notify_wait') as notify:
+                self.image.setup_image(mock.Mock(), instance, {},
+                                       bandwidth=bandwidth)
+        self.assertEqual(expected, inflight.bandwidth)
+        self.assertEqual('import', notify.call_args[0][2])
+
+    @mock.patch('nova.rpc.get_notifier')
+    def test_notify_wait(self, get_notifier):
+        context = mock.Mock()
+        instance = stubs._fake_instance()
+        self.image._notify_wait(context, instance, 'lock', 1.5)
+        get_notifier.assert_called_once_with('compute')
+        get_notifier.return_value.info.assert_called_once_with(
+            context, 'compute.nova_lxd.image_wait',
+            {'image': instance.image_ref, 'host': image.CONF.host,
+             'waited_on': 'lock', 'wait': 1.5})
+
+    def test_setup_image_leader(self):
+        instance = stubs._fake_instance()
+        with test.nested(
+            mock.patch.object(session.LXDAPISession, 'image_defined'),
+            mock.patch.object(self.image, '_import_image')
+        ) as (
+            image_defined,
+            import_image
+        ):
+            image_defined.return_value = False
+            import_image.side_effect = Exception
+            self.assertRaises(Exception, self.image.setup_image,
+                              mock.Mock(), instance, {})
+            self.assertNotIn(instance.image_ref, image._IMPORTS)
+            import_image.side_effect = None
+            self.image.setup_image(mock.Mock(), instance, {})
+            self.assertEqual(2, import_image.call_count)
+            self.assertNotIn(instance.image_ref, image._IMPORTS)
+
+    @stubs.annotated_data(
+        ('ranged', 'http://images/fake', 100, True),
+        ('no_location', None, None, False),
+        ('no_ranges', 'http://images/fake', None, False),
+    )
+    def test_download_ranged(self, tag, url, size, expected):
+        instance = stubs._fake_instance()
+        with test.nested(
+            mock.patch.object(image.IMAGE_API, 'get'),
+            mock.patch.object(image.download, 'get_url'),
+            mock.patch.object(image.download, 'probe'),
+            mock.patch.object(image.download, 'RangedDownload')
+        ) as (
+            image_get,
+            get_url,
+            probe,
+            ranged_download
+        ):
+            image_get.return_value = {'id': 'fake_image',
+                                      'checksum': 'abcdef'}
+            get_url.return_value = url
+            probe.return_value = size
+            self.assertEqual(expected,
+                             self.image._download_ranged(mock.Mock(),
+                                                         instance, '/path'))
+            image_get.assert_called_once_with(mock.ANY, instance.image_ref,
+                                              include_locations=True)
+            if expected:
+                ranged_download.assert_called_once_with(
+                    url, '/path', size, checksum='abcdef', workers=0,
+                    chunk_size=64 * units.Mi)
+                ranged_download.return_value.fetch.assert_called_once_with()
+            else:
+                self.assertFalse(ranged_download.called)
+
+    def test_cleanup_image_partial_download(self):
+        image_meta = {'id': 'fake_image'}
+        with mock.patch.object(self.image.container_dir, 'base_dir',
+                               self.tempdir):
+            path = self.image.container_dir.get_container_rootfs_image(
+                image_meta)
+            for name in (path, image.download.progress_path(path)):
+                open(name, 'w').close()
+            self.image._cleanup_image(image_meta, stubs._fake_instance())
+            self.assertTrue(os.path.exists(path))
+
+    @stubs.annotated_data(
+        ('disabled', False, {'checksum': 'abc', 'size': 10}, None),
+        ('no_checksum', True, {'size': 10}, None),
+        ('enabled', True, {'checksum': 'abc', 'size': 10},
+         'checksum-abc-10'),
+    )
+    def test_checksum_alias(self, tag, dedup, image_meta, expected):
+        with mock.patch.object(image.CONF.lxd, 'image_dedup', dedup):
+            self.assertEqual(expected,
+                             self.image._checksum_alias(image_meta))
+
+    @stubs.annotated_data(
+        ('hit', 'abcdef', True),
+        ('miss', None, False),
+    )
+    def test_alias_duplicate(self, tag, target, expected):
+        instance = stubs._fake_instance()
+        with test.nested(
+            mock.patch.object(image.CONF.lxd, 'image_dedup', True),
+            mock.patch.object(session.LXDAPISession, 'alias_target'),
+            mock.patch.object(session.LXDAPISession, 'create_alias')
+        ) as (
+            image_dedup,
+            alias_target,
+            create_alias
+        ):
+            alias_target.return_value = target
+            self.assertEqual(expected, self.image._alias_duplicate(
+                instance, {'checksum': 'abc', 'size': 10}))
+            alias_target.assert_called_once_with('checksum-abc-10',
+                                                 instance)
+            if expected:
+                create_alias.assert_called_once_with(
+                    {'name': instance.image_ref, 'target': 'abcdef'},
+                    instance)
+            else:
+                self.assertFalse(create_alias.called)
+
+    def test_setup_checksum_alias_exists(self):
+        instance = stubs._fake_instance()
+        with test.nested(
+            mock.patch.object(image.CONF.lxd, 'image_dedup', True),
+            mock.patch.object(session.LXDAPISession, 'create_alias')
+        ) as (
+            image_dedup,
+            create_alias
+        ):
+            create_alias.side_effect = exception.NovaException
+            self.image._setup_checksum_alias(
+                instance, {'checksum': 'abc', 'size': 10}, 'abcdef')
+            create_alias.assert_called_once_with(
+                {'name': 'checksum-abc-10', 'target': 'abcdef'}, instance)
@@ -0,0 +1,129 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import io
+import json
+import os
+import tarfile
+
+import ddt
+import fixtures
+
+from nova import test
+
+from nova_lxd.nova.virt.lxd import image_delta
+from nova_lxd.tests import stubs
+
+
+def _add_file(tar, name, data, mtime=1000):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _add_dir(tar, name):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE
+    info.mode = 0o755
+    info.mtime = 1000
+    tar.addfile(info)
+
+
+def _add_link(tar, name, target):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.LNKTYPE
+    info.linkname = target
+    info.mtime = 1000
+    tar.addfile(info)
+
+
+@ddt.ddt
+class LXDTestImageDelta(test.NoDBTestCase):
+
+    def setUp(self):
+        super(LXDTestImageDelta, self).setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.parent = os.path.join(self.tempdir, 'parent-rootfs.tar.gz')
+        self.delta = os.path.join(self.tempdir, 'delta.tar.gz')
+        self.target = os.path.join(self.tempdir, 'target-rootfs.tar.gz')
+
+        with tarfile.open(self.parent, 'w:gz') as tar:
+            _add_dir(tar, './')
+            _add_dir(tar, './etc')
+            _add_file(tar, './etc/hostname', b'parent\n')
+            _add_file(tar, './etc/passwd', b'root\n')
+            _add_link(tar, './etc/passwd.link', './etc/passwd')
+            _add_file(tar, './etc/removed', b'gone\n')
+
+    def _export(self):
+        export = io.BytesIO()
+        with tarfile.open(fileobj=export, mode='w:gz') as tar:
+            _add_file(tar, 'metadata.yaml', b'architecture: x86_64\n')
+            _add_dir(tar, 'rootfs')
+            _add_dir(tar, 'rootfs/etc')
+            _add_file(tar, 'rootfs/etc/hostname', b'parent\n')
+            _add_file(tar, 'rootfs/etc/passwd', b'root\nuser\n', 2000)
+            _add_link(tar, 'rootfs/etc/passwd.link', 'rootfs/etc/passwd')
+            _add_file(tar, 'rootfs/etc/added', b'new\n')
+            _add_dir(tar, 'templates')
+        export.seek(0)
+        return export
+
+    def _contents(self, path):
+        contents = {}
+        with tarfile.open(path, 'r:*') as tar:
+            for member in tar:
+                name = os.path.normpath(member.name)
+                if member.isfile():
+                    contents[name] = tar.extractfile(member).read()
+                else:
+                    contents[name] = member.linkname or member.type
+        return contents
+
+    @stubs.annotated_data(
+        ('missing', {}, False),
+        ('no_properties', {'properties': None}, False),
+        ('full', {'properties': {'lxd_delta': 'false'}}, False),
+        ('delta', {'properties': {'lxd_delta': 'true'}}, True),
+    )
+    def test_is_delta(self, tag, image_meta, expected):
+        self.assertEqual(expected, image_delta.is_delta(image_meta))
+
+    def test_build_delta(self):
+        self.assertEqual(
+            {'changed': 3, 'deleted': 1},
+            image_delta.build_delta(self._export(), self.parent,
+                                    self.delta, 'parent-image'))
+        contents = self._contents(self.delta)
+        manifest = json.loads(
+            contents.pop(image_delta.DELTA_MANIFEST).decode('utf-8'))
+        self.assertEqual({'parent': 'parent-image',
+                          'deleted': ['etc/removed']}, manifest)
+        self.assertEqual({'etc/passwd': b'root\nuser\n',
+                          'etc/passwd.link': 'etc/passwd',
+                          'etc/added': b'new\n'}, contents)
+
+    def test_apply_delta(self):
+        image_delta.build_delta(self._export(), self.parent, self.delta,
+                                'parent-image')
+        image_delta.apply_delta(self.parent, self.delta, self.target)
+        self.assertEqual({'.': tarfile.DIRTYPE,
+                          'etc': tarfile.DIRTYPE,
+                          'etc/hostname': b'parent\n',
+                          'etc/passwd': b'root\nuser\n',
+                          'etc/passwd.link': 'etc/passwd',
+                          'etc/added': b'new\n'},
+                         self._contents(self.target))
@@ -0,0 +1,105 @@
+# Copyright 2015 Canonical Ltd
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import ddt
+import fixtures
+import mock
+
+from nova import test
+
+from nova_lxd.nova.virt.lxd import numa
+from nova_lxd.tests import stubs
+
+
+def _write(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fp:
+        fp.write(data)
+
+
+@ddt.ddt
+class LXDTestNUMA(test.NoDBTestCase):
+
+    def setUp(self):
+        super(LXDTestNUMA, self).setUp()
+        sysfs = self.useFixture(fixtures.TempDir()).path
+        self.node_dir = os.path.join(sysfs, 'node')
+        self.cpu_dir = os.path.join(sysfs, 'cpu')
+        for patcher in (mock.patch.object(numa, 'NODE_DIR', self.node_dir),
+                        mock.patch.object(numa, 'CPU_DIR', self.cpu_dir)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        nodes = {0: ('0-1,4-5', 8192000), 1: ('2-3,6-7', 4096000)}
+        for node, (cpus, memory) in nodes.items():
+            path = os.path.join(self.node_dir, 'node%d' % node)
+            _write(os.path.join(path, 'cpulist'), cpus + '\n')
+            _write(os.path.join(path, 'meminfo'),
+                   'Node %d MemTotal:       %d kB\n'
+                   'Node %d MemFree:        1024 kB\n'
+                   % (node, memory, node))
+        _write(os.path.join(self.node_dir, 'possible'), '0-1\n')
+        for cpu in range(8):
+            _write(os.path.join(self.cpu_dir, 'cpu%d' % cpu, 'topology',
+                                'thread_siblings_list'),
+                   '%d,%d\n' % (cpu % 4, cpu % 4 + 4))
+
+    def test_get_host_cells(self):
+        self.assertEqual(
+            [{'id': 0, 'cpus': set([0, 1, 4, 5]), 'memory': 8000,
+              'siblings': [set([0, 4]), set([1, 5])]},
+             {'id': 1, 'cpus': set([2, 3, 6, 7]), 'memory': 4000,
+              'siblings': [set([2, 6]), set([3, 7])]}],
+            numa.get_host_cells())
+
+    def test_get_host_cells_no_numa(self):
+        with mock.patch.object(numa, 'NODE_DIR', '/missing'):
+            self.assertEqual([], numa.get_host_cells())
+
+    @stubs.annotated_data(
+        ('none', None, None),
+        ('cell', [(1, 2, None)], (set([2, 7]), set([1]))),
+        ('whole_cell', [(1, 6, None)], (set([2, 3, 6, 7]), set([1]))),
+        ('pinned', [(0, 2, {0: 4, 1: 5})], (set([4, 5]), set([0]))),
+        ('cells', [(0, 1, None), (1, 1, {0: 2})],
+         (set([5, 2]), set([0, 1]))),
+    )
+    def test_get_placement(self, tag, cells, expected):
+        numa_topology = None
+        if cells is not None:
+            numa_topology = mock.Mock(instance_uuid='fake_uuid', cells=[
+                mock.Mock(id=cell_id, cpuset=set(range(vcpus)),
+                          cpu_pinning=pinning)
+                for cell_id, vcpus, pinning in cells])
+        self.assertEqual(expected, numa.get_placement(numa_topology))
+
+    def test_get_placement_spread(self):
+        placements = set()
+        for i in range(8):
+            numa_topology = mock.Mock(instance_uuid='uuid-%d' % i, cells=[
+                mock.Mock(id=0, cpuset=set([0]), cpu_pinning=None)])
+            cpus, mems = numa.get_placement(numa_topology)
+            self.assertEqual(1, len(cpus))
+            self.assertEqual(cpus, numa.get_placement(numa_topology)[0])
+            placements.update(cpus)
+        self.assertTrue(len(placements) > 1)
+
+    def test_get_placement_no_numa(self):
+        numa_topology = mock.Mock(cells=[mock.Mock(id=0, cpu_pinning=None)])
+        with mock.patch.object(numa, 'NODE_DIR', '/missing'):
+            self.assertIsNone(numa.get_placement(numa_topology))